@@ -0,0 +1,49 @@
+import os
+from contextlib import contextmanager
+
+import metrics
+
+
+def _file_permissions(file_path):
+    """
+    Return the permissions of the existing file,
+    or the default permissions for a new file.
+    """
+    try:
+        return os.stat(file_path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+@contextmanager
+def atomic_open(file_path, mode='w', **kwargs):
+    """
+    Open a temporary file next to file_path for writing and,
+    once the with block finishes without errors, rename it to file_path.
+    Readers see either the old or the new file, never a half-written one.
+    """
+    # tempfile is only imported by the commands that write files
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path) + '.',
+                                     suffix='.tmp')
+    try:
+        # mkstemp creates the file readable by the owner only, keep the permissions of a normal file
+        os.chmod(temp_path, _file_permissions(file_path))
+        with os.fdopen(fd, mode, **kwargs) as file:
+            yield file
+            file.flush()
+            os.fsync(file.fileno())
+            if metrics.get_metrics() is not None:
+                metrics.count('file_writes')
+                metrics.count('file_bytes_written', os.fstat(file.fileno()).st_size)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,169 @@
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+import omdb
+from istorage import IStorage
+
+# Returned instead of a movie when it couldn't be fetched (OMDb couldn't be reached or kept failing),
+# unlike None, which means OMDb answered that it doesn't know the movie
+FETCH_FAILED = object()
+
+
+class RateLimiter:
+    """
+    Lets at most `requests_per_second` callers through per second, shared between threads.
+    """
+
+    def __init__(self, requests_per_second):
+        self._interval = 1 / requests_per_second if requests_per_second else 0
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Block until the next request is allowed.
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self._interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class BatchImporter:
+    """
+    Fetches many movies from OMDb concurrently and adds them to the storage in one bulk write.
+    The requests share a pooled requests.Session, run on at most `max_workers` threads,
+    are limited to `requests_per_second` and are retried with exponential backoff
+    on connection errors, timeouts, and 429/5xx responses.
+    """
+
+    def __init__(self, storage: IStorage, max_workers=8, requests_per_second=10,
+                 retries=3, backoff=0.5, session=None, cache=None):
+        self._storage = storage
+        self._cache = cache
+        self._max_workers = max_workers
+        self._rate_limiter = RateLimiter(requests_per_second)
+        self._retries = retries
+        self._backoff = backoff
+        self._session = session or self._create_session(max_workers)
+
+    @staticmethod
+    def _create_session(max_workers):
+        """
+        Create a session that keeps one connection open per worker thread.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @staticmethod
+    def _is_retryable(error):
+        """
+        Tell whether a failed request may succeed when it is sent again.
+        """
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+            return error.response.status_code == 429 or error.response.status_code >= 500
+        return False
+
+    def _fetch(self, movie_name, use_cache=True):
+        """
+        Fetch a single movie, retrying transient errors.
+        With use_cache=False, the cached response is ignored, the new one is still cached.
+        Returns the (title, year, rating, poster_url) tuple, None if OMDb didn't find the movie,
+        or FETCH_FAILED if it couldn't be fetched.
+        """
+        if self._cache is not None and use_cache:
+            # Cached responses don't count against the rate limit
+            data = self._cache.get(movie_name)
+            if data is not None:
+                return omdb.parse_movie_data(data)
+
+        for attempt in range(self._retries + 1):
+            self._rate_limiter.wait()
+            try:
+                data = omdb.request_movie(movie_name, session=self._session)
+                if self._cache is not None:
+                    self._cache.put(movie_name, data)
+                return omdb.parse_movie_data(data)
+            except requests.exceptions.RequestException as error:
+                if attempt == self._retries or not self._is_retryable(error):
+                    metrics.count('omdb_errors', error=type(error).__name__)
+                    print(f"Failed to fetch data for the movie {movie_name}: {error}")
+                    return FETCH_FAILED
+                metrics.count('omdb_retries')
+                time.sleep(self._backoff * 2 ** attempt)
+        return FETCH_FAILED
+
+    def fetch_movies(self, titles, use_cache=True):
+        """
+        Fetch several movies concurrently.
+        Returns the (title, year, rating, poster_url) tuple, None (not found) or FETCH_FAILED
+        of each movie name, in the same order.
+        """
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            return list(executor.map(lambda movie_name: self._fetch(movie_name, use_cache), titles))
+
+    def import_titles(self, titles):
+        """
+        Fetch the given movie names and add all the found movies to the storage at once.
+        Returns the list of added (title, year, rating, poster_url) tuples
+        and the list of movie names that were not found or failed.
+        """
+        titles = [title.strip() for title in titles if title.strip()]
+        results = self.fetch_movies(titles)
+
+        found = [movie for movie in results if movie is not None and movie is not FETCH_FAILED]
+        failed = [title for title, movie in zip(titles, results) if movie is None or movie is FETCH_FAILED]
+        if found:
+            self._storage.add_movies(found)
+        return found, failed
+
+    def import_file(self, file_path):
+        """
+        Import the movie names listed in a text file, one per line.
+        """
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return self.import_titles(file.readlines())
+
+
+def main():
+    """
+    Import a file of movie names into movies.json:
+    python batch_import.py watchlist.txt
+    """
+    parser = argparse.ArgumentParser(description="Import a list of movies from OMDb.")
+    parser.add_argument('titles_file', help="text file with one movie name per line")
+    parser.add_argument('--storage', default='movies.json', help="JSON file to add the movies to")
+    parser.add_argument('--workers', type=int, default=8, help="number of concurrent requests")
+    parser.add_argument('--rate', type=float, default=10, help="maximum requests per second")
+    parser.add_argument('--retries', type=int, default=3, help="retries per movie on transient errors")
+    parser.add_argument('--cache', default='omdb_cache.db', help="SQLite file caching the OMDb responses")
+    args = parser.parse_args()
+
+    from storage_json import StorageJson
+    from omdb_cache import OmdbCache
+    cache = OmdbCache(args.cache)
+    importer = BatchImporter(StorageJson(args.storage), max_workers=args.workers,
+                             requests_per_second=args.rate, retries=args.retries, cache=cache)
+    found, failed = importer.import_file(args.titles_file)
+    print(f"Imported {len(found)} movies.")
+    if failed:
+        print(f"Could not import {len(failed)} movies: {', '.join(failed)}")
+    stats = cache.stats()
+    print(f"OMDb cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries.")
+
+
+if __name__ == "__main__":
+    main()
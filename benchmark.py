@@ -0,0 +1,517 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from urllib.parse import parse_qs, urlparse
+
+from rating_stats import percentile
+
+# The storages benchmarked: name -> extension of the movies file
+BACKENDS = {
+    'json': '.json',
+    'json-journal': '.json',
+    # The storage of the interactive app: the JSON movies kept in memory and searched through an index
+    'json-app': '.json',
+    'csv': '.csv',
+    'snap': '.snap',
+    'sqlite': '.db',
+}
+DEFAULT_SIZES = (1000, 10000)
+# Runs of the operations that go through the whole catalog (loading, saving, statistics, the website)
+DEFAULT_REPEAT = 5
+# Runs of the operations on one movie (adding, searching, fetching, ...)
+DEFAULT_SAMPLES = 200
+# An operation stops after this many seconds once it has MIN_SAMPLES runs, so 1M movies stay practical
+DEFAULT_MAX_SECONDS = 10
+MIN_SAMPLES = 3
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+# A result is a regression if its median time or peak memory grows by more than this fraction of the baseline...
+DEFAULT_TOLERANCE = 0.25
+# ...and by more than these amounts, so the noise of very fast operations isn't flagged
+MIN_REGRESSION_MS = 0.5
+MIN_REGRESSION_BYTES = 1024 * 1024
+# Movies per page of the paged website benchmarks
+SITE_PER_PAGE = 100
+
+WORDS = ('The', 'Silent', 'River', 'Night', 'Last', 'Summer', 'Dark', 'City', 'Love', 'Story',
+         'Lost', 'Highway', 'Blue', 'Velvet', 'Golden', 'Age', 'Return', 'Empire', 'Little', 'Women',
+         'Secret', 'Garden', 'Wild', 'Strawberries', 'Casablanca', 'Psycho', 'Control', 'Following')
+
+
+def synthetic_movies(count, seed=0):
+    """
+    Yield `count` made-up (title, details) pairs like the ones OMDb returns, always the same for a seed:
+    unique titles of a few words, and some movies with 'N/A' ratings, no poster or a note.
+    """
+    generator = random.Random(seed)
+    for number in range(count):
+        title = f"{' '.join(generator.sample(WORDS, generator.randint(1, 3)))} {number}"
+        details = {
+            'year': str(generator.randint(1920, 2024)),
+            'rating': f"{generator.randint(10, 99) / 10}/10" if generator.random() > 0.05 else 'N/A',
+            'poster_url': f"https://posters.example.com/{number}.jpg" if generator.random() > 0.05 else 'N/A',
+        }
+        if generator.random() < 0.1:
+            details['note'] = f"Watch again with {generator.choice(WORDS)}"
+        yield title, details
+
+
+class _StubOmdbHandler(BaseHTTPRequestHandler):
+    """
+    Answers OMDb requests (?t=<title>) with a made-up movie, or "Movie not found!" for titles starting with 'Unknown'.
+    """
+    # Keeps the connections open, like omdbapi.com, so the pooled sessions reuse them
+    protocol_version = 'HTTP/1.1'
+    # The headers and the body are written separately, without this each response waits for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        with server.counter_lock:
+            server.requests += 1
+            request_number = server.requests
+        if server.error_every and request_number % server.error_every == 0:
+            self._send(503, {'Response': 'False', 'Error': 'Service unavailable'})
+            return
+
+        title = parse_qs(urlparse(self.path).query).get('t', [''])[0]
+        if not title or title.startswith('Unknown'):
+            self._send(200, {'Response': 'False', 'Error': 'Movie not found!'})
+            return
+        generator = random.Random(title)
+        self._send(200, {
+            'Response': 'True',
+            'Title': title,
+            'Year': str(generator.randint(1920, 2024)),
+            'Ratings': [{'Source': 'Internet Movie Database', 'Value': f"{generator.randint(10, 99) / 10}/10"}],
+            'Poster': f"https://posters.example.com/{generator.randint(0, 10 ** 6)}.jpg",
+        })
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # The requests are counted, not logged
+        pass
+
+
+class StubOmdbServer:
+    """
+    A local stand-in for omdbapi.com, so fetching movies can be benchmarked without the network or an API key.
+    Each response is delayed by `latency` seconds, and every `error_every`-th request fails with 503
+    to exercise the retries. Used as a context manager, it points omdb.py to itself while it runs.
+    """
+
+    def __init__(self, latency=0.0, error_every=0):
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _StubOmdbHandler)
+        self._server.daemon_threads = True
+        self._server.latency = latency
+        self._server.error_every = error_every
+        self._server.requests = 0
+        self._server.counter_lock = threading.Lock()
+        self._thread = None
+        self._environment = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/"
+
+    @property
+    def requests(self):
+        """
+        The number of requests answered so far.
+        """
+        return self._server.requests
+
+    def __enter__(self):
+        import omdb
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self._environment = {name: os.environ.get(name) for name in ('OMDB_URL', 'API_KEY')}
+        os.environ['OMDB_URL'] = self.url
+        os.environ['API_KEY'] = 'benchmark'
+        omdb.api_settings.cache_clear()
+        return self
+
+    def __exit__(self, *exc_info):
+        import omdb
+        self._server.shutdown()
+        self._server.server_close()
+        for name, value in self._environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        omdb.api_settings.cache_clear()
+
+
+def open_backend(backend, file_path):
+    """
+    Open the storage a backend name stands for on a movies file.
+    """
+    if backend == 'json-journal':
+        from storage_json import StorageJson
+        return StorageJson(file_path, journal=True)
+    if backend == 'json-app':
+        from movie_cli import open_storage
+        return open_storage(file_path)
+    from movie_cli import open_file_storage
+    return open_file_storage(file_path)
+
+
+def close_storage(storage):
+    """
+    Close a storage that keeps a connection or an index to save.
+    """
+    if hasattr(storage, 'close'):
+        storage.close()
+
+
+@contextmanager
+def _app_output(verbose):
+    """
+    Send what the app prints while it's benchmarked to stderr, or nowhere.
+    """
+    if verbose:
+        with redirect_stdout(sys.stderr):
+            yield
+        return
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        yield
+
+
+def measure(run, samples, max_seconds=DEFAULT_MAX_SECONDS):
+    """
+    Time an operation: run() does it once and returns how many movies it went through.
+    After a first run that isn't counted (filling caches and indexes), it runs up to `samples` times,
+    or until max_seconds have passed, then once more with tracemalloc to measure its peak memory.
+    Returns the results: latency percentiles in ms, movies per second and the peak memory in bytes.
+    """
+    run()
+    latencies = []
+    movies = 0
+    deadline = time.perf_counter() + max_seconds
+    while len(latencies) < samples:
+        start = time.perf_counter()
+        movies += run()
+        latencies.append(time.perf_counter() - start)
+        if len(latencies) >= MIN_SAMPLES and time.perf_counter() > deadline:
+            break
+
+    # Measured apart from the timed runs, tracemalloc slows down every allocation
+    tracemalloc.start()
+    try:
+        run()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'samples': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p90_ms': percentile(latencies, 90) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'movies_per_second': movies / sum(latencies) if sum(latencies) else 0.0,
+        'peak_bytes': peak_bytes,
+    }
+
+
+def storage_operations(storage, size, seed):
+    """
+    Return the storage operations to benchmark: {name: (run, whole catalog?)}.
+    The reads come first. The movies added are deleted again, so the catalog keeps its size.
+    """
+    generator = random.Random(seed)
+    titles = [title for title, _ in storage.iter_movies()]
+    numbers = count()
+    added = []
+
+    def load_movies():
+        return len(storage.load_movies())
+
+    def search_movies():
+        # A word and part of another, like a user typing
+        query = generator.choice(titles).split()[0][:5]
+        storage.search_movies(query, limit=20)
+        return 1
+
+    def movie_statistics():
+        storage.movie_statistics()
+        return size
+
+    movies = None
+
+    def save_movies():
+        nonlocal movies
+        if movies is None:
+            # A plain dictionary, the snapshot's movies are decoded as they're used
+            movies = dict(storage.load_movies().items())
+        storage.save_movies(movies)
+        return len(movies)
+
+    def add_movie():
+        title = f"Benchmark Movie {next(numbers)}"
+        storage.add_movie(title, '2024', '7.5/10', 'N/A')
+        added.append(title)
+        return 1
+
+    def update_movie():
+        storage.update_movie(generator.choice(titles), f"Benchmark note {next(numbers)}")
+        return 1
+
+    def delete_movie():
+        storage.delete_movie(added.pop() if added else 'Benchmark Movie missing')
+        return 1
+
+    return {
+        'load_movies': (load_movies, True),
+        'search_movies': (search_movies, False),
+        'movie_statistics': (movie_statistics, True),
+        'save_movies': (save_movies, True),
+        'add_movie': (add_movie, False),
+        'update_movie': (update_movie, False),
+        'delete_movie': (delete_movie, False),
+    }
+
+
+def benchmark_storages(args, temp_dir, report):
+    """
+    Benchmark the storage operations of each backend and catalog size.
+    """
+    for size in args.sizes:
+        catalog = None
+        for backend in args.backends:
+            file_path = os.path.join(temp_dir, f"{backend}-{size}{BACKENDS[backend]}")
+            if catalog is None:
+                catalog = dict(synthetic_movies(size, args.seed))
+            open_backend('json' if backend.startswith('json') else backend, file_path).save_movies(catalog)
+
+            storage = open_backend(backend, file_path)
+            try:
+                with _app_output(args.verbose):
+                    for name, (run, whole_catalog) in storage_operations(storage, size, args.seed).items():
+                        if args.only and name not in args.only:
+                            continue
+                        report(f"{backend}/{size}/{name}",
+                               measure(run, args.repeat if whole_catalog else args.samples, args.max_seconds))
+            finally:
+                close_storage(storage)
+        catalog = None
+
+
+def benchmark_site(args, temp_dir, report):
+    """
+    Benchmark writing the website of each catalog size into the temporary folder: on one page,
+    split into pages, and split into pages generated incrementally with one movie changed before each run.
+    """
+    import movies_web_generator
+    for size in args.sizes:
+        movies = dict(synthetic_movies(size, args.seed))
+        titles = list(movies)
+        site_dir = os.path.join(temp_dir, f"site-{size}")
+        os.makedirs(site_dir, exist_ok=True)
+        generator = random.Random(args.seed)
+
+        def generate(file_name, **options):
+            def run():
+                movies_web_generator.generate_website(movies, os.path.join(site_dir, file_name),
+                                                      "Benchmark Movies", **options)
+                return len(movies)
+            return run
+
+        generate_incrementally = generate('incremental.html', per_page=SITE_PER_PAGE, incremental=True)
+
+        def change_and_generate():
+            # Like regenerating the site after a movie was updated, only its page is written again
+            movie = movies[generator.choice(titles)]
+            movie['rating'] = f"{generator.randint(10, 99) / 10}/10"
+            return generate_incrementally()
+
+        operations = {
+            'generate_website': generate('movies.html'),
+            'generate_website_paged': generate('paged.html', per_page=SITE_PER_PAGE),
+            'generate_website_incremental': change_and_generate,
+        }
+        with _app_output(args.verbose):
+            for name, run in operations.items():
+                if args.only and name not in args.only:
+                    continue
+                report(f"site/{size}/{name}", measure(run, args.repeat, args.max_seconds))
+
+
+def benchmark_omdb(args, temp_dir, report):
+    """
+    Benchmark fetching movies from the stub OMDb server: one at a time like the app,
+    and the batch import of a watchlist with its workers.
+    """
+    from batch_import import BatchImporter
+    from movie_app import MovieApp
+    from storage_json import StorageJson
+
+    generator = random.Random(args.seed)
+    numbers = count()
+    with StubOmdbServer(args.omdb_latency_ms / 1000, args.omdb_error_every) as server, \
+            _app_output(args.verbose):
+        def fetch_data():
+            MovieApp.fetch_data(f"{generator.choice(WORDS)} {next(numbers)}")
+            return 1
+
+        if not args.only or 'fetch_data' in args.only:
+            report('omdb/fetch_data', measure(fetch_data, args.samples, args.max_seconds))
+
+        import_titles = [f"{generator.choice(WORDS)} {number}" for number in range(args.import_titles)]
+
+        def import_movies():
+            storage = StorageJson(os.path.join(temp_dir, f"import-{next(numbers)}.json"))
+            BatchImporter(storage, max_workers=args.workers, requests_per_second=0,
+                          backoff=0.01).import_titles(import_titles)
+            return len(import_titles)
+
+        if not args.only or 'batch_import' in args.only:
+            report(f"omdb/{args.import_titles}/batch_import",
+                   measure(import_movies, args.repeat, args.max_seconds))
+        print(f"The stub OMDb server answered {server.requests} requests.", file=sys.stderr)
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Return a description of each result whose median time or peak memory
+    grew by more than `tolerance` (a fraction) compared with the baseline results.
+    """
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if (result['p50_ms'] > base['p50_ms'] * (1 + tolerance)
+                and result['p50_ms'] - base['p50_ms'] > MIN_REGRESSION_MS):
+            regressions.append(f"{key}: median {result['p50_ms']:.2f} ms, was {base['p50_ms']:.2f} ms")
+        if (result['peak_bytes'] > base['peak_bytes'] * (1 + tolerance)
+                and result['peak_bytes'] - base['peak_bytes'] > MIN_REGRESSION_BYTES):
+            regressions.append(f"{key}: peak memory {result['peak_bytes'] / 2 ** 20:.1f} MB, "
+                               f"was {base['peak_bytes'] / 2 ** 20:.1f} MB")
+    return regressions
+
+
+def _comma_list(convert=str):
+    """
+    Return an argparse type reading a comma-separated list.
+    """
+    return lambda text: [convert(item) for item in text.split(',') if item]
+
+
+def build_parser():
+    """
+    Create the parser of the benchmark's command line.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the storages, search, statistics, the website "
+                                                 "and fetching from OMDb on synthetic catalogs.")
+    parser.add_argument('--sizes', type=_comma_list(int), default=list(DEFAULT_SIZES),
+                        help="catalog sizes, e.g. 1000,10000,100000,1000000")
+    parser.add_argument('--backends', type=_comma_list(), default=list(BACKENDS),
+                        help=f"storages to benchmark, of {', '.join(BACKENDS)}")
+    parser.add_argument('--only', type=_comma_list(),
+                        help="operations to run, e.g. load_movies,search_movies,fetch_data")
+    parser.add_argument('--no-site', action='store_true', help="don't benchmark the website generation")
+    parser.add_argument('--no-omdb', action='store_true', help="don't benchmark fetching from the stub OMDb server")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help="runs of the operations going through the whole catalog")
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help="runs of the operations on one movie")
+    parser.add_argument('--max-seconds', type=float, default=DEFAULT_MAX_SECONDS,
+                        help=f"stop an operation after this time once it ran {MIN_SAMPLES} times")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic catalogs")
+    parser.add_argument('--omdb-latency-ms', type=float, default=0, help="delay of each stub OMDb response")
+    parser.add_argument('--omdb-error-every', type=int, default=0,
+                        help="make every n-th stub OMDb request fail with 503")
+    parser.add_argument('--import-titles', type=int, default=200, help="movie names in the batch import")
+    parser.add_argument('--workers', type=int, default=8, help="workers of the batch import")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help="results to compare with, if the file exists")
+    parser.add_argument('--save-baseline', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="flag a median time or peak memory that grew by more than this fraction")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="show what the app prints while benchmarked")
+    return parser
+
+
+def main():
+    """
+    Run the benchmarks, print a table of the results and compare them with the baseline:
+    python benchmark.py --sizes 1000,100000 --backends json,snap
+    Returns 1 if a result regressed.
+    """
+    args = build_parser().parse_args()
+    unknown = set(args.backends) - set(BACKENDS)
+    if unknown:
+        print(f"Unknown backends: {', '.join(sorted(unknown))}")
+        return 2
+
+    results = {}
+    # The app's own output is hidden while it's benchmarked, the results are written where stdout was
+    out = sys.stdout
+
+    def report(key, result):
+        results[key] = result
+        print(f"{key:<42} {result['samples']:>7} {result['p50_ms']:>10.2f} {result['p90_ms']:>10.2f} "
+              f"{result['p99_ms']:>10.2f} {result['movies_per_second']:>12.0f} {result['peak_bytes'] / 2 ** 20:>9.1f}",
+              file=out, flush=True)
+
+    print(f"{'operation':<42} {'samples':>7} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} "
+          f"{'movies/s':>12} {'peak MB':>9}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        benchmark_storages(args, temp_dir, report)
+        if not args.no_site:
+            benchmark_site(args, temp_dir, report)
+        if not args.no_omdb:
+            benchmark_omdb(args, temp_dir, report)
+
+    document = {
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(document, file, indent=2)
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare_with_baseline(results, baseline['results'], args.tolerance)
+        compared = len(set(results) & set(baseline['results']))
+        print(f"Compared {compared} results with {args.baseline} "
+              f"(Python {baseline.get('python')}, {baseline.get('platform')}).")
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as file:
+            json.dump(document, file, indent=2)
+        print(f"Saved the baseline to {args.baseline}.")
+
+    for regression in regressions:
+        print("REGRESSION:", regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+
+class _HeldLock:
+    """
+    The state of a lock file in this process: the lock is taken once
+    and counted, so code holding it can call code that takes it again.
+    """
+
+    def __init__(self):
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+
+# Lock file path -> _HeldLock
+_held_locks = {}
+_held_locks_guard = threading.Lock()
+
+
+def _lock_file(file):
+    """
+    Block until this process has the exclusive lock of the open lock file.
+    """
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        return
+    file.seek(0)
+    while True:
+        try:
+            # Retries for about 10 seconds before failing, then we try again
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(file):
+    """
+    Release the lock of the open lock file.
+    """
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive advisory lock on path (e.g. movies.json) while the with block runs,
+    shared by all the processes that lock the same path. The lock is taken on a separate
+    path + '.lock' file, so the locked file itself can be replaced by renaming a new file over it.
+    Taking the lock again in the same thread while holding it doesn't block.
+    """
+    lock_path = os.path.abspath(path) + '.lock'
+    with _held_locks_guard:
+        held = _held_locks.setdefault(lock_path, _HeldLock())
+    with held.thread_lock:
+        if held.depth == 0:
+            file = open(lock_path, 'a+b')
+            try:
+                _lock_file(file)
+            except BaseException:
+                file.close()
+                raise
+            held.file = file
+        held.depth += 1
+        try:
+            yield
+        finally:
+            held.depth -= 1
+            if held.depth == 0:
+                _unlock_file(held.file)
+                held.file.close()
+                held.file = None
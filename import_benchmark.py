@@ -0,0 +1,111 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# The commands timed, and the modules each of them must not import
+COMMANDS = {
+    'list': (['list', '--limit', '10', '--format', 'ndjson'],
+             ('requests', 'dotenv', 'colorama', 'PIL', 'sqlite3', 'movie_app', 'movies_web_generator')),
+    'search': (['search', 'casablanca', '--format', 'ndjson'],
+               ('requests', 'dotenv', 'colorama', 'PIL', 'sqlite3', 'movie_app', 'movies_web_generator')),
+    'stats': (['stats', '--format', 'json'],
+              ('requests', 'dotenv', 'colorama', 'PIL', 'sqlite3', 'movie_app', 'movies_web_generator')),
+    'stats-text': (['stats'],
+                   ('requests', 'dotenv', 'PIL', 'sqlite3', 'movies_web_generator')),
+}
+# Default budget for the modules a command imports (not counting Python's own startup), in milliseconds
+DEFAULT_MAX_IMPORT_MS = 25
+
+
+def parse_importtime(stderr):
+    """
+    Parse the output of `python -X importtime` into (module, cumulative microseconds, is top-level)
+    for the modules imported after Python's own startup (site).
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == 'site' and not name.startswith('  '):
+            # Everything before (and including) site is the interpreter starting up
+            modules = []
+            continue
+        modules.append((name.strip(), int(cumulative), not name.startswith('  ')))
+    return modules
+
+
+def run_command(script, storage_path, command_args):
+    """
+    Run one command with -X importtime.
+    Returns the wall-clock time in ms, the modules imported by the app in ms and the names of all modules imported.
+    Raises subprocess.CalledProcessError if the command fails, its time would mean nothing.
+    """
+    env = dict(os.environ)
+    # Time the app as it's installed, with the bytecode cached
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    arguments = [sys.executable, '-X', 'importtime', script, '--storage', storage_path] + command_args
+    start = time.perf_counter()
+    result = subprocess.run(arguments, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, arguments, result.stdout, result.stderr)
+    modules = parse_importtime(result.stderr)
+    import_ms = sum(cumulative for _, cumulative, top_level in modules if top_level) / 1000
+    return wall_ms, import_ms, {name for name, _, _ in modules}
+
+
+def main():
+    """
+    Time the startup of the commands and fail if one imports a heavy module it doesn't need
+    or its imports take longer than the budget:
+    python import_benchmark.py --runs 10 --max-import-ms 25
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the movie_cli commands.")
+    parser.add_argument('--runs', type=int, default=10, help="runs per command, the median is reported")
+    parser.add_argument('--max-import-ms', type=float, default=DEFAULT_MAX_IMPORT_MS,
+                        help="maximum median import time of a command")
+    parser.add_argument('--storage', default='movies.json', help="movies file to run the commands on (it's copied)")
+    args = parser.parse_args()
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # The commands may write a search index next to the movies, keep it out of the real folder
+        storage_path = os.path.join(temp_dir, os.path.basename(args.storage))
+        shutil.copy(args.storage, storage_path)
+
+        print(f"{'command':<12} {'wall ms':>9} {'imports ms':>11}")
+        for name, (command_args, forbidden) in COMMANDS.items():
+            try:
+                # A first run to cache the bytecode and the search index
+                run_command(script, storage_path, command_args)
+                runs = [run_command(script, storage_path, command_args) for _ in range(args.runs)]
+            except subprocess.CalledProcessError as error:
+                errors = [line for line in error.stderr.splitlines() if not line.startswith('import time:')]
+                failures.append(f"{name} exited with {error.returncode}" + (f": {errors[-1]}" if errors else ''))
+                print(f"{name:<12} {'failed':>9}")
+                continue
+            wall_ms = statistics.median(wall for wall, _, _ in runs)
+            import_ms = statistics.median(imports for _, imports, _ in runs)
+            print(f"{name:<12} {wall_ms:>9.1f} {import_ms:>11.1f}")
+
+            imported = set().union(*(modules for _, _, modules in runs))
+            unexpected = sorted({module.split('.')[0] for module in imported} & set(forbidden))
+            if unexpected:
+                failures.append(f"{name} imports {', '.join(unexpected)}")
+            if import_ms > args.max_import_ms:
+                failures.append(f"{name} imports take {import_ms:.1f} ms, more than {args.max_import_ms} ms")
+
+    for failure in failures:
+        print("FAIL:", failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
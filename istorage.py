@@ -1,7 +1,52 @@
+import heapq
+import os
+import random
+import time
+from itertools import islice
 from abc import ABC, abstractmethod
+from contextlib import contextmanager, nullcontext
+
+from file_lock import file_lock
+from rating_stats import RatingStats
+from sorted_index import SortedIndex, sort_value
+
+# How many times a change is tried without holding the lock while loading the movies,
+# before it's made while holding the lock
+MAX_SAVE_ATTEMPTS = 3
+# The values of a detail OMDb didn't know, a movie with one of them (or without the detail) is incomplete
+MISSING_VALUES = ('', 'N/A')
+
+
+def is_missing_value(value):
+    """
+    Tell whether a year, rating or poster URL is missing.
+    """
+    return value is None or value in MISSING_VALUES
+
+
+class ConflictError(Exception):
+    """
+    The stored movies were saved by somebody else since they were loaded.
+    """
 
 
 class IStorage(ABC):
+    # The movies loaded by the running batch(), changes are saved when it ends
+    _batch_movies = None
+    _batch_depth = 0
+    # The title index of the movies dictionary last searched or changed, see _title_index
+    _indexed_movies = None
+    _indexed_count = 0
+    _index = None
+    # The rating statistics of the movies dictionary last asked for, see _rating_stats
+    _stats_movies = None
+    _stats_count = 0
+    _stats = None
+    # The sorted indexes ({field: SortedIndex}) of the movies dictionary last asked for, see _sorted_index
+    _sorted_movies = None
+    _sorted_count = 0
+    _sorted_indexes = None
+
     @abstractmethod
     def load_movies(self):
         """
@@ -16,66 +61,438 @@ class IStorage(ABC):
         """
         pass
 
-    def add_movie(self, title, year, rating, poster_url):
+    def iter_movies(self, filter=None):
         """
-        Add a movie to a storage.
+        Yield the (title, details) pairs of the movies, or only of those for which
+        filter(title, details) is true. Storages that can read their movies one at a time
+        override it, so the movies don't have to be loaded all at once.
         """
-        movies = self.load_movies()
-        if title in movies:
+        for title, details in self.load_movies().items():
+            if filter is None or filter(title, details):
+                yield title, details
+
+    def storage_files(self):
+        """
+        Return the paths of the files this storage reads from.
+        Used to tell whether the stored data changed on disk.
+        """
+        return []
+
+    def _version_path(self):
+        """
+        Return the path of the file counting the writes of the storage, next to its first file.
+        """
+        files = self.storage_files()
+        return files[0] + '.version' if files else None
+
+    def _read_write_count(self):
+        """
+        Return how many times the storage was written, 0 if it never was.
+        """
+        path = self._version_path()
+        if path is None:
+            return 0
+        try:
+            with open(path, 'r', encoding='ascii') as file:
+                return int(file.read())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _count_write(self):
+        """
+        Count a write of the storage in its .version file, so its signature changes with every write.
+        Called by the storages while holding the lock, after the write.
+        """
+        path = self._version_path()
+        if path is None:
+            return
+        # Replaced at once, so readers never see a half-written count. The lock keeps the temporary file to us
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='ascii') as file:
+            file.write(str(self._read_write_count() + 1))
+        os.replace(temp_path, path)
+
+    def file_signature(self):
+        """
+        Return the inode, modification time and size of each storage file (None for files
+        that don't exist yet), and how many times the storage was written.
+        The modification time and size alone can come back to earlier values: two saves of the same size
+        within one tick of a coarse clock, with the inode numbers reused by the replaced files.
+        The write count changes with every write made by the storages.
+        """
+        signature = []
+        for path in self.storage_files():
+            try:
+                stat = os.stat(path)
+                signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        signature.append((self._read_write_count(),))
+        return tuple(signature)
+
+    def version(self):
+        """
+        Return a version tag (like an HTTP ETag) of the stored movies, which changes whenever they are saved.
+        Reading it takes no lock, it's the signature of the storage files and their write count.
+        """
+        return '-'.join('.'.join(f"{number:x}" for number in stat) if stat else 'none'
+                        for stat in self.file_signature())
+
+    def lock(self):
+        """
+        Return a context manager holding the exclusive lock of the storage,
+        shared with the other processes using the same files (see file_lock).
+        Only writers take it, readers rely on the files being replaced atomically.
+        """
+        files = self.storage_files()
+        return file_lock(files[0]) if files else nullcontext()
+
+    def save_movies_if_unchanged(self, movies, version):
+        """
+        Save the movies, unless somebody else saved the stored movies
+        since the given version() was read: then ConflictError is raised and nothing is saved.
+        """
+        with self.lock():
+            if self.version() != version:
+                raise ConflictError("The movies were changed by somebody else since they were loaded")
+            self.save_movies(movies)
+
+    def _title_index(self, movies):
+        """
+        Return the index of the movies' titles: casefolded title -> stored title.
+        It is built once per loaded movies dictionary and then kept up to date by the changes.
+        """
+        if movies is not self._indexed_movies or len(movies) != self._indexed_count:
+            index = {}
+            for stored_title in movies:
+                # Like a linear search, the first of several titles differing only in case wins
+                index.setdefault(stored_title.casefold(), stored_title)
+            self._index = index
+            self._indexed_movies = movies
+            self._indexed_count = len(movies)
+        return self._index
+
+    def _find_title(self, movies, title):
+        """
+        Return the stored title matching the given title case-insensitively,
+        or None if there's no such movie.
+        """
+        stored_title = self._title_index(movies).get(title.casefold())
+        if stored_title is not None and stored_title not in movies:
+            # The movies were changed without the index, build it again
+            self._indexed_movies = None
+            stored_title = self._title_index(movies).get(title.casefold())
+        return stored_title
+
+    def _rating_stats(self, movies):
+        """
+        Return the rating statistics of the movies, with each rating parsed once
+        per loaded movies dictionary and then kept up to date by the changes.
+        """
+        if movies is not self._stats_movies or len(movies) != self._stats_count:
+            self._stats = RatingStats.from_movies(movies)
+            self._stats_movies = movies
+            self._stats_count = len(movies)
+        return self._stats
+
+    def _sorted_index(self, movies, by):
+        """
+        Return the movies sorted by a field (see sorted_index.SORT_FIELDS),
+        sorted once per loaded movies dictionary and then kept up to date by the changes.
+        """
+        if movies is not self._sorted_movies or len(movies) != self._sorted_count:
+            self._sorted_indexes = {}
+            self._sorted_movies = movies
+            self._sorted_count = len(movies)
+        if by not in self._sorted_indexes:
+            self._sorted_indexes[by] = SortedIndex.from_movies(by, movies)
+        return self._sorted_indexes[by]
+
+    def _movie_changed(self, movies, title, old_details):
+        """
+        Update the rating statistics and the sorted indexes after a movie was added
+        (old_details is None), changed or removed from the movies.
+        """
+        details = movies.get(title)
+        if movies is self._stats_movies:
+            if details is None:
+                self._stats.remove(title)
+            else:
+                self._stats.add(title, details.get('rating'))
+            self._stats_count = len(movies)
+        if movies is self._sorted_movies:
+            for index in self._sorted_indexes.values():
+                if old_details is not None:
+                    index.remove(title, old_details)
+                if details is not None:
+                    index.add(title, details)
+            self._sorted_count = len(movies)
+
+    def _apply_add_movie(self, movies, title, year, rating, poster_url):
+        """
+        Add a movie to the movies dictionary,
+        or fill in its missing details if it is already there.
+        Returns the title the movie is stored under.
+        """
+        stored_title = self._find_title(movies, title)
+        if stored_title is not None:
             print(f"Oh hunny, the movie {title} is already there, pick another movie.")
+            details = movies[stored_title]
+            old_details = dict(details)
             # Update only if necessary
-            if not movies[title].get('year'):
-                movies[title]['year'] = year
-            if not movies[title].get('rating'):
-                movies[title]['rating'] = rating
-            if not movies[title].get('poster_url'):
-                movies[title]['poster_url'] = poster_url
-        else:
-            # Add new movie
-            movies[title] = {
-                'year': year,
-                'rating': rating,
-                'poster_url': poster_url
-            }
+            if not details.get('year'):
+                details['year'] = year
+            if not details.get('rating'):
+                details['rating'] = rating
+            if not details.get('poster_url'):
+                details['poster_url'] = poster_url
+            if details != old_details:
+                self._movie_changed(movies, stored_title, old_details)
+            return stored_title
 
-        self.save_movies(movies)
+        # Add new movie
+        movies[title] = {
+            'year': year,
+            'rating': rating,
+            'poster_url': poster_url
+        }
+        self._index[title.casefold()] = title
+        self._indexed_count = len(movies)
+        self._movie_changed(movies, title, None)
+        return title
 
-    def delete_movie(self, title):
+    def _apply_refresh_movie(self, movies, stored_title, year, rating, poster_url):
         """
-        Delete a movie from the storage.
+        Replace a movie's year, rating and poster URL with newly fetched ones,
+        keeping the stored value of each one that is missing from the fetched movie.
+        Returns whether the movie changed.
         """
-        movies = self.load_movies()
-        title_to_delete = None
+        details = movies[stored_title]
+        old_details = dict(details)
+        for key, value in (('year', year), ('rating', rating), ('poster_url', poster_url)):
+            if not is_missing_value(value):
+                details[key] = value
+        if details == old_details:
+            return False
+        self._movie_changed(movies, stored_title, old_details)
+        return True
 
-        # Convert the input title to lowercase once for comparison
-        title_lower = title.lower()
+    def _remove_movie(self, movies, stored_title):
+        """
+        Remove a movie from the movies dictionary and the indexes.
+        """
+        old_details = movies.pop(stored_title)
+        self._movie_changed(movies, stored_title, old_details)
+        if movies is not self._indexed_movies:
+            return
+        key = stored_title.casefold()
+        if self._index.get(key) == stored_title:
+            del self._index[key]
+        self._indexed_count = len(movies)
+        if len(self._index) != len(movies):
+            # Another title differing only in case was hidden by the removed one
+            self._indexed_movies = None
 
-        # Find the actual title in a case-insensitive manner
-        for stored_title in movies.keys():
-            if stored_title.lower() == title.lower():
-                title_to_delete = stored_title
-                break
+    @contextmanager
+    def batch(self):
+        """
+        Group several changes, so the storage is loaded once and saved once:
 
-        if title_to_delete:
-            del movies[title_to_delete]
-            self.save_movies(movies)
-            return True
+            with storage.batch():
+                storage.add_movie(...)
+                storage.delete_movie(...)
+
+        If the block raises an exception, none of its changes are saved.
+        """
+        if self._batch_depth:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+            return
+        # Nobody else can save while the batch runs, so its changes can't conflict
+        with self.lock():
+            self._batch_movies = self.load_movies()
+            self._batch_depth = 1
+            try:
+                yield self
+                self.save_movies(self._batch_movies)
+            finally:
+                self._batch_depth = 0
+                self._batch_movies = None
+
+    def _change_movies(self, change):
+        """
+        Apply change(movies), which returns its result and whether it changed the movies,
+        to the stored movies and return the result.
+        In a batch, the batch's movies are changed and saved when it ends. Otherwise the movies
+        are loaded without a lock and saved only if nobody else saved them in the meantime,
+        or loaded and changed again, up to MAX_SAVE_ATTEMPTS times. If the other writers keep winning,
+        the change is made while holding the lock, so it's never lost.
+        """
+        if self._batch_movies is not None:
+            return change(self._batch_movies)[0]
+
+        for attempt in range(MAX_SAVE_ATTEMPTS):
+            # The version is read first, if the movies are saved before they're loaded the save is only retried
+            version = self.version()
+            movies = self.load_movies()
+            result, changed = change(movies)
+            if not changed:
+                return result
+            try:
+                self.save_movies_if_unchanged(movies, version)
+                return result
+            except ConflictError:
+                # Wait a little, so the writers don't collide again
+                time.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+
+        with self.lock():
+            movies = self.load_movies()
+            result, changed = change(movies)
+            if changed:
+                self.save_movies(movies)
+            return result
+
+    def add_movie(self, title, year, rating, poster_url):
+        """
+        Add a movie to a storage.
+        """
+        self._change_movies(lambda movies: (self._apply_add_movie(movies, title, year, rating, poster_url), True))
 
-        return False
+    def add_movies(self, movies_to_add):
+        """
+        Add several movies, given as (title, year, rating, poster_url) tuples,
+        with a single load and a single save of the storage.
+        """
+        with self.batch():
+            for title, year, rating, poster_url in movies_to_add:
+                self.add_movie(title, year, rating, poster_url)
+
+    def delete_movie(self, title):
+        """
+        Delete a movie from the storage.
+        """
+        def delete(movies):
+            # Find the actual title in a case-insensitive manner
+            title_to_delete = self._find_title(movies, title)
+            if title_to_delete:
+                self._remove_movie(movies, title_to_delete)
+                return True, True
+            return False, False
+
+        return self._change_movies(delete)
+
+    def delete_movies(self, titles):
+        """
+        Delete several movies with a single load and a single save of the storage.
+        Returns the titles that were found and deleted.
+        """
+        with self.batch():
+            return [title for title in titles if self.delete_movie(title)]
 
     def update_movie(self, title, note):
         """
         Update a movie with a note.
         """
+        def update(movies):
+            # Find the movie to update in a case-insensitive manner
+            movie_title = self._find_title(movies, title)
+            if movie_title:
+                movies[movie_title]['note'] = note
+                return True, True
+            return False, False
+
+        return self._change_movies(update)
+
+    def refresh_movie(self, title, year, rating, poster_url):
+        """
+        Replace a movie's year, rating and poster URL with newly fetched ones (see _apply_refresh_movie),
+        unlike add_movie, which only fills in the empty ones.
+        Returns whether the movie was found.
+        """
+        def refresh(movies):
+            stored_title = self._find_title(movies, title)
+            if stored_title is None:
+                return False, False
+            return True, self._apply_refresh_movie(movies, stored_title, year, rating, poster_url)
+
+        return self._change_movies(refresh)
+
+    def update_movies(self, notes):
+        """
+        Update several movies with notes, given as a {title: note} dictionary,
+        with a single load and a single save of the storage.
+        Returns the titles that were found and updated.
+        """
+        with self.batch():
+            return [title for title, note in notes.items() if self.update_movie(title, note)]
+
+    def get_movie(self, title):
+        """
+        Return the (title, details) pair of the movie with the given title, compared case-insensitively,
+        or None if there's no such movie.
+        """
         movies = self.load_movies()
-        # Convert title to lowercase for case-insensitive matching
-        title_lower = title.lower()
+        # The exact title is found without indexing all the titles (e.g. a snapshot's binary search)
+        if title in movies:
+            return title, movies[title]
+        stored_title = self._find_title(movies, title)
+        return (stored_title, movies[stored_title]) if stored_title is not None else None
 
-        for movie_title in list(movies.keys()):
-            if movie_title.lower() == title_lower:
-                # Found the movie to update
-                movies[movie_title]['note'] = note
-                self.save_movies(movies)
-                return True
+    def search_movies(self, query, limit=None):
+        """
+        Return the (title, details) pairs of the movies whose title contains the query,
+        ignoring case. At most `limit` movies are returned if a limit is given.
+        """
+        query_lower = query.lower()
+        return list(islice(self.iter_movies(lambda title, details: query_lower in title.lower()), limit))
 
-        return False
+    def top_movies(self, limit=10, by='rating'):
+        """
+        Return the (title, details) pairs of the `limit` movies with the highest rating or year
+        (or the last titles), highest first. Movies without a valid value are left out.
+        """
+        movies = self.load_movies()
+        if movies is self._sorted_movies and by in self._sorted_indexes:
+            titles = self._sorted_index(movies, by).top(limit)
+        else:
+            # Without a sorted index yet, picking the top movies with a heap is cheaper than sorting
+            values = ((sort_value(by, title, details), title) for title, details in movies.items())
+            titles = [title for _, title in heapq.nlargest(
+                limit, (entry for entry in values if entry[0] is not None))]
+        return [(title, movies[title]) for title in titles]
+
+    def movies_page(self, by='title', limit=20, cursor=None, descending=False):
+        """
+        Return a page of the (title, details) pairs of the movies sorted by title, rating or year,
+        and the cursor to pass to get the next page (None after the last page).
+        Movies without a valid value are left out. Descending order is the exact reverse
+        of ascending order, so movies with the same value come in reverse title order.
+        """
+        movies = self.load_movies()
+        titles, next_cursor = self._sorted_index(movies, by).page(limit, cursor, descending)
+        return [(title, movies[title]) for title in titles], next_cursor
+
+    def movies_in_range(self, by='year', low=None, high=None):
+        """
+        Return the (title, details) pairs of the movies with low <= value <= high
+        in ascending order, e.g. movies_in_range('year', 1990, 1999) or movies_in_range('rating', 8).
+        """
+        movies = self.load_movies()
+        return [(title, movies[title]) for title in self._sorted_index(movies, by).in_range(low, high)]
+
+    def movie_statistics(self):
+        """
+        Return statistics about the movie ratings as a dictionary with the keys
+        'average', 'median', 'best_rating', 'best_movies', 'worst_rating', 'worst_movies',
+        'percentiles' ({25: ..., 75: ..., 90: ...}), 'histogram' ({7: number of movies rated 7 to 7.9, ...})
+        and 'skipped' (the ratings that are not valid numbers).
+        The rating values are None (and the percentiles and histogram empty) if no movie has a valid rating.
+        Returns None if there are no movies at all.
+        """
+        movies = self.load_movies()
+        if not movies:
+            return None
+        return self._rating_stats(movies).summary()
@@ -1,16 +1,39 @@
-from movie_app import MovieApp
-from storage_json import StorageJson
+import sys
 
 
 def main():
+    # With a command (e.g. `python main.py list --format ndjson`), run just that command,
+    # importing only what the command needs
+    if len(sys.argv) > 1:
+        import movie_cli
+        sys.exit(movie_cli.main(sys.argv[1:]))
+
+    import metrics
+    from movie_app import MovieApp
+    from storage_json import StorageJson
+    from storage_cache import CachedStorage
+    from search_index import SearchableStorage
+    from omdb_cache import OmdbCache
+
     # Create a StorageJson object with the desired JSON file
-    storage = StorageJson('movies.json')
+    # and keep its movies in memory between the commands,
+    # searching them through an index saved in movies.json.search
+    storage = SearchableStorage(CachedStorage(StorageJson('movies.json')))
+
+    # Create a MovieApp object with the storage object,
+    # the OMDb responses are cached so adding a movie again doesn't call the API
+    movie_app = MovieApp(storage, OmdbCache('omdb_cache.db'))
 
-    # Create a MovieApp object with the StorageJson object
-    movie_app = MovieApp(storage)
+    # Time the commands if MOVIES_METRICS (or MOVIES_PROFILE, MOVIES_TRACE_MEMORY) is set
+    metrics_file = metrics.enable_from_environment()
 
-    # Run the app
-    movie_app.run()
+    # Run the app, and save the search index (and the metrics) when it exits
+    try:
+        movie_app.run()
+    finally:
+        storage.close()
+        if metrics_file:
+            metrics.write(metrics_file)
 
 
 # Ensure the main function is called when this file is executed
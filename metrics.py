@@ -0,0 +1,312 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# The environment variables that turn the metrics on, for the interactive app and the commands:
+# the file the metrics are written to (.prom for the Prometheus text format, anything else for JSON),
+# a folder to write a cProfile profile of each command to, and whether to trace each command's memory
+METRICS_FILE_VARIABLE = 'MOVIES_METRICS'
+PROFILE_DIR_VARIABLE = 'MOVIES_PROFILE'
+TRACE_MEMORY_VARIABLE = 'MOVIES_TRACE_MEMORY'
+# The prefix of the metric names in the Prometheus format
+PROMETHEUS_PREFIX = 'movies_'
+# How many of the lines allocating the most memory are printed per command when tracing the memory
+TRACE_MEMORY_TOP_LINES = 10
+
+# Returned by timer() while the metrics are off, entering it does nothing
+_DISABLED = nullcontext()
+
+
+class Metrics:
+    """
+    The timers, counters and gauges of this process, each identified by a name and labels.
+    A timer keeps how many times it ran, the total and the longest time in seconds.
+    """
+
+    def __init__(self, profile_dir=None, trace_memory=False):
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.started_at = time.time()
+        # (name, labels) -> [count, total seconds, max seconds]
+        self.timers = {}
+        # (name, labels) -> value
+        self.counters = {}
+        self.gauges = {}
+        # The OMDb requests and the poster downloads are counted from worker threads
+        self._lock = threading.Lock()
+        self._profile_numbers = {}
+
+    def observe(self, name, seconds, labels=()):
+        """
+        Record one run of a timer.
+        """
+        key = (name, labels)
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                self.timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def count(self, name, value=1, labels=()):
+        """
+        Add to a counter.
+        """
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, labels=()):
+        """
+        Set a gauge to its current value.
+        """
+        with self._lock:
+            self.gauges[(name, labels)] = value
+
+    def next_profile_path(self, command):
+        """
+        Return a new file path in the profile folder for a profile of the command.
+        """
+        with self._lock:
+            number = self._profile_numbers[command] = self._profile_numbers.get(command, 0) + 1
+        return os.path.join(self.profile_dir, f"{command}-{os.getpid()}-{number}.prof")
+
+    def to_dict(self):
+        """
+        Return the metrics as a JSON-friendly dictionary.
+        """
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'timers': [{'name': name, 'labels': dict(labels), 'count': count,
+                            'total_seconds': total, 'max_seconds': longest}
+                           for (name, labels), (count, total, longest) in sorted(self.timers.items())],
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+            }
+
+    def to_prometheus(self):
+        """
+        Return the metrics in the Prometheus text format: the timers as summaries in seconds
+        (with their longest time as a _max gauge), the counters with the _total suffix, and the gauges.
+        """
+        lines = []
+
+        def add(metric_type, name, entries):
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}{name} {metric_type}")
+            for suffix, labels, value in entries:
+                lines.append(f"{PROMETHEUS_PREFIX}{name}{suffix}{_prometheus_labels(labels)} {value!r}")
+
+        with self._lock:
+            for name in sorted({name for name, _ in self.timers}):
+                timers = sorted((labels, timer) for (timer_name, labels), timer in self.timers.items()
+                                if timer_name == name)
+                add('summary', f"{name}_seconds",
+                    [entry for labels, (count, total, _) in timers
+                     for entry in (('_count', labels, count), ('_sum', labels, total))])
+                add('gauge', f"{name}_seconds_max", [('', labels, longest) for labels, (_, _, longest) in timers])
+            for name in sorted({name for name, _ in self.counters}):
+                add('counter', f"{name}_total",
+                    sorted(('', labels, value) for (counter_name, labels), value in self.counters.items()
+                           if counter_name == name))
+            for name in sorted({name for name, _ in self.gauges}):
+                add('gauge', name,
+                    sorted(('', labels, value) for (gauge_name, labels), value in self.gauges.items()
+                           if gauge_name == name))
+        return '\n'.join(lines) + '\n'
+
+
+def _prometheus_labels(labels):
+    """
+    Format labels ((name, value) pairs) as {name="value",...} with the values escaped.
+    """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+# The metrics of this process, None while they're off
+_metrics = None
+
+
+def enable(profile_dir=None, trace_memory=False):
+    """
+    Start collecting metrics. With profile_dir, each command is profiled with cProfile
+    into a file of that folder, and with trace_memory, each command's peak memory is measured with tracemalloc.
+    Returns the metrics.
+    """
+    global _metrics
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+    _metrics = Metrics(profile_dir, trace_memory)
+    return _metrics
+
+
+def disable():
+    """
+    Stop collecting metrics and drop the collected ones.
+    """
+    global _metrics
+    _metrics = None
+
+
+def get_metrics():
+    """
+    Return the collected metrics, or None while they're off.
+    """
+    return _metrics
+
+
+def enable_from_environment():
+    """
+    Start collecting metrics if MOVIES_METRICS, MOVIES_PROFILE or MOVIES_TRACE_MEMORY is set.
+    Returns the file to write the metrics to, or None.
+    """
+    metrics_file = os.environ.get(METRICS_FILE_VARIABLE) or None
+    profile_dir = os.environ.get(PROFILE_DIR_VARIABLE) or None
+    trace_memory = os.environ.get(TRACE_MEMORY_VARIABLE, '') not in ('', '0')
+    if metrics_file or profile_dir or trace_memory:
+        enable(profile_dir, trace_memory)
+    return metrics_file
+
+
+def _labels(labels):
+    """
+    Return keyword labels as a hashable, sorted tuple of (name, value) pairs.
+    """
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+class _Timer:
+    """
+    Records the time its with block takes in a timer of the metrics.
+    """
+
+    __slots__ = ('_metrics', '_name', '_labels', '_start')
+
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._metrics.observe(self._name, time.perf_counter() - self._start, self._labels)
+
+
+def timer(name, **labels):
+    """
+    Return a context manager timing its with block, e.g. with metrics.timer('omdb_request'): ...
+    While the metrics are off, it's a shared context manager doing nothing.
+    """
+    if _metrics is None:
+        return _DISABLED
+    return _Timer(_metrics, name, _labels(labels))
+
+
+def timed(name, **labels):
+    """
+    Decorate a function to time each call with timer(name, **labels).
+    While the metrics are off, a call only costs an extra check.
+    """
+    labels = _labels(labels)
+
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if _metrics is None:
+                return function(*args, **kwargs)
+            with _Timer(_metrics, name, labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1, **labels):
+    """
+    Add to a counter, doing nothing while the metrics are off.
+    """
+    if _metrics is not None:
+        _metrics.count(name, value, _labels(labels))
+
+
+def set_gauge(name, value, **labels):
+    """
+    Set a gauge, doing nothing while the metrics are off.
+    """
+    if _metrics is not None:
+        _metrics.set_gauge(name, value, _labels(labels))
+
+
+@contextmanager
+def _run_command(metrics, name):
+    """
+    Time a command, profiling it and tracing its memory if the metrics were enabled to.
+    """
+    profiler = None
+    if metrics.profile_dir:
+        import cProfile
+        profiler = cProfile.Profile()
+    if metrics.trace_memory:
+        import tracemalloc
+        tracemalloc.start()
+    try:
+        with _Timer(metrics, 'command', (('command', name),)):
+            if profiler is None:
+                yield
+            else:
+                with profiler:
+                    yield
+    finally:
+        if profiler is not None:
+            profile_path = metrics.next_profile_path(name)
+            profiler.dump_stats(profile_path)
+            print(f"Profile of {name} written to {profile_path} "
+                  f"(python -m pstats {profile_path})", file=sys.stderr)
+        if metrics.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            top_lines = tracemalloc.take_snapshot().statistics('lineno')[:TRACE_MEMORY_TOP_LINES]
+            tracemalloc.stop()
+            metrics.set_gauge('command_peak_memory_bytes', peak, (('command', name),))
+            print(f"Peak memory of {name}: {peak / 1024:.1f} KB, the lines with the most memory allocated at the end:",
+                  file=sys.stderr)
+            for statistic in top_lines:
+                print(f"  {statistic}", file=sys.stderr)
+
+
+def command(name):
+    """
+    Return a context manager around a command of the app: it's timed (the 'command' timer),
+    and profiled or traced if enable() was asked to. While the metrics are off, it does nothing.
+    """
+    if _metrics is None:
+        return _DISABLED
+    return _run_command(_metrics, name)
+
+
+def write(file_path):
+    """
+    Write the collected metrics to a file, in the Prometheus text format if it ends with .prom, otherwise as JSON.
+    The file is replaced at once, so a scraper never reads half of it.
+    """
+    if _metrics is None:
+        return
+    from atomic_file import atomic_open
+    if file_path.endswith('.prom'):
+        content = _metrics.to_prometheus()
+    else:
+        import json
+        content = json.dumps(_metrics.to_dict(), indent=2) + '\n'
+    with atomic_open(file_path, 'w', encoding='utf-8') as file:
+        file.write(content)
@@ -1,25 +1,31 @@
 import os
-import requests
-from dotenv import load_dotenv
-from random import choice
-import statistics
-import movies_web_generator
+import metrics
 from istorage import IStorage
 from colorama import init, Fore, Style
 
-# Initialize colorama
-init(autoreset=True)
+# requests, omdb (and its .env), the website generator and the poster mirror are imported
+# by the commands that use them, so the commands that don't start faster
 
-load_dotenv()
-API_KEY = os.getenv('API_KEY')
+# How many movies are listed at a time
+PAGE_SIZE = 25
+# How many movies a search shows at most
+SEARCH_RESULTS_LIMIT = 20
+# How many movies a page of the website shows, None puts them all on one page
+WEBSITE_MOVIES_PER_PAGE = None
+# Where the website is generated
+WEBSITE_FILE = "_static/movies.html"
+# Where the website's posters and their thumbnails are downloaded to
+POSTERS_DIR = "_static/posters"
 
 
 class MovieApp:
-    def __init__(self, storage: IStorage):
+    def __init__(self, storage: IStorage, omdb_cache=None):
         self._storage = storage
+        self._omdb_cache = omdb_cache
 
     @staticmethod
-    def fetch_data(movie_name):
+    @metrics.timed('fetch_data')
+    def fetch_data(movie_name, cache=None):
         """
         This function sends a request to the OMDb API based on the provided movie name
         and retrieves the movie's title, year, rating, and poster URL.
@@ -29,39 +35,33 @@ class MovieApp:
 
         Args:
             movie_name (str): The name of the movie to search for in the OMDb database.
+            cache (OmdbCache, optional): Cache of OMDb responses to check before calling the API.
 
         Returns:
             tuple: A tuple containing the movie's title, year, rating, and poster URL.
                    If the movie is not found or an error occurs, None is returned.
         """
+        import requests
+        import omdb
+
         try:
-            api_url = f'http://www.omdbapi.com/?apikey={API_KEY}&t={movie_name}'
-            response = requests.get(api_url, timeout=5)
-            response.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
-            if (response.status_code ==
-                    requests.codes.ok):
-                data = response.json()
-                if data and data['Response'] == 'True':
-                    title = data.get('Title', 'N/A')
-                    year = data.get('Year', 'N/A')
-                    ratings = data.get('Ratings', [])
-                    if ratings:
-                        rating = ratings[0].get('Value', 'N/A')
-                    else:
-                        rating = 'N/A'
-                    poster = data.get('Poster', 'N/A')
-                    return title, year, rating, poster
+            data = omdb.request_movie(movie_name, cache=cache)
+            return omdb.parse_movie_data(data)
 
         except requests.exceptions.HTTPError as http_err:
+            metrics.count('omdb_errors', error='HTTPError')
             print(f"HTTP error happened: {http_err}")
             return None
         except requests.exceptions.ConnectionError as conn_err:
+            metrics.count('omdb_errors', error='ConnectionError')
             print(f"Connection error happened: {conn_err}")
             return None
         except requests.exceptions.Timeout as timeout_err:
+            metrics.count('omdb_errors', error='Timeout')
             print(f"Timeout error happened: {timeout_err}")
             return None
         except requests.exceptions.RequestException as req_err:
+            metrics.count('omdb_errors', error=type(req_err).__name__)
             print(f"An error happened: {req_err}")
             return None
 
@@ -96,9 +96,33 @@ class MovieApp:
         movies = self._storage.load_movies()
         total_movies = len(movies)
         print(Fore.YELLOW + f"{total_movies} movies in total here.")
-        for movie, details in movies.items():
-            print(f"{movie}, year of release is {details['year']}, "
-                  f"and rating is {details['rating']}")
+        self._print_pages('title', lambda movie, details: f"{movie}, year of release is {details['year']}, "
+                                                          f"and rating is {details['rating']}")
+
+    def _print_pages(self, by, format_movie, descending=False):
+        """
+        Prints the movies sorted by title, rating or year, a page at a time,
+        asking before each next page. Only the shown pages are read from the storage's sorted index.
+        """
+        cursor = None
+        while True:
+            page, cursor = self._storage.movies_page(by, limit=PAGE_SIZE, cursor=cursor, descending=descending)
+            for movie, details in page:
+                print(format_movie(movie, details))
+            if cursor is None:
+                return
+            if input("Press Enter for more movies, or q to stop: ").strip().lower() == 'q':
+                return
+
+    def add_movie_by_name(self, movie_name):
+        """
+        Fetches a movie from OMDb and adds it to the storage.
+        Returns the added (title, year, rating, poster_url) tuple, or None if the movie wasn't found.
+        """
+        movie = self.fetch_data(movie_name, cache=self._omdb_cache)
+        if movie:
+            self._storage.add_movie(*movie)
+        return movie
 
     def _command_add_movie(self):
         """
@@ -106,11 +130,9 @@ class MovieApp:
         """
         try:
             title = input("Guess what. You can enter a movie name here: ")
-            movie_name = self.fetch_data(title)
+            movie_name = self.add_movie_by_name(title)
 
             if movie_name:
-                movie_title, year, rating, poster_url = movie_name
-                self._storage.add_movie(movie_title, year, rating, poster_url)
                 print(Fore.YELLOW + "Movie Data:", movie_name)
             else:
                 print("Failed to fetch data for the movie:", movie_name)
@@ -143,73 +165,51 @@ class MovieApp:
         else:
             print("Oh. It's an error. try again, maybe?!")
 
-    @staticmethod
-    def _convert_to_float(rating_str):
-        """
-        Converts a rating string to a float, handling cases where the string might not be a valid number.
-        """
-        try:
-            return float(rating_str.split('/')[0].replace(',', '.'))
-        except ValueError:
-            return None
-
     def _command_movie_statistics(self):
         """
         Display statistics about the movies in the database,
         including average rating, median rating,
         best movie by rating, and worst movie by rating.
         """
-        movies = self._storage.load_movies()
+        # The statistics are calculated by the storage,
+        # so a database storage can calculate them without loading all the movies.
+        self.print_statistics(self._storage.movie_statistics())
 
-        if not movies:
+    @staticmethod
+    def print_statistics(stats):
+        """
+        Prints the statistics returned by the storage's movie_statistics.
+        """
+        if not stats:
             print("No movies available to show statistics.")
             return
 
-        ratings = []
-
-        for details in movies.values():
-            rating_str = details['rating'].split('/')[0]
-            try:
-                # Try converting the rating to a float
-                rating = float(rating_str)
-                ratings.append(rating)
-            except ValueError:
-                # Handle the case where the rating isn't a valid float, rating is N/A
-                print(f"Skipping invalid rating: {rating_str}")
-                continue
+        for rating_str in stats['skipped']:
+            # The rating isn't a valid float, rating is N/A
+            print(f"Skipping invalid rating: {rating_str}")
 
-        if not ratings:
+        if stats['average'] is None:
             print("No valid ratings to calculate statistics.")
             return
 
-        # Average rating
-        average_movie_rating = sum(ratings) / len(ratings)
-        print(f"Average rating: {average_movie_rating:.2f}")
-
-        # Median rating using the statistics.median method
+        print(f"Average rating: {stats['average']:.2f}")
         # The median is the middle value in a sorted list.
         # If list has an even number of elements, the median is average of the two middle numbers.
-        median_movie_rating = statistics.median(ratings)
-        print("Median rating:", median_movie_rating)
-
-        # best movie:
-        max_rating = max(ratings)
-        # movies.items() returns key-value pairs.
-        # Each pair is a tuple with: movie title and dictionary containing the movie's details.
-        best_movies = [title for title, details in movies.items()
-                       if self._convert_to_float(details['rating']) == max_rating]
-        print(f"Best movie(s): {', '.join(best_movies)}, Rating {max_rating}")
-
-        # The worst movie by rating
-        min_rating = min(ratings)
-        worst_movies = [title for title, details in movies.items()
-                        if self._convert_to_float(details['rating']) == min_rating]
-        print(f"Worst movie(s): {', '.join(worst_movies)}, Rating {min_rating}")
+        print("Median rating:", stats['median'])
+        print(f"Best movie(s): {', '.join(stats['best_movies'])}, Rating {stats['best_rating']}")
+        print(f"Worst movie(s): {', '.join(stats['worst_movies'])}, Rating {stats['worst_rating']}")
+        percentiles = ", ".join(f"{percent}th: {value:.2f}" for percent, value in stats['percentiles'].items())
+        print(f"Rating percentiles: {percentiles}")
+        print("Ratings histogram:")
+        for start, count in stats['histogram'].items():
+            print(f"  {start}-{start}.9: {'*' * count} ({count})")
 
     def _command_random_movie(self):
         """
         Select a random movie from the database and display its title, year of release and rating.
         """
+        from random import choice
+
         movies = self._storage.load_movies()
         movie, details = choice(list(movies.items()))
         print(f"Here's your movie for today: {movie}, its year of release is {details['year']}, "
@@ -219,13 +219,9 @@ class MovieApp:
         """
         Search for movies by name in the database and display the results.
         """
-        movies = self._storage.load_movies()
         query = input("Enter part of a movie name: ").lower()
-        # Convert the query to lowercase for case-insensitive search
-        matching_movies = [
-            (title, details) for title, details in movies.items()
-            if query in title.lower()  # Check if the query is a substring of the movie title
-        ]
+        # The storage finds the movies matching the query case-insensitively, best matches first
+        matching_movies = self._storage.search_movies(query, limit=SEARCH_RESULTS_LIMIT)
 
         if matching_movies:
             # Print each matching movie
@@ -239,24 +235,38 @@ class MovieApp:
         """
         Sort and display the movies in the database by rating in descending order.
         """
+        self._print_pages('rating', lambda movie, details: f"{movie}, its year of release: {details['year']}, "
+                                                           f"and it's rated: {details['rating']}.",
+                          descending=True)
+        stats = self._storage.movie_statistics()
+        if stats and stats['skipped']:
+            print(f"{len(stats['skipped'])} movie(s) without a valid rating are not listed.")
+
+    @metrics.timed('site_generation')
+    def generate_website(self, output_file_path=WEBSITE_FILE, per_page=WEBSITE_MOVIES_PER_PAGE):
+        """
+        Generates an HTML website from the movies' database.
+        Returns the list of files that were written.
+        """
+        import movies_web_generator
+        from poster_mirror import PosterMirror
+
         movies = self._storage.load_movies()
-        sorted_movies = sorted(movies.items(), key=lambda r: r[1]['rating'], reverse=True)
-        for movie, details in sorted_movies:
-            print(f"{movie}, its year of release: {details['year']}, "
-                  f"and it's rated: {details['rating']}.")
+        os.makedirs(os.path.dirname(output_file_path) or '.', exist_ok=True)
+        # The posters are shown from local thumbnails, only new posters are downloaded
+        posters = PosterMirror(POSTERS_DIR).local_posters(
+            (details.get('poster_url') for details in movies.values()), os.path.dirname(output_file_path))
+        # The movies are written to the file one by one,
+        # and the page is only written again if a movie changed since the last time
+        return movies_web_generator.generate_website(movies, output_file_path, 'E\'s Movies App',
+                                                     per_page=per_page, incremental=True, posters=posters)
 
     def _generate_website(self):
         """
-        Generates an HTML website from the movies' database.
+        Generates the website and shows where to find it.
         """
-        movies = self._storage.load_movies()
-        html_template = movies_web_generator.read_template()
-        movies_html = movies_web_generator.generate_movies_info(movies)
-        final_html = (html_template.replace('__TEMPLATE_TITLE__', 'E\'s Movies App').replace
-                      ('__TEMPLATE_MOVIE_GRID__', movies_html))
-        output_file_path = "_static/movies.html"
-        movies_web_generator.write_to_html_file(final_html, output_file_path)
-        full_path = os.path.abspath(output_file_path)
+        self.generate_website()
+        full_path = os.path.abspath(WEBSITE_FILE)
         print(Fore.YELLOW + f"Voila! Your Website was generated successfully. "
                             f"you may check it out here: file://{full_path}")
 
@@ -272,6 +282,8 @@ class MovieApp:
         """
         Main function to run the movie database application.
         """
+        # Initialize colorama, only for the menu, the commands of movie_cli write plain text
+        init(autoreset=True)
         choices = {
             "1": self._command_list_movies,
             "2": self._command_add_movie,
@@ -290,6 +302,8 @@ class MovieApp:
             enter_choice = input(Fore.RED + Style.BRIGHT + "Enter your choice (0-9): ")
             action = choices.get(enter_choice)
             if action:
-                action()
+                # Timed, and profiled if MOVIES_PROFILE is set, as e.g. 'list_movies'
+                with metrics.command(action.__name__.replace('_command_', '').lstrip('_')):
+                    action()
             else:
                 print("Invalid choice, please enter a number between 0 and 9.")
@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+from itertools import islice
+
+import metrics
+from sorted_index import SORT_FIELDS
+
+# How many movies are read from the storage at a time when listing them
+LIST_PAGE_SIZE = 1000
+# The output formats of the commands
+OUTPUT_FORMATS = ('text', 'json', 'ndjson')
+
+
+def open_file_storage(file_path):
+    """
+    Open the storage of a movies file, chosen by its extension: .db/.sqlite is an SQLite database,
+    .csv a CSV file, .snap a binary snapshot and anything else a JSON file.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in ('.db', '.sqlite'):
+        from storage_sqlite import StorageSqlite
+        return StorageSqlite(file_path)
+    if extension == '.csv':
+        from storage_csv import StorageCsv
+        return StorageCsv(file_path)
+    if extension == '.snap':
+        from storage_snapshot import StorageSnapshot
+        return StorageSnapshot(file_path)
+    from storage_json import StorageJson
+    return StorageJson(file_path)
+
+
+def open_storage(file_path):
+    """
+    Open the storage of a movies file for the commands, see open_file_storage.
+    The JSON movies are kept in memory and searched through a saved index like in the app,
+    snapshot movies are searched through a saved index too. SQLite databases search themselves,
+    and a CSV file of any size is read row by row instead of being loaded as a whole.
+    """
+    storage = open_file_storage(file_path)
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in ('.db', '.sqlite', '.csv'):
+        return storage
+
+    from search_index import SearchableStorage
+    if extension == '.snap':
+        # The snapshot decodes the movies when they're used, a cache would decode them all
+        return SearchableStorage(storage)
+    from storage_cache import CachedStorage
+    return SearchableStorage(CachedStorage(storage))
+
+
+def movie_record(title, details):
+    """
+    Return a movie as one flat dictionary, the way it's written as JSON.
+    """
+    return {'title': title, **details}
+
+
+def iter_sorted_movies(storage, by='title', descending=False, limit=None):
+    """
+    Yield the (title, details) pairs of the movies sorted by title, rating or year,
+    reading them from the storage a page at a time.
+    """
+    cursor = None
+    remaining = limit
+    # The pages double in size, so a storage reading its whole file per page (StorageCsv)
+    # reads it a few times rather than once per thousand movies
+    page_size = LIST_PAGE_SIZE
+    while remaining is None or remaining > 0:
+        page, cursor = storage.movies_page(by, limit=page_size if remaining is None else min(page_size, remaining),
+                                           cursor=cursor, descending=descending)
+        yield from page
+        if remaining is not None:
+            remaining -= len(page)
+        if cursor is None:
+            return
+        page_size *= 2
+
+
+def write_movies(movies, output_format, out=None):
+    """
+    Write (title, details) pairs one at a time, so a long listing is never held in memory as a whole:
+    one line per movie as text, one JSON object per line as NDJSON, or a JSON array.
+    Returns the number of movies written.
+    """
+    out = out or sys.stdout
+    count = 0
+    if output_format == 'json':
+        out.write('[')
+    for title, details in movies:
+        if output_format == 'text':
+            out.write(f"{title}, year of release is {details.get('year')}, "
+                      f"and rating is {details.get('rating')}\n")
+        elif output_format == 'ndjson':
+            out.write(json.dumps(movie_record(title, details), ensure_ascii=False) + '\n')
+        else:
+            out.write((',\n ' if count else '\n ') + json.dumps(movie_record(title, details), ensure_ascii=False))
+        count += 1
+    if output_format == 'json':
+        out.write('\n]\n' if count else ']\n')
+    return count
+
+
+def write_result(result, output_format, text, out=None):
+    """
+    Write the result of a command as one JSON object (for both json and ndjson), or as the given text.
+    """
+    out = out or sys.stdout
+    if output_format == 'text':
+        out.write(text + '\n')
+    else:
+        out.write(json.dumps(result, ensure_ascii=False) + '\n')
+
+
+def _command_list(storage, args):
+    """
+    List the movies, sorted.
+    """
+    if args.sort is None:
+        # In the stored order, the movies are streamed from the storage as they're read
+        movies = islice(storage.iter_movies(), args.limit)
+    else:
+        movies = iter_sorted_movies(storage, args.sort, args.descending, args.limit)
+    write_movies(movies, args.format)
+    return 0
+
+
+def _command_add(storage, args):
+    """
+    Fetch movies from OMDb and add them.
+    """
+    from movie_app import MovieApp
+    from omdb_cache import OmdbCache
+    cache = OmdbCache(args.omdb_cache)
+    found = []
+    failed = []
+    # Fetched before the storage is locked, then added with a single save
+    for movie_name in args.titles:
+        # The OMDb errors are printed as in the app, but kept out of the command's output
+        with redirect_stdout(sys.stderr):
+            movie = MovieApp.fetch_data(movie_name, cache=cache)
+        if movie:
+            found.append(movie)
+        else:
+            failed.append(movie_name)
+    # Under the lock, nobody else adds one of the movies between looking them up and adding them.
+    # The storage prints about the movies already stored, that's kept out of the command's output too
+    with redirect_stdout(sys.stderr), storage.lock():
+        stored = set()
+        for title, *_ in found:
+            if title.casefold() not in stored and storage.get_movie(title) is not None:
+                stored.add(title.casefold())
+        # The movies already stored get their missing details filled in
+        storage.add_movies(found)
+    added = []
+    already_stored = []
+    for movie in found:
+        record = dict(zip(('title', 'year', 'rating', 'poster_url'), movie))
+        if movie[0].casefold() in stored:
+            already_stored.append(record)
+        else:
+            # The same movie given twice is only added once
+            stored.add(movie[0].casefold())
+            added.append(record)
+    write_result({'added': added, 'already_stored': already_stored, 'failed': failed}, args.format,
+                 "\n".join([f"Added {movie['title']} ({movie['year']}), rated {movie['rating']}" for movie in added]
+                           + [f"{movie['title']} is already there" for movie in already_stored]
+                           + [f"Could not add {movie_name}" for movie_name in failed]))
+    return 1 if failed else 0
+
+
+def _command_import(storage, args):
+    """
+    Import a file of movie names from OMDb.
+    """
+    from batch_import import BatchImporter
+    from omdb_cache import OmdbCache
+    importer = BatchImporter(storage, max_workers=args.workers, requests_per_second=args.rate,
+                             retries=args.retries, cache=OmdbCache(args.omdb_cache))
+    with redirect_stdout(sys.stderr):
+        found, failed = importer.import_file(args.titles_file)
+    text = f"Imported {len(found)} movies."
+    if failed:
+        text += f"\nCould not import {len(failed)} movies: {', '.join(failed)}"
+    write_result({'imported': len(found), 'failed': failed}, args.format, text)
+    return 1 if failed else 0
+
+
+def _command_search(storage, args):
+    """
+    Search the movies, best matches first.
+    """
+    count = write_movies(storage.search_movies(args.query, limit=args.limit), args.format)
+    return 0 if count else 1
+
+
+def _command_stats(storage, args):
+    """
+    Show the rating statistics.
+    """
+    stats = storage.movie_statistics()
+    if not stats:
+        write_result(None, args.format, "No movies available to show statistics.")
+        return 1
+    if args.format == 'text':
+        # The same text as the app's stats command
+        from movie_app import MovieApp
+        MovieApp.print_statistics(stats)
+    else:
+        write_result(stats, args.format, '')
+    return 0
+
+
+def _command_generate_site(storage, args):
+    """
+    Generate the website.
+    """
+    from movie_app import MovieApp
+    with redirect_stdout(sys.stderr):
+        written = MovieApp(storage).generate_website(args.output_file, per_page=args.per_page)
+    write_result({'output_file': os.path.abspath(args.output_file), 'written': written}, args.format,
+                 f"Generated {os.path.abspath(args.output_file)}, {len(written)} file(s) written.")
+    return 0
+
+
+def build_parser():
+    """
+    Create the parser of the command line: python main.py [--storage FILE] COMMAND [--format FORMAT] ...
+    """
+    # The output format is an option of every command: python main.py list --format ndjson
+    format_parser = argparse.ArgumentParser(add_help=False)
+    format_parser.add_argument('--format', choices=OUTPUT_FORMATS, default='text',
+                               help="text, a JSON document, or NDJSON (one JSON object per line)")
+
+    parser = argparse.ArgumentParser(
+        description="Manage the movies without the menu. Run without a command for the interactive app.")
+    parser.add_argument('--storage', default='movies.json',
+                        help="movies file: .json, .csv, .snap for a binary snapshot, or .db/.sqlite for SQLite "
+                             "(default movies.json)")
+    parser.add_argument('--omdb-cache', default='omdb_cache.db', help="SQLite file caching the OMDb responses")
+    parser.add_argument('--metrics', help="write the timings and counters of the command to this file "
+                                          "(.prom for the Prometheus text format, otherwise JSON)")
+    parser.add_argument('--profile', metavar='DIR', help="write a cProfile profile of the command to this folder")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="show the peak memory of the command and the lines allocating the most")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', parents=[format_parser], help="list the movies")
+    list_parser.add_argument('--sort', choices=SORT_FIELDS,
+                             help="sort by title, rating or year (movies without a rating or year are left out), "
+                                  "by default the movies are listed in the stored order")
+    list_parser.add_argument('--descending', action='store_true', help="highest first")
+    list_parser.add_argument('--limit', type=int, help="list at most this many movies")
+    list_parser.set_defaults(handler=_command_list)
+
+    add_parser = commands.add_parser('add', parents=[format_parser], help="fetch movies from OMDb and add them")
+    add_parser.add_argument('titles', nargs='+', help="movie names")
+    add_parser.set_defaults(handler=_command_add)
+
+    import_parser = commands.add_parser('import', parents=[format_parser], help="import a text file with one movie name per line")
+    import_parser.add_argument('titles_file')
+    import_parser.add_argument('--workers', type=int, default=8, help="number of concurrent requests")
+    import_parser.add_argument('--rate', type=float, default=10, help="maximum requests per second")
+    import_parser.add_argument('--retries', type=int, default=3, help="retries per movie on transient errors")
+    import_parser.set_defaults(handler=_command_import)
+
+    search_parser = commands.add_parser('search', parents=[format_parser], help="search the movies' titles and notes")
+    search_parser.add_argument('query')
+    search_parser.add_argument('--limit', type=int, default=20, help="show at most this many movies")
+    search_parser.set_defaults(handler=_command_search)
+
+    stats_parser = commands.add_parser('stats', parents=[format_parser], help="show the rating statistics")
+    stats_parser.set_defaults(handler=_command_stats)
+
+    site_parser = commands.add_parser('generate-site', parents=[format_parser], help="generate the website")
+    site_parser.add_argument('--output-file', default='_static/movies.html', help="HTML file to write")
+    site_parser.add_argument('--per-page', type=int, help="split the movies into pages of this many movies")
+    site_parser.set_defaults(handler=_command_generate_site)
+    return parser
+
+
+def main(argv=None):
+    """
+    Run one command and return the exit code: 0 on success, 1 if nothing was found or something failed.
+    """
+    args = build_parser().parse_args(argv)
+    # The options, or else the MOVIES_METRICS, MOVIES_PROFILE and MOVIES_TRACE_MEMORY environment variables
+    metrics_file = metrics.enable_from_environment()
+    if args.metrics or args.profile or args.trace_memory:
+        metrics.enable(args.profile, args.trace_memory)
+        metrics_file = args.metrics or metrics_file
+
+    # Each command imports what it needs, listing movies doesn't load requests, colorama or the website code
+    storage = open_storage(args.storage)
+    try:
+        with metrics.command(args.command):
+            return args.handler(storage, args)
+    except BrokenPipeError:
+        # The reader stopped early (e.g. `| head`), don't complain about the closed pipe when exiting
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    finally:
+        if hasattr(storage, 'close'):
+            storage.close()
+        if metrics_file:
+            metrics.write(metrics_file)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
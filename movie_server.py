@@ -0,0 +1,435 @@
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from urllib.parse import parse_qsl, unquote, urlencode, urlsplit
+
+import metrics
+from movie_cli import movie_record, open_file_storage, open_storage
+from sorted_index import SORT_FIELDS
+
+# How often the movies file is checked for changes, in seconds
+DEFAULT_RELOAD_INTERVAL = 1.0
+# How long an idle keep-alive connection is kept open, in seconds
+KEEP_ALIVE_TIMEOUT = 15
+# How many encoded responses are kept, the least recently used are dropped first
+RESPONSE_CACHE_ENTRIES = 1024
+# Smaller responses aren't worth compressing
+GZIP_MIN_BYTES = 1024
+# The movies of a list or search response
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+MAX_HEADERS = 100
+# Pending connections the listening socket queues, so bursts of thousands of clients aren't refused
+BACKLOG = 4096
+STATUS_TEXTS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class BadRequest(Exception):
+    """
+    A request the server can't answer, e.g. with an invalid parameter. Answered with 400.
+    """
+
+
+def open_server_storage(file_path):
+    """
+    Open the storage of a movies file for the server, see movie_cli.open_file_storage.
+    JSON and CSV movies are kept in memory and JSON and snapshot movies are searched through an index,
+    SQLite databases answer from the database.
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == '.csv':
+        from search_index import SearchableStorage
+        from storage_cache import CachedStorage
+        # The commands read a CSV file row by row, the server keeps it hot in memory instead
+        return SearchableStorage(CachedStorage(open_file_storage(file_path)))
+    return open_storage(file_path)
+
+
+def _valid_cursor(cursor, sort):
+    """
+    Return whether a decoded cursor is a [value, title] pair a page sorted by `sort` can start from:
+    the value is a number for rating and year (small enough for an SQLite integer) and a string for title,
+    so comparing it never fails.
+    """
+    if not isinstance(cursor, list) or len(cursor) != 2:
+        return False
+    value, title = cursor
+    if sort == 'title':
+        value_is_valid = isinstance(value, str)
+    else:
+        value_is_valid = (isinstance(value, float)
+                          or isinstance(value, int) and not isinstance(value, bool) and abs(value) < 2 ** 63)
+    return value_is_valid and isinstance(title, str)
+
+
+def _int_parameter(params, name, default, low, high):
+    """
+    Return an integer query parameter between low and high.
+    """
+    if name not in params:
+        return default
+    try:
+        value = int(params[name])
+    except ValueError:
+        raise BadRequest(f"{name} must be a number")
+    if not low <= value <= high:
+        raise BadRequest(f"{name} must be between {low} and {high}")
+    return value
+
+
+class _CachedResponse:
+    """
+    An encoded response and the version of the movies it was made from.
+    """
+
+    __slots__ = ('version', 'status', 'body', 'gzip_body')
+
+    def __init__(self, version, status, body):
+        self.version = version
+        self.status = status
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6) if len(body) >= GZIP_MIN_BYTES else None
+
+
+class MovieServer:
+    """
+    A read-only HTTP API of the movies, on asyncio:
+
+    GET /movies?sort=rating&descending=1&limit=50&cursor=...  the movies, a page at a time
+    GET /movies/<title>                                       one movie
+    GET /search?q=casa&limit=20                               the movies best matching a query
+    GET /stats                                                the rating statistics
+
+    The responses are JSON, sent gzipped to the clients accepting it, with the version of the movies
+    (IStorage.version()) as their ETag, so a client sending If-None-Match gets a 304 while nothing changed.
+    The encoded responses are kept until the movies file changes, which is checked every reload_interval seconds,
+    so most requests are answered without touching the storage. Connections are kept alive between requests.
+    The storage is only used from one worker thread, so a slow load never blocks the other connections
+    (and an SQLite connection stays in the thread it was opened in).
+    """
+
+    def __init__(self, file_path, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        self._file_path = file_path
+        self._reload_interval = reload_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage')
+        self._storage = None
+        self._version = None
+        # Request key -> _CachedResponse
+        self._responses = OrderedDict()
+        # Request key -> future of the response being made, so concurrent requests for it wait for the same one
+        self._pending = {}
+        self._server = None
+
+    async def _in_storage_thread(self, function, *args):
+        """
+        Run a function in the storage's thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def start(self, host, port):
+        """
+        Open the storage, load the movies and start listening.
+        """
+        self._storage = await self._in_storage_thread(open_server_storage, self._file_path)
+        await self._in_storage_thread(self._warm_up)
+        self._server = await asyncio.start_server(self._handle_connection, host, port, backlog=BACKLOG)
+        asyncio.get_running_loop().create_task(self._watch_file())
+        return self._server
+
+    def _warm_up(self):
+        """
+        Load the movies into memory, so the first requests don't wait for it.
+        """
+        self._set_version(self._storage.version())
+        self._storage.load_movies()
+
+    def _set_version(self, version):
+        """
+        Remember the current version of the movies, dropping the responses made from older ones.
+        """
+        if version != self._version:
+            self._version = version
+            self._responses.clear()
+
+    async def _watch_file(self):
+        """
+        Check the movies file for changes and reload it, until the server is closed.
+        """
+        while self._server is not None and self._server.is_serving():
+            await asyncio.sleep(self._reload_interval)
+            version = await self._in_storage_thread(self._storage.version)
+            if version != self._version:
+                print(f"{self._file_path} changed, reloading the movies.", file=sys.stderr)
+                # The storage notices the change itself, loading the movies now keeps them hot
+                await self._in_storage_thread(self._storage.load_movies)
+                self._set_version(version)
+
+    async def close(self):
+        """
+        Stop listening, and close the storage (saving its search index).
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._storage is not None and hasattr(self._storage, 'close'):
+            await self._in_storage_thread(self._storage.close)
+        self._executor.shutdown()
+
+    def _route(self, path, params):
+        """
+        Answer a request in the storage's thread. Returns the version of the movies, the status and the JSON data.
+        """
+        version = self._storage.version()
+        if path == '/movies':
+            return version, 200, self._list_movies(params)
+        if path.startswith('/movies/'):
+            movie = self._storage.get_movie(unquote(path[len('/movies/'):]))
+            if movie is None:
+                return version, 404, {'error': "Movie not found"}
+            return version, 200, movie_record(*movie)
+        if path == '/search':
+            query = params.get('q', '').strip()
+            if not query:
+                raise BadRequest("q is required")
+            limit = _int_parameter(params, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+            return version, 200, {'movies': [movie_record(title, details) for title, details
+                                             in self._storage.search_movies(query, limit=limit)]}
+        if path == '/stats':
+            stats = self._storage.movie_statistics()
+            if not stats:
+                return version, 404, {'error': "No movies available to show statistics"}
+            return version, 200, stats
+        return version, 404, {'error': "Not found, the endpoints are /movies, /movies/<title>, /search and /stats"}
+
+    def _list_movies(self, params):
+        """
+        Return a page of the movies: sorted from a cursor, or in the stored order from an offset.
+        """
+        limit = _int_parameter(params, 'limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+        sort = params.get('sort')
+        if sort is None:
+            offset = _int_parameter(params, 'offset', 0, 0, sys.maxsize)
+            page = list(islice(self._storage.iter_movies(), offset, offset + limit + 1))
+            return {'movies': [movie_record(title, details) for title, details in page[:limit]],
+                    'next_offset': offset + limit if len(page) > limit else None}
+
+        if sort not in SORT_FIELDS:
+            raise BadRequest(f"sort must be one of {', '.join(SORT_FIELDS)}")
+        cursor = None
+        if params.get('cursor'):
+            try:
+                cursor = json.loads(params['cursor'])
+            except ValueError:
+                raise BadRequest("cursor must be the next_cursor of the previous page")
+            if not _valid_cursor(cursor, sort):
+                raise BadRequest("cursor must be the next_cursor of the previous page")
+        descending = params.get('descending', '') not in ('', '0', 'false')
+        page, next_cursor = self._storage.movies_page(sort, limit=limit, cursor=cursor, descending=descending)
+        return {'movies': [movie_record(title, details) for title, details in page],
+                'next_cursor': json.dumps(list(next_cursor)) if next_cursor is not None else None}
+
+    def _make_response(self, key, path, params):
+        """
+        Make and encode the response of a request in the storage's thread.
+        """
+        try:
+            version, status, data = self._route(path, params)
+        except BadRequest as error:
+            version, status, data = self._version, 400, {'error': str(error)}
+        with metrics.timer('http_encode'):
+            return _CachedResponse(version, status, json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+    async def _get_response(self, path, params):
+        """
+        Return the response of a request, made once per version of the movies.
+        """
+        key = path + '?' + urlencode(sorted(params.items()))
+        response = self._responses.get(key)
+        if response is not None and response.version == self._version:
+            self._responses.move_to_end(key)
+            metrics.count('http_cache_hits')
+            return response
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._make_response, key, path, params)
+        self._pending[key] = future
+        try:
+            response = await future
+        finally:
+            del self._pending[key]
+        # The movies may have changed before the file was checked again
+        self._set_version(response.version)
+        if response.status in (200, 404):
+            self._responses[key] = response
+            if len(self._responses) > RESPONSE_CACHE_ENTRIES:
+                self._responses.popitem(last=False)
+        return response
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Answer the requests of a connection until the client closes it or stops sending requests.
+        """
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            # The client went away, or sent a line too long to be a request
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, request_line, reader, writer):
+        """
+        Read the headers of a request and write its response.
+        Returns whether the connection can be kept open for the next request.
+        """
+        parts = request_line.decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                parts = []
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            self._write(writer, 400, {'error': "Bad request"}, keep_alive=False)
+            return False
+
+        method, target, protocol = parts
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if protocol == 'HTTP/1.1' else connection == 'keep-alive'
+        if 'content-length' in headers:
+            # A body isn't expected, but it has to be read to get to the next request
+            await reader.readexactly(int(headers['content-length']))
+        if method not in ('GET', 'HEAD'):
+            self._write(writer, 405, {'error': "Only GET and HEAD are allowed"}, keep_alive, {'Allow': 'GET, HEAD'})
+            return keep_alive
+
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query))
+        try:
+            response = await self._get_response(url.path.rstrip('/') or '/', params)
+        except Exception as error:
+            print(f"Could not answer {target}: {error!r}", file=sys.stderr)
+            self._write(writer, 500, {'error': "Internal server error"}, keep_alive)
+            return keep_alive
+
+        use_gzip = response.gzip_body is not None and 'gzip' in headers.get('accept-encoding', '')
+        # The gzipped response is another representation, with its own ETag
+        etag = f'"{response.version}{"-gzip" if use_gzip else ""}"'
+        extra_headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if_none_match = headers.get('if-none-match')
+        if response.status == 200 and if_none_match and (
+                if_none_match.strip() == '*'
+                or etag in (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))):
+            self._write_head(writer, 304, None, 0, keep_alive, extra_headers)
+            return keep_alive
+
+        if use_gzip:
+            extra_headers['Content-Encoding'] = 'gzip'
+        body = response.gzip_body if use_gzip else response.body
+        self._write_head(writer, response.status, 'application/json; charset=utf-8', len(body), keep_alive,
+                         extra_headers)
+        if method == 'GET':
+            writer.write(body)
+        return keep_alive
+
+    @staticmethod
+    def _write_head(writer, status, content_type, content_length, keep_alive, extra_headers=None):
+        """
+        Write the status line and the headers of a response.
+        """
+        metrics.count('http_responses', status=status)
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXTS[status]}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        if status != 304:
+            lines.append(f"Content-Length: {content_length}")
+        lines.extend(f"{name}: {value}" for name, value in (extra_headers or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    def _write(self, writer, status, data, keep_alive, extra_headers=None):
+        """
+        Write a response that isn't cached, like an error.
+        """
+        body = json.dumps(data).encode('utf-8')
+        self._write_head(writer, status, 'application/json; charset=utf-8', len(body), keep_alive, extra_headers)
+        writer.write(body)
+
+
+def _raise_open_files_limit():
+    """
+    Allow as many open files as the system lets this process have, each connection is a file.
+    """
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def serve(file_path, host, port, reload_interval=DEFAULT_RELOAD_INTERVAL):
+    """
+    Serve the movies of a file until the task is cancelled.
+    """
+    server = MovieServer(file_path, reload_interval)
+    listening = await server.start(host, port)
+    address = listening.sockets[0].getsockname()
+    print(f"Serving {file_path} on http://{address[0]}:{address[1]}/ (press Ctrl+C to stop)", file=sys.stderr)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main():
+    """
+    Serve the movies over HTTP:
+    python movie_server.py --storage movies.json --port 8000
+    """
+    parser = argparse.ArgumentParser(description="Serve the movies as a read-only JSON API.")
+    parser.add_argument('--storage', default='movies.json', help="movies file: .json, .csv, .snap or .db/.sqlite")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on")
+    parser.add_argument('--reload-interval', type=float, default=DEFAULT_RELOAD_INTERVAL,
+                        help="how often to check the movies file for changes, in seconds")
+    args = parser.parse_args()
+
+    _raise_open_files_limit()
+    try:
+        asyncio.run(serve(args.storage, args.host, args.port, args.reload_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
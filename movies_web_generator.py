@@ -1,3 +1,11 @@
+import hashlib
+import json
+import os
+from itertools import chain
+
+import metrics
+from atomic_file import atomic_open
+
 trailer_links = {
     "Control": "https://www.youtube.com/watch?v=xUz6y6ANIgE",
     "Clerks": "https://www.youtube.com/watch?v=Mlfn5n-E2WE",
@@ -19,18 +27,26 @@ def read_template():
         return content.read()
 
 
-def generate_movie_info(movie_name, details):
+def generate_movie_info(movie_name, details, poster=None):
     """
     Generates HTML for a single movie.
+    poster is an optional (local path, width, height) of the poster to show instead of poster_url.
     """
     trailer_url = trailer_links.get(movie_name)
     trailer_html = f'<a class="trailer-link" href="{trailer_url}" target="_blank">trailer</a>' \
         if trailer_url else '<p class="trailer-coming-soon">trailer is not here, yet</p>'
     note = details.get('note', 'No notes available')  # Get the note or set a default message
+    if poster:
+        poster_src, width, height = poster
+        # Knowing the size, the browser can lay out the page before the poster is loaded
+        size_html = f' width="{width}" height="{height}"' if width and height else ''
+        poster_html = f'src="{poster_src}"{size_html} loading="lazy"'
+    else:
+        poster_html = f'src="{details["poster_url"]}"'
     return f"""
     <li> 
         <div class="movie">
-            <img class="movie-poster" src="{details['poster_url']}" alt="{movie_name}"title="{note}">
+            <img class="movie-poster" {poster_html} alt="{movie_name}"title="{note}">
             <h2 class="movie-title">{movie_name}</h2>
             <p class="movie-year">Year <strong>{details['year']}</strong></p>
             <p class="movie-rating">Rating <strong>{details['rating']}</strong></p>
@@ -44,18 +60,156 @@ def generate_movies_info(data):
     """
     Generates HTML for all movies in the database.
     """
-    output = ""
-    if data:
-        for movie_name, details in data.items():
-            output += generate_movie_info(movie_name, details)
-    else:
+    if not data:
+        print("nothing is here")
+    # Joining the pieces once instead of adding them one by one keeps this linear
+    return "".join(generate_movie_info(movie_name, details) for movie_name, details in data.items())
+
+
+def _movie_hash(movie_name, details):
+    """
+    Returns a hash of everything a movie's HTML is generated from.
+    """
+    record = json.dumps([movie_name, details, trailer_links.get(movie_name)], sort_keys=True)
+    return hashlib.sha1(record.encode('utf-8')).hexdigest()
+
+
+def _load_page_hashes(cache_path):
+    """
+    Reads the hashes of the pages written by the last generation: {file path: hash}.
+    """
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _page_hash(page_html, movie_items):
+    """
+    Returns a hash of everything a page is generated from:
+    the template and navigation HTML, and the page's movies.
+    """
+    page_hash = hashlib.sha1(page_html.encode('utf-8'))
+    for movie_name, details in movie_items:
+        page_hash.update(_movie_hash(movie_name, details).encode('utf-8'))
+    return page_hash.hexdigest()
+
+
+def _page_file_path(output_file_path, page_number):
+    """
+    Returns the path of a page, e.g. _static/movies-2.html for page 2 of _static/movies.html.
+    """
+    base, extension = os.path.splitext(output_file_path)
+    return f"{base}-{page_number}{extension}"
+
+
+def _page_navigation(output_file_path, page_number, page_count):
+    """
+    Generates the links to the index and the previous and next pages.
+    """
+    links = [f'<a href="{os.path.basename(output_file_path)}">all pages</a>']
+    if page_number > 1:
+        previous_page = os.path.basename(_page_file_path(output_file_path, page_number - 1))
+        links.append(f'<a href="{previous_page}">previous</a>')
+    if page_number < page_count:
+        next_page = os.path.basename(_page_file_path(output_file_path, page_number + 1))
+        links.append(f'<a href="{next_page}">next</a>')
+    return f'<li class="page-navigation">{" | ".join(links)} (page {page_number} of {page_count})</li>'
+
+
+def _write_page(file_path, template_head, template_tail, html_pieces):
+    """
+    Writes a page piece by piece, so the whole page is never held in memory.
+    """
+    with atomic_open(file_path, 'w', encoding='utf-8') as file:
+        file.write(template_head)
+        for html in html_pieces:
+            file.write(html)
+        file.write(template_tail)
+
+
+def _movie_cards(movie_items, posters):
+    """
+    Generates the HTML of the movies one by one.
+    """
+    for movie_name, details in movie_items:
+        yield generate_movie_info(movie_name, details, posters.get(details.get('poster_url')))
+
+
+@metrics.timed('site_render')
+def generate_website(data, output_file_path, title, per_page=None, incremental=False, posters=None):
+    """
+    Writes the website of the movies to output_file_path, streaming each movie's HTML into the file.
+
+    With per_page, the movies are split into pages of per_page movies
+    (movies-1.html, movies-2.html, ...) and output_file_path becomes an index of the pages.
+    With incremental=True, a hash of each page's movies is kept next to the output file,
+    and only the pages whose movies changed since the last generation are written again.
+    posters maps poster URLs to the (local path, width, height) to show instead,
+    see poster_mirror.PosterMirror.local_posters.
+
+    Returns the list of files that were written.
+    """
+    posters = posters or {}
+    html_template = read_template().replace('__TEMPLATE_TITLE__', title)
+    template_head, template_tail = html_template.split('__TEMPLATE_MOVIE_GRID__', 1)
+    if not data:
         print("nothing is here")
-    return output
+
+    movie_items = list(data.items())
+    # Each page as (file path, navigation HTML, movies)
+    if not per_page:
+        pages = [(output_file_path, '', movie_items)]
+        index_html = None
+    else:
+        page_count = max(1, -(-len(movie_items) // per_page))
+        pages = []
+        index_links = []
+        for page_number in range(1, page_count + 1):
+            page_items = movie_items[(page_number - 1) * per_page:page_number * per_page]
+            page_path = _page_file_path(output_file_path, page_number)
+            pages.append((page_path, _page_navigation(output_file_path, page_number, page_count), page_items))
+            if page_items:
+                index_links.append(f'<li class="page-link"><a href="{os.path.basename(page_path)}">'
+                                   f'Page {page_number}: {page_items[0][0]} - {page_items[-1][0]}</a></li>')
+        index_html = "".join(index_links)
+
+    cache_path = output_file_path + '.hashes.json'
+    old_hashes = _load_page_hashes(cache_path) if incremental else {}
+    new_hashes = {}
+    written = []
+    for page_path, navigation, page_items in pages:
+        if incremental:
+            page_posters = [posters.get(details.get('poster_url')) for _, details in page_items]
+            new_hashes[page_path] = _page_hash(html_template + navigation + json.dumps(page_posters),
+                                               page_items)
+            if old_hashes.get(page_path) == new_hashes[page_path] and os.path.exists(page_path):
+                continue
+        _write_page(page_path, template_head, template_tail,
+                    chain([navigation], _movie_cards(page_items, posters), [navigation]))
+        written.append(page_path)
+
+    if index_html is not None:
+        new_hashes[output_file_path] = _page_hash(html_template + index_html, [])
+        if (not incremental or old_hashes.get(output_file_path) != new_hashes[output_file_path]
+                or not os.path.exists(output_file_path)):
+            _write_page(output_file_path, template_head, template_tail, [index_html])
+            written.append(output_file_path)
+
+    if incremental:
+        # Remove the pages left over from a generation with more pages
+        for page_path in old_hashes.keys() - new_hashes.keys():
+            if os.path.exists(page_path):
+                os.remove(page_path)
+        with atomic_open(cache_path, 'w', encoding='utf-8') as file:
+            json.dump(new_hashes, file)
+    return written
 
 
 def write_to_html_file(content, output_file_path):
     """
     Writes the final HTML content to the index.html file.
     """
-    with open(output_file_path, 'w') as new_file:
+    with atomic_open(output_file_path, 'w') as new_file:
         return new_file.write(content)
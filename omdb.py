@@ -0,0 +1,62 @@
+import os
+from functools import lru_cache
+
+import requests
+
+import metrics
+
+
+@lru_cache(maxsize=None)
+def api_settings():
+    """
+    Return the API key and the OMDb URL, reading .env on the first request instead of on import.
+    OMDB_URL can point to another server, e.g. a local stub of omdbapi.com.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv('API_KEY'), os.getenv('OMDB_URL', 'http://www.omdbapi.com/')
+
+
+def request_movie(movie_name, session=None, timeout=5, cache=None):
+    """
+    Sends a request to the OMDb API for the given movie name and returns the decoded JSON response.
+    A requests.Session can be passed to reuse its connections,
+    and an OmdbCache to answer repeated requests (including "not found" ones) without the API.
+    Raises the requests exceptions (HTTPError, ConnectionError, Timeout, ...) on failure.
+    """
+    if cache is not None:
+        data = cache.get(movie_name)
+        if data is not None:
+            return data
+
+    api_key, omdb_url = api_settings()
+    http = session or requests
+    with metrics.timer('omdb_request'):
+        response = http.get(omdb_url, params={'apikey': api_key, 't': movie_name}, timeout=timeout)
+    metrics.count('omdb_responses', status=response.status_code)
+    response.raise_for_status()  # Raises an HTTPError if the response status is 4xx, 5xx
+    data = response.json()
+
+    if cache is not None:
+        cache.put(movie_name, data)
+    return data
+
+
+def parse_movie_data(data):
+    """
+    Extracts the movie's title, year, rating, and poster URL from an OMDb response.
+
+    Returns:
+        tuple: (title, year, rating, poster_url), or None if OMDb didn't find the movie.
+    """
+    if data and data.get('Response') == 'True':
+        title = data.get('Title', 'N/A')
+        year = data.get('Year', 'N/A')
+        ratings = data.get('Ratings', [])
+        if ratings:
+            rating = ratings[0].get('Value', 'N/A')
+        else:
+            rating = 'N/A'
+        poster = data.get('Poster', 'N/A')
+        return title, year, rating, poster
+    return None
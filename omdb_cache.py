@@ -0,0 +1,121 @@
+import json
+import sqlite3
+import threading
+import time
+
+import metrics
+
+# How long a cached response is used before OMDb is asked again
+DEFAULT_TTL = 30 * 24 * 60 * 60
+# "Movie not found" responses are kept for a shorter time, the movie might be added to OMDb
+DEFAULT_NEGATIVE_TTL = 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def normalize_title(movie_name):
+    """
+    Return the cache key for a movie name: case-folded, with the whitespace collapsed.
+    """
+    return ' '.join(movie_name.split()).casefold()
+
+
+class OmdbCache:
+    """
+    Caches OMDb responses in an SQLite file, so fetching the same movie again doesn't call the API.
+    Entries expire after their TTL, and once there are more than max_entries,
+    the least recently used ones are removed.
+    The hit and miss counters of the current process are in `hits` and `misses`.
+    """
+
+    def __init__(self, db_path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self._db_path = db_path
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # The cache is shared by the threads of the batch importer
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    title TEXT PRIMARY KEY,
+                    response TEXT,
+                    expires_at REAL,
+                    last_used REAL
+                )
+            """)
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self._connection.close()
+
+    def get(self, movie_name):
+        """
+        Return the cached OMDb response for the movie name,
+        or None if it isn't cached or has expired.
+        """
+        key = normalize_title(movie_name)
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT response FROM responses WHERE title = ? AND expires_at > ?",
+                (key, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.count('omdb_cache_misses')
+                return None
+            self.hits += 1
+            metrics.count('omdb_cache_hits')
+            self._connection.execute(
+                "UPDATE responses SET last_used = ? WHERE title = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, movie_name, response):
+        """
+        Cache an OMDb response for the movie name.
+        Responses for movies OMDb didn't find ("Response": "False") are cached for negative_ttl.
+        """
+        key = normalize_title(movie_name)
+        now = time.time()
+        found = bool(response) and response.get('Response') == 'True'
+        ttl = self._ttl if found else self._negative_ttl
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (title, response, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                (key, json.dumps(response), now + ttl, now))
+            self._evict(now)
+
+    def _evict(self, now):
+        """
+        Remove the expired entries and the least recently used ones over max_entries.
+        """
+        self._connection.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+        self._connection.execute(
+            "DELETE FROM responses WHERE title IN ("
+            "SELECT title FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self._max_entries,))
+
+    def stats(self):
+        """
+        Return the number of cached entries, hits, misses and the hit rate.
+        """
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'max_entries': self._max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,145 @@
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from atomic_file import atomic_open
+
+# Size the thumbnails are scaled down to fit in, the OMDb posters are 300px wide
+THUMBNAIL_SIZE = (150, 222)
+
+
+class PosterMirror:
+    """
+    Downloads the movie posters into a local folder, so the website doesn't hotlink them.
+    Posters are stored under the hash of their content (next to a smaller thumbnail),
+    and a manifest remembers which URL was stored where, so a poster is only downloaded once.
+    """
+
+    def __init__(self, cache_dir, thumbnail_size=THUMBNAIL_SIZE, max_workers=8, session=None):
+        self._cache_dir = cache_dir
+        self._manifest_path = os.path.join(cache_dir, 'manifest.json')
+        self._thumbnail_size = thumbnail_size
+        self._max_workers = max_workers
+        self._session = session or self._create_session(max_workers)
+        self._manifest = self._load_manifest()
+
+    @staticmethod
+    def _create_session(max_workers):
+        """
+        Create a session that keeps one connection open per worker thread.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def _load_manifest(self):
+        """
+        Read the manifest: {poster URL: {'file', 'thumbnail', 'width', 'height'}}.
+        """
+        try:
+            with open(self._manifest_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self):
+        """
+        Write the manifest, replacing the old one at once.
+        """
+        with atomic_open(self._manifest_path, 'w', encoding='utf-8') as file:
+            json.dump(self._manifest, file, indent=2)
+
+    def _is_cached(self, url):
+        """
+        Tell whether the poster was downloaded before and its files are still there.
+        """
+        entry = self._manifest.get(url)
+        return bool(entry) and all(os.path.exists(os.path.join(self._cache_dir, entry[name]))
+                                   for name in ('file', 'thumbnail'))
+
+    def _make_thumbnail(self, content, digest, extension):
+        """
+        Write a thumbnail of the poster and return its file name, width and height.
+        Without Pillow installed, the poster itself is used and its size is unknown.
+        """
+        try:
+            from PIL import Image
+        except ImportError:
+            return digest + extension, None, None
+
+        try:
+            with Image.open(io.BytesIO(content)) as image:
+                image.thumbnail(self._thumbnail_size)
+                thumbnail_name = f"{digest}-thumb.jpg"
+                with atomic_open(os.path.join(self._cache_dir, thumbnail_name), 'wb') as file:
+                    image.convert('RGB').save(file, 'JPEG', quality=80, optimize=True)
+                return thumbnail_name, image.width, image.height
+        except OSError as error:
+            # Not an image Pillow can read, use the poster as it is
+            print(f"Could not make a thumbnail of {digest}{extension}: {error}")
+            return digest + extension, None, None
+
+    def _download(self, url):
+        """
+        Download a poster and store it with its thumbnail under the hash of its content.
+        Returns the manifest entry, or None if the download failed.
+        """
+        try:
+            response = self._session.get(url, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as error:
+            metrics.count('poster_download_errors')
+            print(f"Could not download the poster {url}: {error}")
+            return None
+        metrics.count('poster_downloads')
+
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        extension = os.path.splitext(url.split('?')[0])[1].lower() or '.jpg'
+        file_name = digest + extension
+        file_path = os.path.join(self._cache_dir, file_name)
+        # The same poster behind another URL is already stored
+        if not os.path.exists(file_path):
+            with atomic_open(file_path, 'wb') as file:
+                file.write(content)
+        thumbnail_name, width, height = self._make_thumbnail(content, digest, extension)
+        return {'file': file_name, 'thumbnail': thumbnail_name, 'width': width, 'height': height}
+
+    def mirror(self, urls):
+        """
+        Download the posters that are not in the local folder yet, several at a time.
+        Returns {poster URL: manifest entry} for all the posters that are available locally.
+        """
+        os.makedirs(self._cache_dir, exist_ok=True)
+        urls = {url for url in urls if url and url.startswith(('http://', 'https://'))}
+        missing = [url for url in urls if not self._is_cached(url)]
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                for url, entry in zip(missing, executor.map(self._download, missing)):
+                    if entry:
+                        self._manifest[url] = entry
+            self._save_manifest()
+
+        return {url: self._manifest[url] for url in urls if url in self._manifest}
+
+    @metrics.timed('site_posters')
+    def local_posters(self, urls, relative_to):
+        """
+        Mirror the posters and return {poster URL: (thumbnail path, width, height)},
+        with the paths relative to the folder of the page showing them.
+        """
+        posters = {}
+        for url, entry in self.mirror(urls).items():
+            thumbnail_path = os.path.join(self._cache_dir, entry['thumbnail'])
+            relative_path = os.path.relpath(thumbnail_path, relative_to).replace(os.sep, '/')
+            posters[url] = (relative_path, entry['width'], entry['height'])
+        return posters
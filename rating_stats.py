@@ -0,0 +1,215 @@
+from bisect import bisect_left, insort
+from collections import Counter
+
+# The percentiles included in the statistics
+PERCENTILES = (25, 75, 90)
+
+
+def parse_rating(rating_str):
+    """
+    Converts a rating string like '7.3/10' to a float,
+    returns None if the rating is not a valid number (e.g. 'N/A').
+    """
+    try:
+        return float(str(rating_str).split('/')[0].replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def percentile(sorted_values, percent):
+    """
+    Return the percentile of sorted values, interpolating between the two closest values
+    (the 50th percentile is the median).
+    """
+    position = percent / 100 * (len(sorted_values) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _value_at(counted_values, position):
+    """
+    Return the value at a position of the sorted values, given as sorted (value, count) pairs.
+    """
+    for value, count in counted_values:
+        if position < count:
+            return value
+        position -= count
+    return counted_values[-1][0]
+
+
+def summarize_ratings(ratings):
+    """
+    Calculate the statistics of IStorage.movie_statistics in one pass over (title, rating string) pairs,
+    e.g. movies read one at a time from a file. Only the number of movies with each distinct rating
+    is kept, not the ratings themselves, so the memory used doesn't grow with the number of movies.
+    Ratings that were already parsed can be given as floats.
+    Returns None if there are no movies.
+    """
+    counts = Counter()
+    total = 0.0
+    best_movies = []
+    worst_movies = []
+    skipped = []
+    movie_count = 0
+    for title, rating_str in ratings:
+        movie_count += 1
+        rating = rating_str if isinstance(rating_str, float) else parse_rating(rating_str)
+        if rating is None:
+            skipped.append(rating_str)
+            continue
+        if not counts or rating > best_rating:
+            best_rating, best_movies = rating, []
+        if not counts or rating < worst_rating:
+            worst_rating, worst_movies = rating, []
+        if rating == best_rating:
+            best_movies.append(title)
+        if rating == worst_rating:
+            worst_movies.append(title)
+        counts[rating] += 1
+        total += rating
+    if not movie_count:
+        return None
+
+    stats = RatingStats().summary()
+    stats['skipped'] = skipped
+    if counts:
+        counted_values = sorted(counts.items())
+        value_count = sum(counts.values())
+
+        def counted_percentile(percent):
+            # Like percentile(), on the values the counts stand for
+            position = percent / 100 * (value_count - 1)
+            lower = int(position)
+            lower_value = _value_at(counted_values, lower)
+            upper_value = _value_at(counted_values, min(lower + 1, value_count - 1))
+            return lower_value + (upper_value - lower_value) * (position - lower)
+
+        histogram = {}
+        for value, count in counted_values:
+            histogram[int(value)] = histogram.get(int(value), 0) + count
+        stats.update({
+            'average': total / value_count,
+            'median': counted_percentile(50),
+            'best_rating': best_rating,
+            'best_movies': best_movies,
+            'worst_rating': worst_rating,
+            'worst_movies': worst_movies,
+            'percentiles': {percent: counted_percentile(percent) for percent in PERCENTILES},
+            'histogram': histogram
+        })
+    return stats
+
+
+class RatingStats:
+    """
+    Keeps the movies' ratings as numbers, sorted, so the statistics don't have to parse
+    and scan all the ratings each time. Adding or removing a movie updates them.
+    """
+
+    def __init__(self):
+        # title -> numeric rating, for the movies with a valid rating
+        self._ratings = {}
+        # title -> rating string, for the movies without a valid rating (e.g. 'N/A')
+        self._invalid = {}
+        # All valid ratings, sorted
+        self._values = []
+        # rating -> titles with that rating, in the order they were added
+        self._titles_by_rating = {}
+        self._total = 0.0
+
+    @classmethod
+    def from_movies(cls, movies):
+        """
+        Parse the ratings of all the movies once.
+        """
+        stats = cls()
+        for title, details in movies.items():
+            rating_str = details.get('rating')
+            rating = parse_rating(rating_str)
+            if rating is None:
+                stats._invalid[title] = rating_str
+            else:
+                stats._ratings[title] = rating
+                stats._titles_by_rating.setdefault(rating, {})[title] = None
+        stats._values = sorted(stats._ratings.values())
+        stats._total = sum(stats._values)
+        return stats
+
+    def rating_of(self, title):
+        """
+        Return the numeric rating of a movie, or None if it has no valid rating.
+        """
+        return self._ratings.get(title)
+
+    def add(self, title, rating_str):
+        """
+        Add a movie's rating, replacing its previous rating.
+        """
+        self.remove(title)
+        rating = parse_rating(rating_str)
+        if rating is None:
+            self._invalid[title] = rating_str
+            return
+        self._ratings[title] = rating
+        insort(self._values, rating)
+        self._titles_by_rating.setdefault(rating, {})[title] = None
+        self._total += rating
+
+    def remove(self, title):
+        """
+        Remove a movie's rating.
+        """
+        self._invalid.pop(title, None)
+        rating = self._ratings.pop(title, None)
+        if rating is None:
+            return
+        del self._values[bisect_left(self._values, rating)]
+        titles = self._titles_by_rating[rating]
+        del titles[title]
+        if not titles:
+            del self._titles_by_rating[rating]
+        self._total -= rating
+
+    def histogram(self):
+        """
+        Return how many movies are rated in each whole-number range: {7: 3} means 3 movies rated 7 to 7.9.
+        """
+        histogram = {}
+        if not self._values:
+            return histogram
+        for start in range(int(self._values[0]), int(self._values[-1]) + 1):
+            count = bisect_left(self._values, start + 1) - bisect_left(self._values, start)
+            if count:
+                histogram[start] = count
+        return histogram
+
+    def summary(self):
+        """
+        Return the statistics in the format of IStorage.movie_statistics.
+        """
+        stats = {
+            'average': None,
+            'median': None,
+            'best_rating': None,
+            'best_movies': [],
+            'worst_rating': None,
+            'worst_movies': [],
+            'percentiles': {},
+            'histogram': {},
+            'skipped': list(self._invalid.values())
+        }
+        if self._values:
+            best_rating = self._values[-1]
+            worst_rating = self._values[0]
+            stats.update({
+                'average': self._total / len(self._values),
+                'median': percentile(self._values, 50),
+                'best_rating': best_rating,
+                'best_movies': list(self._titles_by_rating[best_rating]),
+                'worst_rating': worst_rating,
+                'worst_movies': list(self._titles_by_rating[worst_rating]),
+                'percentiles': {percent: percentile(self._values, percent) for percent in PERCENTILES},
+                'histogram': self.histogram()
+            })
+        return stats
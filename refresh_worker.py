@@ -0,0 +1,212 @@
+import argparse
+import json
+import signal
+import time
+
+import metrics
+from atomic_file import atomic_open
+from istorage import IStorage, is_missing_value
+
+# How many movies are fetched before their new details are saved, together with the checkpoint
+DEFAULT_BATCH_SIZE = 100
+# A movie OMDb couldn't complete (or find) is only asked for again after this many days
+DEFAULT_RETRY_AFTER_DAYS = 7
+DAY = 24 * 60 * 60
+CHECKPOINT_VERSION = 1
+
+
+def is_incomplete(details):
+    """
+    Tell whether a movie's year, rating or poster URL is missing (e.g. 'N/A').
+    """
+    return any(is_missing_value(details.get(key)) for key in ('year', 'rating', 'poster_url'))
+
+
+class RefreshWorker:
+    """
+    Fetches the movies with a missing year, rating or poster ('N/A') again from OMDb, and with max_age,
+    also the movies that weren't fetched for that long, so their details stay up to date.
+
+    The movies are fetched by a BatchImporter (concurrent workers, rate limit, retries with backoff)
+    and saved batch_size at a time in one batch of the storage, so the storage is only locked for the moment
+    the new details are written and the app can be used while the worker runs.
+    When each movie was last fetched is kept in a checkpoint file, saved after each batch: an interrupted run
+    continues where it stopped, and a movie OMDb can't complete is only asked for again after retry_after seconds.
+    """
+
+    def __init__(self, storage: IStorage, checkpoint_path=None, max_workers=4, requests_per_second=5, retries=3,
+                 batch_size=DEFAULT_BATCH_SIZE, max_age=None, retry_after=DEFAULT_RETRY_AFTER_DAYS * DAY,
+                 cache=None, session=None):
+        from batch_import import BatchImporter
+        self._storage = storage
+        files = storage.storage_files()
+        self._checkpoint_path = checkpoint_path or (files[0] + '.refresh.json' if files else None)
+        self._batch_size = batch_size
+        self._max_age = max_age
+        self._retry_after = retry_after
+        # The cached responses are the old details, only the new responses are cached
+        self._importer = BatchImporter(storage, max_workers=max_workers, requests_per_second=requests_per_second,
+                                       retries=retries, cache=cache, session=session)
+
+    def _load_checkpoint(self):
+        """
+        Return {title: {'fetched_at': time, 'complete': bool}} of the movies fetched before.
+        """
+        if not self._checkpoint_path:
+            return {}
+        try:
+            with open(self._checkpoint_path, 'r', encoding='utf-8') as file:
+                checkpoint = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if not isinstance(checkpoint, dict) or checkpoint.get('version') != CHECKPOINT_VERSION:
+            return {}
+        return checkpoint.get('movies', {})
+
+    def _save_checkpoint(self, fetched):
+        """
+        Save when the movies were last fetched.
+        """
+        if not self._checkpoint_path:
+            return
+        with atomic_open(self._checkpoint_path, 'w', encoding='utf-8') as file:
+            json.dump({'version': CHECKPOINT_VERSION, 'movies': fetched}, file)
+
+    def _is_due(self, details, entry, now):
+        """
+        Tell whether a movie has to be fetched again, given its checkpoint entry (None if it was never fetched).
+        """
+        if self._max_age is not None and (entry is None or entry['fetched_at'] < now - self._max_age):
+            return True
+        return is_incomplete(details) and (entry is None or entry['fetched_at'] < now - self._retry_after)
+
+    def find_due(self, fetched=None, now=None):
+        """
+        Return the titles of the movies to fetch again, in the stored order,
+        reading the movies one at a time from storages that can (see IStorage.iter_movies).
+        """
+        fetched = self._load_checkpoint() if fetched is None else fetched
+        now = time.time() if now is None else now
+        return [title for title, details in self._storage.iter_movies()
+                if self._is_due(details, fetched.get(title), now)]
+
+    def run(self, limit=None, should_stop=None):
+        """
+        Fetch the movies that are due (at most `limit`) and save their new details a batch at a time.
+        should_stop() is asked before each batch, to stop early and continue in the next run.
+        Returns the numbers of movies that were due, updated, unchanged, not found,
+        and that failed to be fetched (they are fetched again by the next run).
+        """
+        from batch_import import FETCH_FAILED
+        fetched = self._load_checkpoint()
+        titles = self.find_due(fetched)
+        if limit is not None:
+            titles = titles[:limit]
+        summary = {'due': len(titles), 'updated': 0, 'unchanged': 0, 'not_found': 0, 'failed': 0}
+
+        for start in range(0, len(titles), self._batch_size):
+            if should_stop is not None and should_stop():
+                print("Stopping, the next run continues with the remaining movies.")
+                break
+            batch_titles = titles[start:start + self._batch_size]
+            # Fetched outside of the storage's batch, the storage is only locked while the details are written
+            movies = self._importer.fetch_movies(batch_titles, use_cache=False)
+            if all(movie is FETCH_FAILED for movie in movies):
+                # OMDb can't be reached, the movies are tried again by the next run
+                summary['failed'] += len(batch_titles)
+                print("Couldn't fetch any of the movies from OMDb, stopping, try again later.")
+                break
+
+            wanted = set(batch_titles)
+            # Copies, a cached storage changes its movies in place
+            stored = {title: dict(details) for title, details
+                      in self._storage.iter_movies(lambda title, details: title in wanted)}
+            with self._storage.batch():
+                for title, movie in zip(batch_titles, movies):
+                    if movie is not None and movie is not FETCH_FAILED:
+                        _, year, rating, poster_url = movie
+                        self._storage.refresh_movie(title, year, rating, poster_url)
+
+            fetched_at = time.time()
+            for title, movie in zip(batch_titles, movies):
+                if movie is FETCH_FAILED:
+                    # Not checkpointed, so it's fetched again by the next run
+                    summary['failed'] += 1
+                    metrics.count('refresh_movies', result='failed')
+                    continue
+                details = dict(stored.get(title, {}))
+                if movie is None:
+                    # Checkpointed too, so a movie OMDb doesn't know is only asked for again after retry_after
+                    result = 'not_found'
+                else:
+                    # The details as refresh_movie saved them
+                    for key, value in zip(('year', 'rating', 'poster_url'), movie[1:]):
+                        if not is_missing_value(value):
+                            details[key] = value
+                    result = 'updated' if details != stored.get(title) else 'unchanged'
+                summary[result] += 1
+                metrics.count('refresh_movies', result=result)
+                fetched[title] = {'fetched_at': fetched_at, 'complete': not is_incomplete(details)}
+            self._save_checkpoint(fetched)
+            print(f"Refreshed {min(start + self._batch_size, len(titles))} of {len(titles)} movies "
+                  f"({summary['updated']} updated).")
+        return summary
+
+
+def main():
+    """
+    Fetch the incomplete movies of movies.json again, e.g. overnight from cron:
+    python refresh_worker.py --storage movies.json --rate 5
+    """
+    parser = argparse.ArgumentParser(description="Fetch the movies with missing or old details again from OMDb.")
+    parser.add_argument('--storage', default='movies.json', help="movies file: .json, .csv, .snap or .db/.sqlite")
+    parser.add_argument('--checkpoint', help="file remembering when each movie was fetched "
+                                             "(default: next to the movies file, .refresh.json)")
+    parser.add_argument('--max-age-days', type=float,
+                        help="also fetch the movies that weren't fetched for this many days")
+    parser.add_argument('--retry-after-days', type=float, default=DEFAULT_RETRY_AFTER_DAYS,
+                        help="ask again for a movie OMDb couldn't complete after this many days")
+    parser.add_argument('--limit', type=int, help="fetch at most this many movies in this run")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="movies saved at a time, and how much is done again after an interruption")
+    parser.add_argument('--workers', type=int, default=4, help="number of concurrent requests")
+    parser.add_argument('--rate', type=float, default=5, help="maximum requests per second")
+    parser.add_argument('--retries', type=int, default=3, help="retries per movie on transient errors")
+    parser.add_argument('--every-minutes', type=float,
+                        help="keep running, looking for movies to fetch again every this many minutes")
+    parser.add_argument('--omdb-cache', default='omdb_cache.db', help="SQLite file caching the OMDb responses")
+    args = parser.parse_args()
+
+    from movie_cli import open_file_storage
+    from omdb_cache import OmdbCache
+    storage = open_file_storage(args.storage)
+    worker = RefreshWorker(storage, args.checkpoint, max_workers=args.workers, requests_per_second=args.rate,
+                           retries=args.retries, batch_size=args.batch_size,
+                           max_age=args.max_age_days * DAY if args.max_age_days is not None else None,
+                           retry_after=args.retry_after_days * DAY, cache=OmdbCache(args.omdb_cache))
+
+    # On SIGTERM (e.g. the job is stopped in the morning), finish the running batch and stop
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: stopping.append(signal_number))
+    try:
+        while True:
+            summary = worker.run(args.limit, should_stop=lambda: bool(stopping))
+            print(f"{summary['due']} movies to fetch again: {summary['updated']} updated, "
+                  f"{summary['unchanged']} unchanged, {summary['not_found']} not found, "
+                  f"{summary['failed']} failed.")
+            if args.every_minutes is None or stopping:
+                break
+            deadline = time.monotonic() + args.every_minutes * 60
+            while not stopping and time.monotonic() < deadline:
+                time.sleep(1)
+            if stopping:
+                break
+    except KeyboardInterrupt:
+        print("Stopped, the next run continues from the last saved batch.")
+    finally:
+        if hasattr(storage, 'close'):
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,364 @@
+import heapq
+import math
+from contextlib import contextmanager
+
+from atomic_file import atomic_open
+from istorage import IStorage
+
+# Version of the index file format, older files are rebuilt
+INDEX_VERSION = 3
+# The part of a query's trigrams a movie needs to share to be found
+DEFAULT_MIN_SCORE = 0.5
+# Matches in the notes count less than matches in the title
+NOTE_WEIGHT = 0.8
+
+
+def trigrams(text):
+    """
+    Return the set of 3-letter pieces of the case-folded words of a text,
+    each word padded with a space so its start and end form trigrams too.
+    """
+    result = set()
+    for word in text.casefold().split():
+        padded = f" {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def _normalized(text):
+    """
+    Return a text case-folded, with its words separated by single spaces.
+    """
+    return ' '.join(text.casefold().split())
+
+
+def _text_trigrams(text):
+    """
+    Return the set of 3-letter pieces of a whole case-folded text padded with a space:
+    the trigrams() of its words and the pieces across its words, so any part of the text can be found.
+    """
+    padded = f" {_normalized(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)} if padded.strip() else set()
+
+
+class SearchIndex:
+    """
+    A trigram index of the movies' titles and notes for ranked, typo-tolerant search.
+    Each trigram points to the titles containing it, so a search only looks at
+    the movies sharing the query's rarest trigrams instead of scanning all of them.
+    """
+
+    def __init__(self):
+        # title -> (trigrams of the title, trigrams of the note)
+        self._documents = {}
+        # trigram -> titles whose title or note contains it
+        self._postings = {}
+        # casefolded title -> title, to find movies like the storages do
+        self._titles = {}
+
+    def __len__(self):
+        return len(self._documents)
+
+    def find(self, title):
+        """
+        Return the indexed title matching the given title case-insensitively, or None.
+        """
+        return self._titles.get(title.casefold())
+
+    @classmethod
+    def from_movies(cls, movies):
+        """
+        Build an index of all the movies.
+        """
+        index = cls()
+        for title, details in movies.items():
+            index.add(title, details.get('note') or '')
+        return index
+
+    def add(self, title, note=''):
+        """
+        Add a movie to the index, or replace its indexed note.
+        """
+        if title in self._documents:
+            self.remove(title)
+        title_grams = frozenset(_text_trigrams(title))
+        note_grams = frozenset(_text_trigrams(note))
+        self._documents[title] = (title_grams, note_grams)
+        self._titles.setdefault(title.casefold(), title)
+        for gram in title_grams | note_grams:
+            self._postings.setdefault(gram, set()).add(title)
+
+    def remove(self, title):
+        """
+        Remove a movie from the index.
+        """
+        title_grams, note_grams = self._documents.pop(title, (frozenset(), frozenset()))
+        if self._titles.get(title.casefold()) == title:
+            del self._titles[title.casefold()]
+        for gram in title_grams | note_grams:
+            titles = self._postings[gram]
+            titles.discard(title)
+            if not titles:
+                del self._postings[gram]
+
+    def search(self, query, limit=10, min_score=DEFAULT_MIN_SCORE):
+        """
+        Return up to `limit` (title, score) pairs of the best matching movies, best first.
+        Every movie whose title contains the query is found, scored 1 plus
+        the part of the query's trigrams found in the title, then the movies sharing enough
+        of the query's trigrams with their title (or, weighted less, their note).
+        """
+        query_text = _normalized(query)
+        if not query_text:
+            return []
+        query_grams = trigrams(query)
+        required = max(1, math.ceil(min_score * len(query_grams)))
+
+        # A movie sharing `required` trigrams with the query must contain
+        # at least one of its len - required + 1 rarest trigrams
+        rarest = sorted(query_grams, key=lambda gram: len(self._postings.get(gram, ())))
+        candidates = set()
+        for gram in rarest[:len(query_grams) - required + 1]:
+            candidates.update(self._postings.get(gram, ()))
+
+        # A title containing the query contains all its trigrams, even if it shares few
+        # of the word trigrams (e.g. 'her' in 'There'), shorter queries are looked for in all the titles
+        if len(query_text) < 3:
+            containing = self._documents.keys()
+        else:
+            postings = sorted((self._postings.get(query_text[i:i + 3], set())
+                               for i in range(len(query_text) - 2)), key=len)
+            containing = postings[0].intersection(*postings[1:])
+        matches = {title for title in containing if query_text in _normalized(title)}
+
+        scored = []
+        for title in candidates | matches:
+            title_grams, note_grams = self._documents[title]
+            title_overlap = len(query_grams & title_grams)
+            note_overlap = len(query_grams & note_grams)
+            if title not in matches and max(title_overlap, note_overlap) < required:
+                continue
+            score = max(title_overlap, NOTE_WEIGHT * note_overlap) / len(query_grams)
+            if title in matches:
+                score += 1
+            # On equal scores, titles closer in length to the query come first
+            scored.append((score, -len(title_grams), title))
+
+        best = heapq.nlargest(limit, scored) if limit is not None else sorted(scored, reverse=True)
+        return [(title, score) for score, _, title in best]
+
+    def save(self, file_path, signature):
+        """
+        Save the index to a file, with the signature of the storage files it was built from.
+        The file is written with marshal, which only stores plain data (dictionaries, sets, strings),
+        so unlike pickle, loading a tampered file can't run any code.
+        """
+        import marshal
+        with atomic_open(file_path, 'wb') as file:
+            marshal.dump({'version': INDEX_VERSION, 'signature': signature,
+                          'documents': self._documents, 'postings': self._postings,
+                          'titles': self._titles}, file)
+
+    @classmethod
+    def load(cls, file_path, signature):
+        """
+        Load an index saved for the given storage signature,
+        returns None if there's no such index or the storage changed since it was saved.
+        """
+        import marshal
+        try:
+            with open(file_path, 'rb') as file:
+                data = marshal.load(file)
+        except (FileNotFoundError, EOFError, ValueError, TypeError):
+            # No index, or one written in another format (e.g. by another Python version)
+            return None
+        if not isinstance(data, dict) or data.get('version') != INDEX_VERSION or data.get('signature') != signature:
+            return None
+        if not all(isinstance(data.get(name), dict) for name in ('documents', 'postings', 'titles')):
+            return None
+        index = cls()
+        index._documents = data['documents']
+        index._postings = data['postings']
+        index._titles = data['titles']
+        return index
+
+
+class SearchableStorage(IStorage):
+    """
+    Wraps another storage and searches its movies through a SearchIndex.
+    The index is kept up to date by the changes made through this storage,
+    rebuilt when the storage files are changed by someone else,
+    and saved next to the storage file (e.g. movies.json.search) by close().
+    """
+
+    def __init__(self, storage: IStorage, index_path=None):
+        self._storage = storage
+        files = storage.storage_files()
+        self._index_path = index_path or (files[0] + '.search' if files else None)
+        self._index = None
+        # The storage signature the index matches
+        self._signature = None
+        self._changed = False
+
+    def storage_files(self):
+        """
+        Return the files of the wrapped storage.
+        """
+        return self._storage.storage_files()
+
+    def load_movies(self):
+        """
+        Load the movies from the wrapped storage.
+        """
+        return self._storage.load_movies()
+
+    def iter_movies(self, filter=None):
+        """
+        Yield the movies of the wrapped storage.
+        """
+        return self._storage.iter_movies(filter)
+
+    def save_movies(self, movies):
+        """
+        Save the movies to the wrapped storage and index them again.
+        """
+        with self.lock():
+            self._storage.save_movies(movies)
+            self._index = SearchIndex.from_movies(movies)
+            self._signature_changed()
+
+    def _signature_changed(self):
+        """
+        Remember that the index matches the storage as it is now.
+        Called while holding the storage's lock, or the signature could be
+        the one of another process's change the index doesn't contain.
+        """
+        self._signature = self.file_signature()
+        self._changed = True
+
+    def _get_index(self):
+        """
+        Return the index, loading it from its file or building it
+        if there's none yet or the storage was changed by someone else.
+        """
+        signature = self.file_signature()
+        if self._index is None or signature != self._signature:
+            self._index = None
+            if self._index_path:
+                self._index = SearchIndex.load(self._index_path, signature)
+            if self._index is None:
+                self._index = SearchIndex.from_movies(self._storage.load_movies())
+                self._changed = True
+            self._signature = signature
+        return self._index
+
+    def close(self):
+        """
+        Save the index next to the storage file if it changed.
+        """
+        if self._index is not None and self._changed and self._index_path:
+            self._index.save(self._index_path, self._signature)
+            self._changed = False
+
+    @contextmanager
+    def batch(self):
+        """
+        Group several changes in a batch of the wrapped storage.
+        If the block raises an exception, the index is rebuilt from the storage.
+        """
+        try:
+            with self.lock():
+                with self._storage.batch():
+                    yield self
+                if self._index is not None:
+                    self._signature_changed()
+        except BaseException:
+            self._index = None
+            raise
+
+    def add_movie(self, title, year, rating, poster_url):
+        """
+        Add a movie to the wrapped storage and the index.
+        """
+        with self.lock():
+            index = self._get_index()
+            self._storage.add_movie(title, year, rating, poster_url)
+            # A movie that is already there keeps its title and note
+            if index.find(title) is None:
+                index.add(title)
+            self._signature_changed()
+
+    def delete_movie(self, title):
+        """
+        Delete a movie from the wrapped storage and the index.
+        """
+        with self.lock():
+            index = self._get_index()
+            stored_title = index.find(title)
+            deleted = self._storage.delete_movie(title)
+            if deleted and stored_title is not None:
+                index.remove(stored_title)
+            self._signature_changed()
+            return deleted
+
+    def update_movie(self, title, note):
+        """
+        Update a movie's note in the wrapped storage and the index.
+        """
+        with self.lock():
+            index = self._get_index()
+            stored_title = index.find(title)
+            updated = self._storage.update_movie(title, note)
+            if updated and stored_title is not None:
+                index.add(stored_title, note)
+            self._signature_changed()
+            return updated
+
+    def refresh_movie(self, title, year, rating, poster_url):
+        """
+        Replace a movie's fetched details in the wrapped storage, its title and note stay indexed.
+        """
+        with self.lock():
+            self._get_index()
+            refreshed = self._storage.refresh_movie(title, year, rating, poster_url)
+            self._signature_changed()
+            return refreshed
+
+    def search_movies(self, query, limit=None):
+        """
+        Return the (title, details) pairs of the movies best matching the query, best first.
+        Titles with typos and matches in the notes are found too.
+        """
+        movies = self._storage.load_movies()
+        return [(title, movies[title]) for title, _ in self._get_index().search(query, limit)
+                if title in movies]
+
+    def get_movie(self, title):
+        """
+        Return the movie with the given title found by the wrapped storage.
+        """
+        return self._storage.get_movie(title)
+
+    def top_movies(self, limit=10, by='rating'):
+        """
+        Return the top movies found by the wrapped storage.
+        """
+        return self._storage.top_movies(limit, by)
+
+    def movies_page(self, by='title', limit=20, cursor=None, descending=False):
+        """
+        Return a page of sorted movies from the wrapped storage.
+        """
+        return self._storage.movies_page(by, limit, cursor, descending)
+
+    def movies_in_range(self, by='year', low=None, high=None):
+        """
+        Return the movies in a range found by the wrapped storage.
+        """
+        return self._storage.movies_in_range(by, low, high)
+
+    def movie_statistics(self):
+        """
+        Return the rating statistics calculated by the wrapped storage.
+        """
+        return self._storage.movie_statistics()
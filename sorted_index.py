@@ -0,0 +1,112 @@
+import math
+import re
+from bisect import bisect_left, bisect_right, insort
+
+from rating_stats import parse_rating
+
+# The fields the movies can be sorted by
+SORT_FIELDS = ('title', 'rating', 'year')
+
+
+def parse_year(year_str):
+    """
+    Converts a year string to an int, using the first year of ranges like '2005–2010',
+    returns None if there's no year in it (e.g. 'N/A').
+    """
+    match = re.match(r'\s*(\d{4})', str(year_str))
+    return int(match.group(1)) if match else None
+
+
+def sort_value(by, title, details):
+    """
+    Returns the value a movie is sorted by, or None if the movie has no valid value for it.
+    Titles are sorted case-insensitively.
+    """
+    if by == 'title':
+        return title.casefold()
+    if by == 'rating':
+        return parse_rating(details.get('rating'))
+    if by == 'year':
+        return parse_year(details.get('year'))
+    raise ValueError(f"Movies can't be sorted by {by!r}, only by {', '.join(SORT_FIELDS)}")
+
+
+class SortedIndex:
+    """
+    The titles of the movies sorted by title, rating or year, kept as a sorted list of
+    (value, title) entries, so top-K, pages and ranges are found by binary search
+    instead of sorting all the movies. Movies without a valid value are left out.
+    """
+
+    def __init__(self, by):
+        sort_value(by, '', {})  # Fail early on an unknown field
+        self.by = by
+        self._entries = []
+
+    @classmethod
+    def from_movies(cls, by, movies):
+        """
+        Sort all the movies once.
+        """
+        index = cls(by)
+        entries = ((sort_value(by, title, details), title) for title, details in movies.items())
+        index._entries = sorted(entry for entry in entries if entry[0] is not None)
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, title, details):
+        """
+        Add a movie to the index.
+        """
+        value = sort_value(self.by, title, details)
+        if value is not None:
+            insort(self._entries, (value, title))
+
+    def remove(self, title, details):
+        """
+        Remove a movie from the index, details are the movie's details when it was added.
+        """
+        entry = (sort_value(self.by, title, details), title)
+        if entry[0] is None:
+            return
+        position = bisect_left(self._entries, entry)
+        if position < len(self._entries) and self._entries[position] == entry:
+            del self._entries[position]
+
+    def top(self, limit):
+        """
+        Return the titles of the `limit` movies with the highest values, highest first.
+        """
+        return [title for _, title in reversed(self._entries[max(0, len(self._entries) - limit):])]
+
+    def page(self, limit, cursor=None, descending=False):
+        """
+        Return the titles of the next `limit` movies after the cursor, and the cursor of the page's
+        last movie to get the next page with (None if there are no more movies).
+        """
+        if descending:
+            end = bisect_left(self._entries, tuple(cursor)) if cursor else len(self._entries)
+            entries = self._entries[max(0, end - limit):end][::-1]
+            has_more = end - limit > 0
+        else:
+            # Entries are unique (value, title) pairs, the page starts right after the cursor's entry
+            start = bisect_right(self._entries, tuple(cursor)) if cursor else 0
+            entries = self._entries[start:start + limit]
+            has_more = start + limit < len(self._entries)
+        next_cursor = entries[-1] if entries and has_more else None
+        return [title for _, title in entries], next_cursor
+
+    def in_range(self, low=None, high=None):
+        """
+        Return the titles of the movies with low <= value <= high, in ascending order.
+        """
+        start = bisect_left(self._entries, (low,)) if low is not None else 0
+        if high is None:
+            end = len(self._entries)
+        else:
+            # (next value after high,) sorts after every (high, title) entry
+            next_value = math.nextafter(high, math.inf) if isinstance(high, (int, float)) else high + '\0'
+            end = bisect_left(self._entries, (next_value,))
+        return [title for _, title in self._entries[start:end]]
@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+
+import metrics
+from istorage import ConflictError, IStorage
+
+
+class CachedStorage(IStorage):
+    """
+    Keeps the movies of another storage in memory.
+    The cached movies are reused until one of the storage files changes on disk
+    (its modification time or size), and every save is written through to the storage.
+    """
+
+    def __init__(self, storage: IStorage):
+        self._storage = storage
+        self._movies = None
+        self._signature = None
+
+    def storage_files(self):
+        """
+        Return the files of the wrapped storage.
+        """
+        return self._storage.storage_files()
+
+    def invalidate(self):
+        """
+        Drop the cached movies, so the next load reads the storage again.
+        """
+        self._movies = None
+        self._signature = None
+
+    @contextmanager
+    def batch(self):
+        """
+        Group several changes like IStorage.batch.
+        If the block raises an exception, the cache is dropped,
+        since the changes were already made to the cached movies.
+        """
+        try:
+            with super().batch():
+                yield self
+        except BaseException:
+            self.invalidate()
+            raise
+
+    def load_movies(self):
+        """
+        Return the cached movies, loading them from the storage only
+        if nothing is cached yet or the storage files changed since.
+        The returned dictionary is the cache itself, so changes to it
+        have to be saved with save_movies.
+        """
+        signature = self.file_signature()
+        if self._movies is None or signature != self._signature:
+            metrics.count('storage_cache_misses')
+            self._movies = self._storage.load_movies()
+            self._signature = signature
+        else:
+            metrics.count('storage_cache_hits')
+        return self._movies
+
+    def save_movies_if_unchanged(self, movies, version):
+        """
+        Save the movies like IStorage.save_movies_if_unchanged,
+        on a conflict the cache is dropped, since the change was already made to the cached movies.
+        """
+        try:
+            super().save_movies_if_unchanged(movies, version)
+        except ConflictError:
+            self.invalidate()
+            raise
+
+    def save_movies(self, movies):
+        """
+        Save the movies to the storage and keep them as the cached movies.
+        """
+        try:
+            self._storage.save_movies(movies)
+        except BaseException:
+            # The movies may have been changed in place, they don't match the storage anymore
+            self.invalidate()
+            raise
+        self._movies = movies
+        self._signature = self.file_signature()
@@ -1,57 +1,345 @@
 import csv
+import heapq
+from contextlib import contextmanager
 
-from istorage import IStorage
-from typing import Dict, Any
+import metrics
+from atomic_file import atomic_open
+from istorage import IStorage, is_missing_value
+from rating_stats import summarize_ratings
+from sorted_index import sort_value
+from typing import Dict, Any, List
+
+# Specifies the order of columns in the CSV file.
+FIELDNAMES = ['title', 'year', 'rating', 'poster_url', 'notes']
+
+
+class _Unchanged(Exception):
+    """
+    Raised to drop a rewrite of the file that didn't change any movie.
+    """
+
+
+def _row(title, details):
+    """
+    Return the CSV row of a movie, its note is kept in the 'notes' column.
+    """
+    return {
+        'title': title,
+        'year': details.get('year', ''),
+        'rating': details.get('rating', ''),
+        'poster_url': details.get('poster_url', ''),
+        'notes': details.get('note') or ''
+    }
+
+
+def _apply_changes(title, details, changes):
+    """
+    Apply a movie's changes, in the order they were made, to its details (None if the movie isn't stored).
+    The changes are ('add', title, year, rating, poster_url), ('delete',), ('note', note)
+    and ('refresh', year, rating, poster_url), see IStorage.refresh_movie.
+    Returns the movie's title and new details, which are None if the movie was deleted.
+    """
+    details = dict(details) if details is not None else None
+    for change in changes:
+        if change[0] == 'add':
+            _, new_title, year, rating, poster_url = change
+            if details is None:
+                title = new_title
+                details = {'year': year, 'rating': rating, 'poster_url': poster_url}
+                continue
+            print(f"Oh hunny, the movie {new_title} is already there, pick another movie.")
+            # Update only if necessary
+            for key, value in (('year', year), ('rating', rating), ('poster_url', poster_url)):
+                if not details.get(key):
+                    details[key] = value
+        elif change[0] == 'delete':
+            details = None
+        elif details is None:
+            continue
+        elif change[0] == 'refresh':
+            for key, value in zip(('year', 'rating', 'poster_url'), change[1:]):
+                if not is_missing_value(value):
+                    details[key] = value
+        else:
+            details['note'] = change[1]
+    return title, details
 
 
 class StorageCsv(IStorage):
+    """
+    Stores the movies in a CSV file and reads it one row at a time,
+    so listing, searching and the statistics use the same memory however big the file is.
+    Changes are applied by copying the file row by row into a new file, patching the changed rows
+    on the way and appending the new movies, and a batch applies all its changes in a single copy.
+    """
+
     def __init__(self, file_path):
         self._file_path = file_path
+        # The changes of the running batch: {casefolded title: [change, ...]}, see _apply_changes
+        self._changes = None
+        # Whether the movies changed in the running batch are stored after their changes
+        self._stored_after_changes = None
+        # The casefolded titles stored in the file, read once by the running batch when it first needs them
+        self._stored_titles = None
 
-    def load_movies(self) -> Dict[str, Dict[str, Any]]:
+    def storage_files(self) -> List[str]:
         """
-        Load movies from a CSV file and return a dictionary.
+        Return the CSV file the movies are stored in.
+        """
+        return [self._file_path]
+
+    def iter_movies(self, filter=None):
+        """
+        Yield the movies row by row from the CSV file, see IStorage.iter_movies.
         """
-        # Each row in the CSV file corresponds to an entry in the dictionary.
         # The movie title serves as the key, and the associated details
-        # (year, rating, poster URL, optional notes) are stored as values in a nested dictionary.
-        movies = {}
+        # (year, rating, poster URL, optional note) are stored as values in a nested dictionary.
         try:
             with open(self._file_path, mode='r', newline='', encoding='utf-8') as file:
                 # Reads the CSV file and parses each row into a dictionary
                 # where the keys are the column headers from the first row of the CSV file.
-                reader = csv.DictReader(file)
-                for row in reader:
-                    movies[row['title']] = {
+                for row in csv.DictReader(file):
+                    title = row['title']
+                    details = {
                         'year': row['year'],
                         'rating': row['rating'],
-                        'poster_url': row['poster_url'],
-                        'notes': row.get('notes', '')
+                        'poster_url': row['poster_url']
                     }
+                    # The 'notes' column holds the movie's 'note', left out if there's none
+                    if row.get('notes'):
+                        details['note'] = row['notes']
+                    if filter is None or filter(title, details):
+                        yield title, details
         except FileNotFoundError:
-            # If file doesn't exist, return an empty dictionary
-            pass
-        return movies
+            # If file doesn't exist, there are no movies
+            return
 
+    @metrics.timed('storage_load', storage='csv')
+    def load_movies(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Load movies from a CSV file and return a dictionary.
+        """
+        return dict(self.iter_movies())
+
+    @metrics.timed('storage_save', storage='csv')
     def save_movies(self, movies: Dict[str, Dict[str, str]]) -> None:
         """
         Save movies to CSV file from a dictionary.
-        This function uses the csv module to write data into a CSV file in a structured format.
-        """
-        with open(self._file_path, mode='w', newline='', encoding='utf-8') as file:
-            # Specifies the order of columns in the CSV file.
-            # This list should match the keys used in the dictionary.
-            fieldnames = ['title', 'year', 'rating', 'poster_url', 'notes']
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-
-            # Writes the header row to the CSV file using the column names specified in 'fieldnames'.
-            writer.writeheader()
-
-            for title, details in movies.items():
-                writer.writerow({
-                    'title': title,
-                    'year': details['year'],
-                    'rating': details['rating'],
-                    'poster_url': details['poster_url'],
-                    'notes': details.get('notes', '')
-                })
+        The file is written to a temporary file first and then replaces the old file at once.
+        """
+        with self.lock():
+            with atomic_open(self._file_path, mode='w', newline='', encoding='utf-8') as file:
+                writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+
+                # Writes the header row to the CSV file using the column names specified in 'fieldnames'.
+                writer.writeheader()
+
+                for title, details in movies.items():
+                    writer.writerow(_row(title, details))
+            self._count_write()
+
+    @metrics.timed('storage_rewrite', storage='csv')
+    def _rewrite(self, changes):
+        """
+        Copy the file row by row into a new file, applying the changes ({casefolded title: [change, ...]})
+        to the first movie with each title and appending the movies that weren't stored.
+        The file is only replaced if a movie changed. The copy is made while holding the storage's lock,
+        so the changes of other processes made in the meantime are never lost.
+        Returns the casefolded titles of the changed movies that were stored.
+        """
+        found = set()
+        if not changes:
+            return found
+        with self.lock():
+            try:
+                with atomic_open(self._file_path, mode='w', newline='', encoding='utf-8') as file:
+                    writer = csv.DictWriter(file, fieldnames=FIELDNAMES)
+                    writer.writeheader()
+                    changed = False
+                    for title, details in self.iter_movies():
+                        key = title.casefold()
+                        if key in changes and key not in found:
+                            found.add(key)
+                            new_title, new_details = _apply_changes(title, details, changes[key])
+                            changed = changed or (new_title, new_details) != (title, details)
+                            title, details = new_title, new_details
+                        if details is not None:
+                            writer.writerow(_row(title, details))
+
+                    for key, movie_changes in changes.items():
+                        if key not in found:
+                            title, details = _apply_changes(None, None, movie_changes)
+                            if details is not None:
+                                writer.writerow(_row(title, details))
+                                changed = True
+                    if not changed:
+                        raise _Unchanged()
+            except _Unchanged:
+                return found
+            self._count_write()
+        return found
+
+    def _is_stored(self, key):
+        """
+        Tell whether a movie is stored, counting the changes of the running batch.
+        The file's titles are read in one pass the first time, not once per changed movie.
+        """
+        if key not in self._stored_after_changes:
+            if self._stored_titles is None:
+                self._stored_titles = {title.casefold() for title, _ in self.iter_movies()}
+            self._stored_after_changes[key] = key in self._stored_titles
+        return self._stored_after_changes[key]
+
+    def _change(self, title, change):
+        """
+        Apply a change to a movie, or add it to the running batch's changes.
+        Returns whether the movie was stored before the change.
+        """
+        key = title.casefold()
+        if self._changes is None:
+            return key in self._rewrite({key: [change]})
+
+        # Adding a movie doesn't tell whether it was stored, so it doesn't have to read the file
+        was_stored = self._is_stored(key) if change[0] != 'add' else None
+        self._changes.setdefault(key, []).append(change)
+        if change[0] in ('add', 'delete'):
+            self._stored_after_changes[key] = change[0] == 'add'
+        return was_stored
+
+    @contextmanager
+    def batch(self):
+        """
+        Group several changes, so the file is copied once when the batch ends.
+        If the block raises an exception, none of its changes are saved.
+        """
+        if self._changes is not None:
+            yield self
+            return
+        self._changes = {}
+        self._stored_after_changes = {}
+        try:
+            yield self
+            self._rewrite(self._changes)
+        finally:
+            self._changes = None
+            self._stored_after_changes = None
+            self._stored_titles = None
+
+    def add_movie(self, title, year, rating, poster_url):
+        """
+        Add a movie to the file, or fill in its missing details if it is already there.
+        """
+        self._change(title, ('add', title, year, rating, poster_url))
+
+    def add_movies(self, movies_to_add):
+        """
+        Add several movies, given as (title, year, rating, poster_url) tuples, in one copy of the file.
+        """
+        with self.batch():
+            for title, year, rating, poster_url in movies_to_add:
+                self.add_movie(title, year, rating, poster_url)
+
+    def delete_movie(self, title):
+        """
+        Delete a movie from the file.
+        """
+        return self._change(title, ('delete',))
+
+    def delete_movies(self, titles):
+        """
+        Delete several movies in one copy of the file.
+        Returns the titles that were found and deleted.
+        """
+        if self._changes is not None:
+            return super().delete_movies(titles)
+        changes = {}
+        for title in titles:
+            changes.setdefault(title.casefold(), [('delete',)])
+        found = self._rewrite(changes)
+        deleted = []
+        for title in titles:
+            # Like deleting them one by one, a movie given twice is only deleted once
+            if title.casefold() in found:
+                found.discard(title.casefold())
+                deleted.append(title)
+        return deleted
+
+    def update_movie(self, title, note):
+        """
+        Update a movie with a note.
+        """
+        return self._change(title, ('note', note))
+
+    def refresh_movie(self, title, year, rating, poster_url):
+        """
+        Replace a movie's fetched details, see IStorage.refresh_movie.
+        """
+        return self._change(title, ('refresh', year, rating, poster_url))
+
+    def update_movies(self, notes):
+        """
+        Update several movies with notes, given as a {title: note} dictionary, in one copy of the file.
+        Returns the titles that were found and updated.
+        """
+        if self._changes is not None:
+            return super().update_movies(notes)
+        changes = {}
+        for title, note in notes.items():
+            changes.setdefault(title.casefold(), []).append(('note', note))
+        found = self._rewrite(changes)
+        return [title for title in notes if title.casefold() in found]
+
+    def get_movie(self, title):
+        """
+        Return the movie with the given title, compared case-insensitively,
+        reading the file only until the movie is found.
+        """
+        key = title.casefold()
+        return next(self.iter_movies(lambda stored_title, details: stored_title.casefold() == key), None)
+
+    def _sort_entries(self, by):
+        """
+        Yield the movies with a valid value to sort by as ((value, title), title, details).
+        """
+        for title, details in self.iter_movies():
+            value = sort_value(by, title, details)
+            if value is not None:
+                yield (value, title), title, details
+
+    def top_movies(self, limit=10, by='rating'):
+        """
+        Return the `limit` movies with the highest rating or year, see IStorage.top_movies.
+        Only `limit` movies are kept while the file is read.
+        """
+        top = heapq.nlargest(limit, self._sort_entries(by), key=lambda entry: entry[0])
+        return [(title, details) for _, title, details in top]
+
+    def movies_page(self, by='title', limit=20, cursor=None, descending=False):
+        """
+        Return a page of the sorted movies and the cursor of the next page, see IStorage.movies_page.
+        The file is read once per page, keeping only the page's movies.
+        """
+        cursor = tuple(cursor) if cursor else None
+        entries = self._sort_entries(by)
+        if cursor is not None:
+            entries = (entry for entry in entries if (entry[0] < cursor if descending else entry[0] > cursor))
+        select = heapq.nlargest if descending else heapq.nsmallest
+        # One movie more than the page tells whether there's a next page
+        page = select(limit + 1, entries, key=lambda entry: entry[0])
+        next_cursor = page[limit - 1][0] if limit and len(page) > limit else None
+        return [(title, details) for _, title, details in page[:limit]], next_cursor
+
+    def movies_in_range(self, by='year', low=None, high=None):
+        """
+        Return the movies with low <= value <= high in ascending order, see IStorage.movies_in_range.
+        """
+        in_range = [entry for entry in self._sort_entries(by)
+                    if (low is None or entry[0][0] >= low) and (high is None or entry[0][0] <= high)]
+        in_range.sort(key=lambda entry: entry[0])
+        return [(title, details) for _, title, details in in_range]
+
+    def movie_statistics(self):
+        """
+        Return the rating statistics, see IStorage.movie_statistics, calculated in one pass over the file.
+        """
+        return summarize_ratings((title, details['rating']) for title, details in self.iter_movies())
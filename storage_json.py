@@ -1,11 +1,35 @@
 import json
+import os
+
+import metrics
+from atomic_file import atomic_open
 from istorage import IStorage
 
+# Once the journal grows past this size, it is compacted into the JSON file
+JOURNAL_MAX_BYTES = 1024 * 1024
+
 
 class StorageJson(IStorage):
-    def __init__(self, file_path):
+    def __init__(self, file_path, journal=False, journal_max_bytes=JOURNAL_MAX_BYTES):
+        """
+        With journal=True, adding, deleting and updating a movie appends a line
+        to a journal file next to the JSON file instead of rewriting the whole file
+        (changes made in a batch() are saved to the JSON file at once instead).
+        The journal is replayed on load and compacted into the JSON file
+        when it grows past journal_max_bytes.
+        """
         self.file_path = file_path
+        self.journal = journal
+        self.journal_path = file_path + '.journal'
+        self.journal_max_bytes = journal_max_bytes
+
+    def storage_files(self):
+        """
+        Return the JSON file the movies are stored in and its journal.
+        """
+        return [self.file_path, self.journal_path]
 
+    @metrics.timed('storage_load', storage='json')
     def load_movies(self):
         """
         Load the movies from the JSON file.
@@ -17,11 +41,122 @@ class StorageJson(IStorage):
                     movies = {}
         except (FileNotFoundError, json.JSONDecodeError):
             movies = {}
+        self._replay_journal(movies)
         return movies
 
+    @metrics.timed('storage_save', storage='json')
     def save_movies(self, movies):
         """
         Save the movies to the JSON file.
+        The file is replaced atomically, so a crash never leaves a half-written file behind
+        and readers never see one, and the journal is removed while holding the storage's lock.
+        """
+        with self.lock():
+            with atomic_open(self.file_path, 'w', encoding="utf-8") as file:
+                json.dump(movies, file, indent=2)
+            # The saved movies already contain all the journaled changes
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+            self._count_write()
+
+    def _replay_journal(self, movies):
+        """
+        Apply the changes recorded in the journal (if there is one) to the movies.
+        """
+        try:
+            with open(self.journal_path, 'r', encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut off by a crash while it was written, the change never completed
+                        continue
+                    if entry['op'] == 'set':
+                        movies[entry['title']] = entry['details']
+                    elif entry['op'] == 'delete':
+                        movies.pop(entry['title'], None)
+        except FileNotFoundError:
+            pass
+
+    @metrics.timed('storage_journal_append', storage='json')
+    def _append_to_journal(self, entry):
+        """
+        Append a change to the journal,
+        and compact the journal into the JSON file once it gets too big.
+        The storage is locked, so the changes appended by other processes are never lost by a compaction.
+        """
+        line = (json.dumps(entry) + '\n').encode("utf-8")
+        with self.lock():
+            with open(self.journal_path, 'ab+') as file:
+                # Don't continue a line cut off by a crash, or this change would be lost with it
+                if file.tell() > 0:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b'\n':
+                        line = b'\n' + line
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+                journal_size = file.tell()
+            self._count_write()
+            if journal_size > self.journal_max_bytes:
+                # Load the movies again, with the changes journaled by the other processes
+                self.save_movies(self.load_movies())
+
+    def add_movie(self, title, year, rating, poster_url):
+        """
+        Add a movie to the JSON file, or to the journal in journal mode.
+        """
+        if not self.journal or self._batch_movies is not None:
+            return super().add_movie(title, year, rating, poster_url)
+        # Loaded, changed and appended under the lock, so no other writer's change is overwritten
+        with self.lock():
+            movies = self.load_movies()
+            stored_title = self._apply_add_movie(movies, title, year, rating, poster_url)
+            self._append_to_journal({'op': 'set', 'title': stored_title, 'details': movies[stored_title]})
+
+    def delete_movie(self, title):
+        """
+        Delete a movie from the JSON file, or record the deletion in the journal in journal mode.
+        """
+        if not self.journal or self._batch_movies is not None:
+            return super().delete_movie(title)
+        with self.lock():
+            movies = self.load_movies()
+            title_to_delete = self._find_title(movies, title)
+            if title_to_delete:
+                self._remove_movie(movies, title_to_delete)
+                self._append_to_journal({'op': 'delete', 'title': title_to_delete})
+                return True
+            return False
+
+    def refresh_movie(self, title, year, rating, poster_url):
+        """
+        Replace a movie's fetched details, in journal mode the change is recorded in the journal.
+        """
+        if not self.journal or self._batch_movies is not None:
+            return super().refresh_movie(title, year, rating, poster_url)
+        with self.lock():
+            movies = self.load_movies()
+            movie_title = self._find_title(movies, title)
+            if movie_title is None:
+                return False
+            if self._apply_refresh_movie(movies, movie_title, year, rating, poster_url):
+                self._append_to_journal({'op': 'set', 'title': movie_title, 'details': movies[movie_title]})
+            return True
+
+    def update_movie(self, title, note):
+        """
+        Update a movie with a note, in journal mode the change is recorded in the journal.
         """
-        with open(self.file_path, 'w', encoding="utf-8") as file:
-            json.dump(movies, file, indent=2)
+        if not self.journal or self._batch_movies is not None:
+            return super().update_movie(title, note)
+        with self.lock():
+            movies = self.load_movies()
+            movie_title = self._find_title(movies, title)
+            if movie_title:
+                movies[movie_title]['note'] = note
+                self._append_to_journal({'op': 'set', 'title': movie_title, 'details': movies[movie_title]})
+                return True
+            return False
@@ -0,0 +1,424 @@
+import math
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import ItemsView, MutableMapping
+
+import metrics
+from atomic_file import atomic_open
+from istorage import IStorage
+from rating_stats import parse_rating, summarize_ratings
+from sorted_index import parse_year
+
+MAGIC = b'MOVIESNP'
+SNAPSHOT_VERSION = 1
+# magic, version, number of movies, number of strings, then the offset of each section
+HEADER = struct.Struct('<8sIII4xQQQQQQ')
+# The string columns, each an array of string ids (one per movie)
+STRING_COLUMNS = ('title', 'year', 'rating', 'poster_url', 'note')
+# The string id of a missing value (a movie without a note)
+NO_STRING = 0xFFFFFFFF
+# The year value of a movie without a valid year, the rating value of one without a valid rating is NaN
+NO_YEAR = -2 ** 31
+# Whether a file can be replaced while it's memory-mapped, Windows refuses to
+CAN_REPLACE_MAPPED_FILE = os.name != 'nt'
+
+
+def _align(offset):
+    """
+    Round an offset up to a multiple of 8, so the arrays can be read in place.
+    """
+    return (offset + 7) // 8 * 8
+
+
+def _to_bytes(values):
+    """
+    Return the bytes of an array, in little-endian byte order.
+    """
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def write_snapshot(file_path, movies):
+    """
+    Write (title, details) pairs to a snapshot file:
+    a table of the distinct strings (each year, rating or poster URL that repeats is stored once),
+    a column of string ids per field, the years and ratings as numbers, and the row numbers sorted by title.
+    The file replaces the old one at once.
+    """
+    strings = {}
+    string_list = []
+    columns = {name: array('I') for name in STRING_COLUMNS}
+    year_values = array('i')
+    rating_values = array('d')
+
+    def string_id(value):
+        if value is None:
+            return NO_STRING
+        if value not in strings:
+            strings[value] = len(string_list)
+            string_list.append(value)
+        return strings[value]
+
+    titles = []
+    for title, details in movies:
+        titles.append(title)
+        columns['title'].append(string_id(title))
+        columns['year'].append(string_id(details.get('year')))
+        columns['rating'].append(string_id(details.get('rating')))
+        columns['poster_url'].append(string_id(details.get('poster_url')))
+        columns['note'].append(string_id(details.get('note') or None))
+        year = parse_year(details.get('year'))
+        year_values.append(NO_YEAR if year is None else year)
+        rating = parse_rating(details.get('rating'))
+        rating_values.append(math.nan if rating is None else rating)
+    title_order = array('I', sorted(range(len(titles)), key=titles.__getitem__))
+
+    encoded = [string.encode('utf-8') for string in string_list]
+    string_offsets = array('Q', [0])
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+
+    sections = [_to_bytes(string_offsets), b''.join(encoded),
+                b''.join(_to_bytes(columns[name]) for name in STRING_COLUMNS),
+                _to_bytes(year_values), _to_bytes(rating_values), _to_bytes(title_order)]
+    offsets = []
+    offset = HEADER.size
+    for section in sections:
+        offset = _align(offset)
+        offsets.append(offset)
+        offset += len(section)
+
+    with atomic_open(file_path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, len(titles), len(string_list), *offsets))
+        for section_offset, section in zip(offsets, sections):
+            file.write(b'\0' * (section_offset - file.tell()))
+            file.write(section)
+
+
+class _SnapshotReader:
+    """
+    A memory-mapped snapshot file. Nothing is decoded when it's opened,
+    the arrays are read in place and each string is decoded when it's first asked for.
+    """
+
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < HEADER.size:
+                raise ValueError(f"{file_path} is not a movies snapshot")
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = HEADER.unpack_from(self._data)
+        except struct.error:
+            header = (None, None)
+        if header[:2] != (MAGIC, SNAPSHOT_VERSION):
+            self._data.close()
+            raise ValueError(f"{file_path} is not a movies snapshot (version {SNAPSHOT_VERSION})")
+        self._read_sections(header)
+        # Decoded strings by id, there are few distinct years and ratings
+        self._strings = {}
+
+    def _read_sections(self, header):
+        """
+        Find the arrays of the file's sections, from the values of its header.
+        """
+        (_, _, self.count, string_count, string_offsets, string_data, columns,
+         year_values, rating_values, title_order) = header
+        self._string_offsets = self._array('Q', string_offsets, string_count + 1)
+        self._string_data = string_data
+        self._columns = {name: self._array('I', columns + position * 4 * self.count, self.count)
+                         for position, name in enumerate(STRING_COLUMNS)}
+        self.year_values = self._array('i', year_values, self.count)
+        self.rating_values = self._array('d', rating_values, self.count)
+        self._title_order = self._array('I', title_order, self.count)
+
+    def _array(self, typecode, offset, count):
+        """
+        Return a section of the file as a sequence of numbers, without copying it on little-endian machines.
+        """
+        size = array(typecode).itemsize * count
+        if sys.byteorder == 'little':
+            return memoryview(self._data)[offset:offset + size].cast(typecode)
+        values = array(typecode, self._data[offset:offset + size])
+        values.byteswap()
+        return values
+
+    def detach(self):
+        """
+        Copy the snapshot into memory and unmap the file, so the file can be replaced
+        while the movies already loaded from it are still read.
+        """
+        if not isinstance(self._data, mmap.mmap):
+            return
+        mapped = self._data
+        self._data = mapped[:]
+        # The mapping can only be closed once no array points into it
+        for values in [self._string_offsets, self.year_values, self.rating_values, self._title_order,
+                       *self._columns.values()]:
+            if isinstance(values, memoryview):
+                values.release()
+        self._read_sections(HEADER.unpack_from(self._data))
+        mapped.close()
+
+    def string(self, string_id):
+        """
+        Return the string with the given id, None for NO_STRING.
+        """
+        if string_id == NO_STRING:
+            return None
+        string = self._strings.get(string_id)
+        if string is None:
+            start = self._string_data + self._string_offsets[string_id]
+            end = self._string_data + self._string_offsets[string_id + 1]
+            string = self._data[start:end].decode('utf-8')
+            # Titles, poster URLs and notes are mostly unique, only the short strings are worth keeping
+            if end - start <= 16:
+                self._strings[string_id] = string
+        return string
+
+    def title(self, row):
+        """
+        Return the title of the movie in a row.
+        """
+        return self.string(self._columns['title'][row])
+
+    def rating(self, row):
+        """
+        Return the rating string of the movie in a row.
+        """
+        return self.string(self._columns['rating'][row])
+
+    def details(self, row):
+        """
+        Decode the details of the movie in a row.
+        """
+        details = {
+            'year': self.string(self._columns['year'][row]),
+            'rating': self.string(self._columns['rating'][row]),
+            'poster_url': self.string(self._columns['poster_url'][row])
+        }
+        note = self.string(self._columns['note'][row])
+        if note is not None:
+            details['note'] = note
+        return details
+
+    def find(self, title):
+        """
+        Return the row of the movie with the given title, or None, by binary search over the sorted titles.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.title(self._title_order[middle]) < title:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.title(self._title_order[low]) == title:
+            return self._title_order[low]
+        return None
+
+
+class _SnapshotItems(ItemsView):
+    """
+    The (title, details) pairs of SnapshotMovies, decoded row by row.
+    """
+
+    def __iter__(self):
+        return self._mapping.iter_items()
+
+
+class SnapshotMovies(MutableMapping):
+    """
+    The movies of a snapshot as a dictionary. A movie's details are decoded from the file
+    when the movie is looked up, and the changes are kept in memory until the movies are saved.
+    Details looked up by title can be changed in place, like in a dictionary.
+    """
+
+    def __init__(self, reader):
+        self._reader = reader
+        # The decoded (and maybe changed) details of the snapshot's movies that were looked up
+        self._decoded = {}
+        # The titles of the snapshot's movies that were deleted
+        self._deleted = set()
+        # The movies added after the snapshot was written, in the order they were added
+        self._added = {}
+
+    def _row(self, title):
+        """
+        Return the row of a movie of the snapshot that wasn't deleted, or None.
+        """
+        if self._reader is None or title in self._deleted:
+            return None
+        return self._reader.find(title)
+
+    def __getitem__(self, title):
+        if title in self._added:
+            return self._added[title]
+        if title in self._decoded:
+            return self._decoded[title]
+        row = self._row(title)
+        if row is None:
+            raise KeyError(title)
+        details = self._decoded[title] = self._reader.details(row)
+        return details
+
+    def __contains__(self, title):
+        return title in self._added or title in self._decoded or self._row(title) is not None
+
+    def __setitem__(self, title, details):
+        if title in self._added or (title not in self._decoded and self._row(title) is None):
+            self._added[title] = details
+        else:
+            self._decoded[title] = details
+
+    def __delitem__(self, title):
+        if title in self._added:
+            del self._added[title]
+        elif self._row(title) is not None:
+            self._deleted.add(title)
+            self._decoded.pop(title, None)
+        else:
+            raise KeyError(title)
+
+    def __len__(self):
+        count = self._reader.count if self._reader is not None else 0
+        return count - len(self._deleted) + len(self._added)
+
+    def __iter__(self):
+        for title, _ in self.iter_items(decode=False):
+            yield title
+
+    def iter_items(self, decode=True):
+        """
+        Yield the (title, details) pairs in the stored order, then the added movies.
+        With decode=False, only the titles are decoded and the details are None.
+        """
+        if self._reader is not None:
+            for row in range(self._reader.count):
+                title = self._reader.title(row)
+                if title in self._deleted:
+                    continue
+                details = self._decoded.get(title)
+                if details is None and decode:
+                    details = self._reader.details(row)
+                yield title, details
+        yield from self._added.items()
+
+    def items(self):
+        return _SnapshotItems(self)
+
+
+class StorageSnapshot(IStorage):
+    """
+    Stores the movies in a compact binary snapshot file (see write_snapshot) that is memory-mapped,
+    so loading the movies doesn't parse the file: a movie is decoded when it's looked up,
+    and the statistics are calculated from the stored numeric ratings.
+    Saving writes a new snapshot of all the movies.
+    """
+
+    def __init__(self, file_path):
+        self._file_path = file_path
+        self._reader = None
+        self._reader_signature = None
+
+    def storage_files(self):
+        """
+        Return the snapshot file.
+        """
+        return [self._file_path]
+
+    def _get_reader(self):
+        """
+        Return the mapped snapshot, mapping it again if the file was replaced, or None if there's no file.
+        """
+        signature = self.file_signature()
+        if self._reader is None or signature != self._reader_signature:
+            try:
+                self._reader = _SnapshotReader(self._file_path)
+            except FileNotFoundError:
+                self._reader = None
+            self._reader_signature = signature
+        return self._reader
+
+    @metrics.timed('storage_load', storage='snapshot')
+    def load_movies(self):
+        """
+        Return the movies of the snapshot, without decoding them yet.
+        """
+        return SnapshotMovies(self._get_reader())
+
+    @metrics.timed('storage_save', storage='snapshot')
+    def save_movies(self, movies):
+        """
+        Write the movies to a new snapshot.
+        Where a mapped file can't be replaced (Windows), the old snapshot is copied into memory and unmapped first,
+        the snapshot can't be saved while another process has it mapped though.
+        """
+        with self.lock():
+            if not CAN_REPLACE_MAPPED_FILE and self._reader is not None:
+                # The movies may still be read from the old snapshot while they're written
+                self._reader.detach()
+            write_snapshot(self._file_path, movies.items())
+            self._count_write()
+
+    def iter_movies(self, filter=None):
+        """
+        Yield the movies row by row from the snapshot, see IStorage.iter_movies.
+        """
+        for title, details in self.load_movies().items():
+            if filter is None or filter(title, details):
+                yield title, details
+
+    def movie_statistics(self):
+        """
+        Return the rating statistics, see IStorage.movie_statistics,
+        calculated from the numeric ratings of the snapshot without decoding the movies.
+        """
+        reader = self._get_reader()
+        if reader is None or not reader.count:
+            return None
+        values = reader.rating_values
+        # The rows are passed as titles, only the best and worst are decoded
+        stats = summarize_ratings((row, values[row] if not math.isnan(values[row]) else reader.rating(row))
+                                  for row in range(reader.count))
+        stats['best_movies'] = [reader.title(row) for row in stats['best_movies']]
+        stats['worst_movies'] = [reader.title(row) for row in stats['worst_movies']]
+        return stats
+
+
+def convert(source_path, target_path):
+    """
+    Copy the movies of one movies file to another, of any format movie_cli.open_file_storage knows
+    (e.g. movies.json to movies.snap and back). Returns the number of movies copied.
+    """
+    from movie_cli import open_file_storage
+    source = open_file_storage(source_path)
+    target = open_file_storage(target_path)
+    # A plain dictionary, the JSON storage can't write the snapshot's lazy mapping
+    movies = dict(source.load_movies().items())
+    target.save_movies(movies)
+    for storage in (source, target):
+        if hasattr(storage, 'close'):
+            storage.close()
+    return len(movies)
+
+
+def main():
+    """
+    Convert a movies file to a snapshot, or a snapshot back to JSON or CSV:
+    python storage_snapshot.py movies.json movies.snap
+    """
+    if len(sys.argv) != 3:
+        print("Usage: python storage_snapshot.py <source: .json|.csv|.snap|.db> <target: .json|.csv|.snap|.db>")
+        sys.exit(1)
+    source_path, target_path = sys.argv[1:]
+    count = convert(source_path, target_path)
+    print(f"Converted {count} movies from {source_path} to {target_path}.")
+
+
+if __name__ == "__main__":
+    main()
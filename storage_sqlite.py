@@ -0,0 +1,407 @@
+import sqlite3
+import sys
+from contextlib import contextmanager
+
+import metrics
+from istorage import IStorage, is_missing_value
+from rating_stats import PERCENTILES, parse_rating
+from sorted_index import SORT_FIELDS, parse_year
+
+# The column each sort field is sorted by
+SORT_COLUMNS = {'title': 'title', 'rating': 'rating_value', 'year': 'year_value'}
+# Movies with the same value are sorted by their exact title, like sorted_index.SortedIndex,
+# not by the title column's case-insensitive collation
+TITLE_ORDER = "title COLLATE BINARY"
+
+
+class StorageSqlite(IStorage):
+    """
+    Stores the movies in an SQLite database.
+    Unlike the file storages, adding, deleting and updating a movie only touches its own row,
+    and search, sorting and statistics are calculated by the database.
+    """
+
+    def __init__(self, db_path):
+        self._db_path = db_path
+        self._connection = sqlite3.connect(db_path)
+        self._create_tables()
+
+    def _create_tables(self):
+        """
+        Create the movies table and its indexes if they don't exist yet.
+        The title is compared case-insensitively (COLLATE NOCASE),
+        rating_value and year_value hold the rating and year as numbers
+        so they can be sorted, compared and aggregated.
+        """
+        with self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS movies (
+                    title TEXT PRIMARY KEY COLLATE NOCASE,
+                    year TEXT,
+                    year_value INTEGER,
+                    rating TEXT,
+                    rating_value REAL,
+                    poster_url TEXT,
+                    note TEXT
+                )
+            """)
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(movies)")]
+            if 'year_value' not in columns:
+                # A database created before the year_value column was added
+                self._connection.execute("ALTER TABLE movies ADD COLUMN year_value INTEGER")
+                self._connection.executemany(
+                    "UPDATE movies SET year_value = ? WHERE rowid = ?",
+                    [(parse_year(year), rowid) for rowid, year
+                     in self._connection.execute("SELECT rowid, year FROM movies").fetchall()])
+                self._connection.execute("DROP INDEX IF EXISTS movies_year")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS movies_rating_value ON movies (rating_value)")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS movies_year_value ON movies (year_value)")
+
+    def close(self):
+        """
+        Close the database connection.
+        """
+        self._connection.close()
+
+    @contextmanager
+    def batch(self):
+        """
+        Run several changes in a single transaction,
+        none of them are saved if the block raises an exception.
+        Like the file storages, the storage's lock is held while writing.
+        """
+        if self._batch_depth:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+            return
+        with self.lock():
+            with self._connection:
+                self._batch_depth = 1
+                try:
+                    yield self
+                finally:
+                    self._batch_depth = 0
+            self._count_write()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run a change in its own transaction, or in the running batch's transaction.
+        """
+        if self._batch_depth:
+            yield
+        else:
+            with self.lock():
+                with self._connection:
+                    yield
+                self._count_write()
+
+    def storage_files(self):
+        """
+        Return the database file the movies are stored in.
+        """
+        return [self._db_path]
+
+    @staticmethod
+    def _row_to_details(row):
+        """
+        Convert a (year, rating, poster_url, note) row to the details dictionary used by the app.
+        """
+        year, rating, poster_url, note = row
+        details = {
+            'year': year,
+            'rating': rating,
+            'poster_url': poster_url
+        }
+        if note is not None:
+            details['note'] = note
+        return details
+
+    def _select_movies(self, where="", parameters=(), order_by="rowid", limit=None):
+        """
+        Return the (title, details) pairs of the movies matching the where clause.
+        """
+        # LIMIT -1 means no limit in SQLite
+        cursor = self._connection.execute(
+            f"SELECT title, year, rating, poster_url, note FROM movies {where} "
+            f"ORDER BY {order_by} LIMIT ?",
+            (*parameters, -1 if limit is None else limit))
+        return [(row[0], self._row_to_details(row[1:])) for row in cursor]
+
+    def iter_movies(self, filter=None):
+        """
+        Yield the movies row by row from the database, see IStorage.iter_movies.
+        """
+        for row in self._connection.execute(
+                "SELECT title, year, rating, poster_url, note FROM movies ORDER BY rowid"):
+            title, details = row[0], self._row_to_details(row[1:])
+            if filter is None or filter(title, details):
+                yield title, details
+
+    @metrics.timed('storage_load', storage='sqlite')
+    def load_movies(self):
+        """
+        Load all the movies from the database.
+        """
+        return dict(self._select_movies())
+
+    @metrics.timed('storage_save', storage='sqlite')
+    def save_movies(self, movies):
+        """
+        Replace all the movies in the database with the given movies.
+        """
+        with self._transaction():
+            self._connection.execute("DELETE FROM movies")
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO movies "
+                "(title, year, year_value, rating, rating_value, poster_url, note) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(title,
+                  details.get('year'),
+                  parse_year(details.get('year')),
+                  details.get('rating'),
+                  parse_rating(details.get('rating')),
+                  details.get('poster_url'),
+                  details.get('note') or None)
+                 for title, details in movies.items()])
+
+    def _insert_movie(self, title, year, rating, poster_url):
+        """
+        Insert a movie, or fill in its missing details if it is already there.
+        Runs inside the caller's transaction.
+        """
+        exists = self._connection.execute(
+            "SELECT 1 FROM movies WHERE title = ?", (title,)).fetchone()
+        if exists:
+            print(f"Oh hunny, the movie {title} is already there, pick another movie.")
+            # Update only if necessary
+            self._connection.execute(
+                """
+                UPDATE movies SET
+                    year_value = CASE WHEN NULLIF(year, '') IS NULL THEN ? ELSE year_value END,
+                    year = COALESCE(NULLIF(year, ''), ?),
+                    rating_value = CASE WHEN NULLIF(rating, '') IS NULL THEN ? ELSE rating_value END,
+                    rating = COALESCE(NULLIF(rating, ''), ?),
+                    poster_url = COALESCE(NULLIF(poster_url, ''), ?)
+                WHERE title = ?
+                """,
+                (parse_year(year), year, parse_rating(rating), rating, poster_url, title))
+        else:
+            self._connection.execute(
+                "INSERT INTO movies (title, year, year_value, rating, rating_value, poster_url) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (title, year, parse_year(year), rating, parse_rating(rating), poster_url))
+
+    def add_movie(self, title, year, rating, poster_url):
+        """
+        Add a movie to the database,
+        or fill in its missing details if it is already there.
+        """
+        with self._transaction():
+            self._insert_movie(title, year, rating, poster_url)
+
+    def delete_movie(self, title):
+        """
+        Delete a movie from the database, the title is matched case-insensitively.
+        """
+        with self._transaction():
+            cursor = self._connection.execute("DELETE FROM movies WHERE title = ?", (title,))
+        return cursor.rowcount > 0
+
+    def update_movie(self, title, note):
+        """
+        Update a movie with a note, the title is matched case-insensitively.
+        """
+        with self._transaction():
+            cursor = self._connection.execute(
+                "UPDATE movies SET note = ? WHERE title = ?", (note, title))
+        return cursor.rowcount > 0
+
+    def refresh_movie(self, title, year, rating, poster_url):
+        """
+        Replace a movie's year, rating and poster URL with newly fetched ones,
+        keeping the stored value of each one that is missing from the fetched movie.
+        Returns whether the movie was found, the title is matched case-insensitively.
+        """
+        assignments = []
+        parameters = []
+        if not is_missing_value(year):
+            assignments.append("year = ?, year_value = ?")
+            parameters += [year, parse_year(year)]
+        if not is_missing_value(rating):
+            assignments.append("rating = ?, rating_value = ?")
+            parameters += [rating, parse_rating(rating)]
+        if not is_missing_value(poster_url):
+            assignments.append("poster_url = ?")
+            parameters.append(poster_url)
+        with self._transaction():
+            if not assignments:
+                return self._connection.execute(
+                    "SELECT 1 FROM movies WHERE title = ?", (title,)).fetchone() is not None
+            cursor = self._connection.execute(
+                f"UPDATE movies SET {', '.join(assignments)} WHERE title = ?", parameters + [title])
+        return cursor.rowcount > 0
+
+    def get_movie(self, title):
+        """
+        Return the movie with the given title, compared case-insensitively by the title's index.
+        """
+        movies = self._select_movies("WHERE title = ?", (title,), limit=1)
+        return movies[0] if movies else None
+
+    def search_movies(self, query, limit=None):
+        """
+        Return the movies whose title contains the query, ignoring case.
+        """
+        # Escape the LIKE wildcards, so they are searched for literally
+        pattern = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return self._select_movies("WHERE title LIKE ? ESCAPE '\\'", (f"%{pattern}%",),
+                                   limit=limit)
+
+    @staticmethod
+    def _sort_column(by):
+        """
+        Return the column a sort field is sorted by.
+        """
+        if by not in SORT_COLUMNS:
+            raise ValueError(f"Movies can't be sorted by {by!r}, only by {', '.join(SORT_FIELDS)}")
+        return SORT_COLUMNS[by]
+
+    def top_movies(self, limit=10, by='rating'):
+        """
+        Return the `limit` movies with the highest rating or year (or the last titles), highest first,
+        read through the column's index.
+        """
+        column = self._sort_column(by)
+        return self._select_movies(f"WHERE {column} IS NOT NULL", order_by=f"{column} DESC, {TITLE_ORDER} DESC",
+                                   limit=limit)
+
+    def movies_page(self, by='title', limit=20, cursor=None, descending=False):
+        """
+        Return a page of the movies sorted by title, rating or year and the cursor of the next page,
+        see IStorage.movies_page.
+        """
+        column = self._sort_column(by)
+        direction, comparison = ("DESC", "<") if descending else ("ASC", ">")
+        where = f"WHERE {column} IS NOT NULL"
+        parameters = ()
+        if cursor:
+            where += f" AND ({column}, {TITLE_ORDER}) {comparison} (?, ?)"
+            parameters = tuple(cursor)
+        # One movie more than the page, to know whether there's a next page
+        movies = self._select_movies(where, parameters, order_by=f"{column} {direction}, {TITLE_ORDER} {direction}",
+                                     limit=limit + 1)
+        page = movies[:limit]
+        next_cursor = None
+        if len(movies) > limit:
+            last_title, last_details = page[-1]
+            value = {'title': last_title, 'rating': parse_rating(last_details['rating']),
+                     'year': parse_year(last_details['year'])}[by]
+            next_cursor = (value, last_title)
+        return page, next_cursor
+
+    def movies_in_range(self, by='year', low=None, high=None):
+        """
+        Return the movies with low <= value <= high in ascending order, read through the column's index.
+        """
+        column = self._sort_column(by)
+        where = f"WHERE {column} IS NOT NULL"
+        parameters = ()
+        if low is not None:
+            where += f" AND {column} >= ?"
+            parameters += (low,)
+        if high is not None:
+            where += f" AND {column} <= ?"
+            parameters += (high,)
+        return self._select_movies(where, parameters, order_by=f"{column}, {TITLE_ORDER}")
+
+    def _rating_percentile(self, count, percent):
+        """
+        Return the percentile of the count valid ratings like rating_stats.percentile,
+        reading only the one or two ratings around it through the rating index.
+        """
+        position = percent / 100 * (count - 1)
+        lower = int(position)
+        values = [row[0] for row in self._connection.execute(
+            "SELECT rating_value FROM movies WHERE rating_value IS NOT NULL "
+            "ORDER BY rating_value LIMIT 2 OFFSET ?", (lower,))]
+        upper_value = values[1] if len(values) > 1 else values[0]
+        return values[0] + (upper_value - values[0]) * (position - lower)
+
+    def movie_statistics(self):
+        """
+        Return statistics about the movie ratings, calculated by the database.
+        See IStorage.movie_statistics for the keys.
+        """
+        total, count, average, best_rating, worst_rating = self._connection.execute(
+            "SELECT COUNT(*), COUNT(rating_value), AVG(rating_value), "
+            "MAX(rating_value), MIN(rating_value) FROM movies").fetchone()
+        if not total:
+            return None
+
+        skipped = [row[0] for row in self._connection.execute(
+            "SELECT rating FROM movies WHERE rating_value IS NULL ORDER BY rowid")]
+        stats = {
+            'average': average,
+            'median': None,
+            'best_rating': best_rating,
+            'best_movies': [],
+            'worst_rating': worst_rating,
+            'worst_movies': [],
+            'percentiles': {},
+            'histogram': {},
+            'skipped': skipped
+        }
+        if count:
+            stats['median'] = self._rating_percentile(count, 50)
+            stats['percentiles'] = {percent: self._rating_percentile(count, percent)
+                                    for percent in PERCENTILES}
+            stats['histogram'] = dict(self._connection.execute(
+                "SELECT CAST(rating_value AS INTEGER), COUNT(*) FROM movies "
+                "WHERE rating_value IS NOT NULL GROUP BY 1 ORDER BY 1").fetchall())
+            stats['best_movies'] = [row[0] for row in self._connection.execute(
+                "SELECT title FROM movies WHERE rating_value = ? ORDER BY rowid", (best_rating,))]
+            stats['worst_movies'] = [row[0] for row in self._connection.execute(
+                "SELECT title FROM movies WHERE rating_value = ? ORDER BY rowid", (worst_rating,))]
+        return stats
+
+
+def migrate_to_sqlite(source, db_path):
+    """
+    Copy all the movies from another storage (e.g. StorageJson or StorageCsv)
+    into an SQLite database and return the new storage.
+    """
+    storage = StorageSqlite(db_path)
+    storage.save_movies(source.load_movies())
+    return storage
+
+
+def main():
+    """
+    Migrate a movies.json or CSV file to an SQLite database:
+    python storage_sqlite.py movies.json movies.db
+    """
+    if len(sys.argv) != 3:
+        print("Usage: python storage_sqlite.py <movies.json|movies.csv> <movies.db>")
+        sys.exit(1)
+
+    source_path, db_path = sys.argv[1:]
+    if source_path.lower().endswith('.csv'):
+        from storage_csv import StorageCsv
+        source = StorageCsv(source_path)
+    else:
+        from storage_json import StorageJson
+        source = StorageJson(source_path)
+
+    storage = migrate_to_sqlite(source, db_path)
+    print(f"Migrated {len(storage.load_movies())} movies from {source_path} to {db_path}.")
+    storage.close()
+
+
+if __name__ == "__main__":
+    main()
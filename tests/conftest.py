@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the app are in the folder above the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
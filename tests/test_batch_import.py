@@ -0,0 +1,75 @@
+import time
+
+from batch_import import BatchImporter
+from benchmark import StubOmdbServer
+from storage_json import StorageJson
+
+TITLES = ['Casablanca', 'Psycho', 'Metropolis', 'Sin City', 'Eraserhead']
+
+
+class CountingStorage(StorageJson):
+    """
+    Counts how many times the movies are written.
+    """
+
+    def __init__(self, file_path):
+        super().__init__(file_path)
+        self.saves = 0
+
+    def save_movies(self, movies):
+        self.saves += 1
+        super().save_movies(movies)
+
+
+def test_503_responses_are_retried(tmp_path):
+    storage = StorageJson(str(tmp_path / 'movies.json'))
+    # Every second request fails, one worker sends them in order
+    with StubOmdbServer(error_every=2) as server:
+        importer = BatchImporter(storage, max_workers=1, requests_per_second=0, retries=3, backoff=0)
+        found, failed = importer.import_titles(TITLES)
+        requests = server.requests
+
+    assert [movie[0] for movie in found] == TITLES
+    assert failed == []
+    # The first movie is fetched at once, each of the others after one 503
+    assert requests == 1 + 2 * (len(TITLES) - 1)
+
+
+def test_a_movie_is_given_up_after_the_retries(tmp_path, capsys):
+    storage = StorageJson(str(tmp_path / 'movies.json'))
+    with StubOmdbServer(error_every=1) as server:
+        importer = BatchImporter(storage, max_workers=2, requests_per_second=0, retries=2, backoff=0)
+        found, failed = importer.import_titles(['Casablanca', 'Psycho'])
+        requests = server.requests
+
+    assert found == []
+    assert failed == ['Casablanca', 'Psycho']
+    assert requests == 2 * 3
+    assert '503' in capsys.readouterr().out
+    assert storage.load_movies() == {}
+
+
+def test_the_requests_are_rate_limited(tmp_path):
+    storage = StorageJson(str(tmp_path / 'movies.json'))
+    titles = [f"Movie {number}" for number in range(10)]
+    with StubOmdbServer():
+        importer = BatchImporter(storage, max_workers=8, requests_per_second=20, backoff=0)
+        start = time.monotonic()
+        found, _ = importer.import_titles(titles)
+        elapsed = time.monotonic() - start
+
+    assert len(found) == len(titles)
+    # The first request goes at once, the next 9 one every 1/20 second, however many workers there are
+    assert elapsed >= 9 / 20 * 0.9
+
+
+def test_the_found_movies_are_added_in_one_write(tmp_path):
+    storage = CountingStorage(str(tmp_path / 'movies.json'))
+    with StubOmdbServer():
+        importer = BatchImporter(storage, max_workers=4, requests_per_second=0, backoff=0)
+        found, failed = importer.import_titles(TITLES + ['Unknown Movie', '  ', 'Following\n'])
+
+    assert storage.saves == 1
+    assert failed == ['Unknown Movie']
+    assert list(storage.load_movies()) == TITLES + ['Following']
+    assert [movie[0] for movie in found] == TITLES + ['Following']
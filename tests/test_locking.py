@@ -0,0 +1,124 @@
+import multiprocessing
+import time
+
+import pytest
+
+from istorage import ConflictError
+from storage_csv import StorageCsv
+from storage_json import StorageJson
+
+PROCESSES = 4
+MOVIES_PER_PROCESS = 15
+# Small enough for the journal to be compacted into the JSON file several times while the writers run
+JOURNAL_MAX_BYTES = 2000
+
+spawn = multiprocessing.get_context('spawn')
+
+
+def open_storage(kind, file_path):
+    if kind == 'json':
+        return StorageJson(file_path)
+    if kind == 'journal':
+        return StorageJson(file_path, journal=True, journal_max_bytes=JOURNAL_MAX_BYTES)
+    return StorageCsv(file_path)
+
+
+def write_movies(kind, file_path, writer):
+    storage = open_storage(kind, file_path)
+    for number in range(MOVIES_PER_PROCESS):
+        title = f"Movie {writer}-{number}"
+        storage.add_movie(title, '2000', 'N/A', '')
+        storage.update_movie(title, f"note {writer}-{number}")
+        storage.refresh_movie(title, '2001', '7.5', 'https://example.com/poster.jpg')
+        # Every writer also changes the first movie, changing the same movie as the others
+        storage.update_movie('Shared', f"note of {writer}")
+
+
+def run_processes(target, args_list):
+    processes = [spawn.Process(target=target, args=args) for args in args_list]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+
+@pytest.mark.parametrize('kind', ['json', 'journal', 'csv'])
+def test_concurrent_writers_lose_no_change(tmp_path, kind):
+    file_path = str(tmp_path / ('movies.csv' if kind == 'csv' else 'movies.json'))
+    open_storage(kind, file_path).add_movie('Shared', '1999', '8.0', '')
+
+    run_processes(write_movies, [(kind, file_path, writer) for writer in range(PROCESSES)])
+
+    movies = open_storage(kind, file_path).load_movies()
+    assert len(movies) == 1 + PROCESSES * MOVIES_PER_PROCESS
+    for writer in range(PROCESSES):
+        for number in range(MOVIES_PER_PROCESS):
+            assert movies[f"Movie {writer}-{number}"] == {
+                'year': '2001', 'rating': '7.5', 'poster_url': 'https://example.com/poster.jpg',
+                'note': f"note {writer}-{number}"}
+    assert movies['Shared']['note'] in {f"note of {writer}" for writer in range(PROCESSES)}
+    assert movies['Shared']['rating'] == '8.0'
+
+
+def update_note(file_path):
+    StorageJson(file_path, journal=True).update_movie('Psycho', 'shower scene')
+
+
+def test_a_journaled_change_keeps_the_change_made_while_waiting_for_the_lock(tmp_path):
+    file_path = str(tmp_path / 'movies.json')
+    storage = StorageJson(file_path, journal=True)
+    storage.add_movie('Psycho', '1960', 'N/A', '')
+
+    with storage.lock():
+        writer = spawn.Process(target=update_note, args=(file_path,))
+        writer.start()
+        # The other process is started and waits for the lock, before or after loading the movies
+        time.sleep(1)
+        assert storage.refresh_movie('Psycho', '1960', '8.5', '')
+    writer.join(timeout=60)
+    assert writer.exitcode == 0
+
+    assert StorageJson(file_path).load_movies()['Psycho'] == {
+        'year': '1960', 'rating': '8.5', 'poster_url': '', 'note': 'shower scene'}
+
+
+class FrozenStat:
+    """
+    The stat of a file on a clock too coarse to tell two saves apart, with its inode number reused.
+    """
+    st_ino = 1
+    st_mtime_ns = 1
+    st_size = 1
+
+    def __init__(self, stat):
+        self._stat = stat
+
+    def __getattr__(self, name):
+        return getattr(self._stat, name)
+
+
+@pytest.mark.parametrize('file_name', ['movies.json', 'movies.csv', 'movies.snap', 'movies.db'])
+def test_the_version_changes_with_every_write_even_if_the_files_look_the_same(tmp_path, monkeypatch, file_name):
+    import istorage
+    from movie_cli import open_file_storage
+
+    storage = open_file_storage(str(tmp_path / file_name))
+    storage.add_movie('Psycho', '1960', '8.5', '')
+    files = set(storage.storage_files())
+    real_stat = istorage.os.stat
+
+    def stat(path, **options):
+        result = real_stat(path, **options)
+        return FrozenStat(result) if path in files else result
+
+    monkeypatch.setattr(istorage.os, 'stat', stat)
+
+    version = storage.version()
+    movies = storage.load_movies()
+    storage.update_movie('Psycho', 'first')
+    storage.update_movie('Psycho', 'second')
+    assert storage.version() != version
+    with pytest.raises(ConflictError):
+        storage.save_movies_if_unchanged(movies, version)
+    assert storage.load_movies()['Psycho']['note'] == 'second'
@@ -0,0 +1,123 @@
+import json
+import os
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def metrics_off():
+    metrics.disable()
+    yield
+    metrics.disable()
+
+
+def test_nothing_is_collected_or_written_while_the_metrics_are_off(tmp_path):
+    assert metrics.get_metrics() is None
+    assert metrics.timer('omdb_request') is metrics._DISABLED
+    assert metrics.command('list') is metrics._DISABLED
+
+    @metrics.timed('work')
+    def work():
+        return 42
+
+    with metrics.timer('omdb_request'):
+        metrics.count('omdb_requests')
+        metrics.set_gauge('movies', 3)
+    assert work() == 42
+
+    metrics.write(str(tmp_path / 'metrics.json'))
+    assert os.listdir(tmp_path) == []
+
+
+def test_the_timers_counters_and_gauges_are_written_as_json(tmp_path):
+    collected = metrics.enable()
+
+    @metrics.timed('storage_load', storage='json')
+    def load():
+        return {}
+
+    load()
+    load()
+    with metrics.timer('omdb_request'):
+        pass
+    metrics.count('omdb_requests', status='ok')
+    metrics.count('omdb_requests', 2, status='ok')
+    metrics.set_gauge('movies', 3)
+    metrics.set_gauge('movies', 5)
+
+    file_path = str(tmp_path / 'metrics.json')
+    metrics.write(file_path)
+    with open(file_path, encoding='utf-8') as file:
+        written = json.load(file)
+
+    assert written['started_at'] == collected.started_at
+    timers = {timer['name']: timer for timer in written['timers']}
+    assert timers['storage_load']['labels'] == {'storage': 'json'}
+    assert timers['storage_load']['count'] == 2
+    assert timers['storage_load']['max_seconds'] <= timers['storage_load']['total_seconds']
+    assert timers['omdb_request']['count'] == 1
+    # Writing the file is counted by atomic_open too
+    assert {'name': 'omdb_requests', 'labels': {'status': 'ok'}, 'value': 3} in written['counters']
+    assert written['gauges'] == [{'name': 'movies', 'labels': {}, 'value': 5}]
+
+
+def test_the_metrics_are_written_in_the_prometheus_format(tmp_path):
+    collected = metrics.enable()
+    collected.observe('omdb_request', 0.5)
+    collected.observe('omdb_request', 1.5)
+    metrics.count('posters', status='ok')
+    metrics.set_gauge('movies', 7, title='Say "Hi"\\\n')
+
+    file_path = str(tmp_path / 'metrics.prom')
+    metrics.write(file_path)
+    with open(file_path, encoding='utf-8') as file:
+        lines = file.read().splitlines()
+
+    assert lines == [
+        '# TYPE movies_omdb_request_seconds summary',
+        'movies_omdb_request_seconds_count 2',
+        'movies_omdb_request_seconds_sum 2.0',
+        '# TYPE movies_omdb_request_seconds_max gauge',
+        'movies_omdb_request_seconds_max 1.5',
+        '# TYPE movies_posters_total counter',
+        'movies_posters_total{status="ok"} 1',
+        '# TYPE movies_movies gauge',
+        'movies_movies{title="Say \\"Hi\\"\\\\\\n"} 7',
+    ]
+
+
+def test_a_command_is_timed_and_its_memory_traced(capsys):
+    collected = metrics.enable(trace_memory=True)
+    with metrics.command('list'):
+        data = [str(number) for number in range(1000)]
+    assert data
+
+    assert collected.timers[('command', (('command', 'list'),))][0] == 1
+    assert collected.gauges[('command_peak_memory_bytes', (('command', 'list'),))] > 0
+    assert 'Peak memory of list' in capsys.readouterr().err
+
+
+def test_a_command_is_profiled_into_the_profile_folder(tmp_path, capsys):
+    profile_dir = str(tmp_path / 'profiles')
+    metrics.enable(profile_dir=profile_dir)
+    with metrics.command('list'):
+        pass
+
+    assert os.listdir(profile_dir) == [f"list-{os.getpid()}-1.prof"]
+    assert 'python -m pstats' in capsys.readouterr().err
+
+
+def test_the_metrics_are_enabled_from_the_environment(monkeypatch, tmp_path):
+    for variable in (metrics.METRICS_FILE_VARIABLE, metrics.PROFILE_DIR_VARIABLE, metrics.TRACE_MEMORY_VARIABLE):
+        monkeypatch.delenv(variable, raising=False)
+    monkeypatch.setenv(metrics.TRACE_MEMORY_VARIABLE, '0')
+    assert metrics.enable_from_environment() is None
+    assert metrics.get_metrics() is None
+
+    file_path = str(tmp_path / 'metrics.prom')
+    monkeypatch.setenv(metrics.METRICS_FILE_VARIABLE, file_path)
+    assert metrics.enable_from_environment() == file_path
+    assert metrics.get_metrics() is not None
+    assert not metrics.get_metrics().trace_memory
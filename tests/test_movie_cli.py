@@ -0,0 +1,48 @@
+import json
+
+import file_lock
+import movie_cli
+from benchmark import StubOmdbServer
+from movie_app import MovieApp
+
+
+def test_add_fetches_the_movies_before_locking_the_storage(tmp_path, monkeypatch, capsys):
+    file_path = str(tmp_path / 'movies.json')
+    locked_while_fetching = []
+    fetch_data = MovieApp.fetch_data
+
+    def fetch_and_check_the_lock(movie_name, cache=None):
+        locked_while_fetching.append(any(held.depth for held in file_lock._held_locks.values()))
+        return fetch_data(movie_name, cache=cache)
+
+    monkeypatch.setattr(MovieApp, 'fetch_data', staticmethod(fetch_and_check_the_lock))
+    with StubOmdbServer():
+        exit_code = movie_cli.main(['--storage', file_path, '--omdb-cache', str(tmp_path / 'cache.db'),
+                                    'add', 'Casablanca', 'Unknown Movie', 'Psycho', '--format', 'json'])
+
+    assert exit_code == 1
+    assert locked_while_fetching == [False, False, False]
+    result = json.loads(capsys.readouterr().out)
+    assert [movie['title'] for movie in result['added']] == ['Casablanca', 'Psycho']
+    assert result['failed'] == ['Unknown Movie']
+    with open(file_path, encoding='utf-8') as file:
+        assert list(json.load(file)) == ['Casablanca', 'Psycho']
+
+
+def test_adding_a_stored_movie_again_keeps_the_json_output_clean(tmp_path, capsys):
+    file_path = str(tmp_path / 'movies.json')
+    arguments = ['--storage', file_path, '--omdb-cache', str(tmp_path / 'cache.db'), 'add']
+    with StubOmdbServer():
+        assert movie_cli.main(arguments + ['Psycho']) == 0
+        capsys.readouterr()
+        exit_code = movie_cli.main(arguments + ['Psycho', 'Casablanca', 'casablanca', '--format', 'json'])
+
+    assert exit_code == 0
+    captured = capsys.readouterr()
+    result = json.loads(captured.out)
+    assert [movie['title'] for movie in result['added']] == ['Casablanca']
+    assert [movie['title'] for movie in result['already_stored']] == ['Psycho', 'Casablanca']
+    assert result['failed'] == []
+    assert 'already there' in captured.err
+    with open(file_path, encoding='utf-8') as file:
+        assert list(json.load(file)) == ['Psycho', 'Casablanca']
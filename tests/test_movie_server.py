@@ -0,0 +1,70 @@
+import asyncio
+import json
+from urllib.parse import quote
+
+import pytest
+
+from movie_cli import open_file_storage
+from movie_server import MovieServer
+
+
+async def get(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, body = response.split(b'\r\n\r\n', 1)
+    return int(head.split(b' ')[1]), json.loads(body)
+
+
+@pytest.mark.parametrize('file_name', ['movies.json', 'movies.csv', 'movies.snap', 'movies.db'])
+def test_a_movie_is_found_by_its_title(tmp_path, file_name):
+    file_path = str(tmp_path / file_name)
+    storage = open_file_storage(file_path)
+    storage.add_movies([('Casablanca', '1942', '8.5', ''), ('Psycho', '1960', '8.5', '')])
+    if hasattr(storage, 'close'):
+        storage.close()
+
+    async def run():
+        server = MovieServer(file_path)
+        listening = await server.start('127.0.0.1', 0)
+        port = listening.sockets[0].getsockname()[1]
+        try:
+            return [await get(port, path) for path in ('/movies/casablanca', '/movies/Psycho', '/movies/Vertigo')]
+        finally:
+            await server.close()
+
+    found_lower, found, missing = asyncio.run(run())
+    assert found_lower == (200, {'title': 'Casablanca', 'year': '1942', 'rating': '8.5', 'poster_url': ''})
+    assert found[0] == 200 and found[1]['title'] == 'Psycho'
+    assert missing == (404, {'error': "Movie not found"})
+
+
+@pytest.mark.parametrize('file_name', ['movies.json', 'movies.db'])
+def test_a_cursor_of_the_wrong_type_is_a_bad_request(tmp_path, file_name):
+    file_path = str(tmp_path / file_name)
+    storage = open_file_storage(file_path)
+    storage.add_movies([('Casablanca', '1942', '8.5', ''), ('Psycho', '1960', '8.5', ''),
+                        ('Vertigo', '1958', '8.3', '')])
+    if hasattr(storage, 'close'):
+        storage.close()
+    bad_cursors = [('rating', '["8.5", "Psycho"]'), ('year', '[true, "Psycho"]'), ('year', '[1960, 1960]'),
+                   ('year', f'[{2 ** 64}, "Psycho"]'), ('title', '[1, "Psycho"]'), ('title', '{"a": 1}')]
+
+    async def run():
+        server = MovieServer(file_path)
+        listening = await server.start('127.0.0.1', 0)
+        port = listening.sockets[0].getsockname()[1]
+        try:
+            first = await get(port, '/movies?sort=rating&limit=2')
+            second = await get(port, f"/movies?sort=rating&limit=2&cursor={quote(first[1]['next_cursor'])}")
+            bad = [await get(port, f"/movies?sort={sort}&cursor={quote(cursor)}") for sort, cursor in bad_cursors]
+            return first, second, bad
+        finally:
+            await server.close()
+
+    first, second, bad = asyncio.run(run())
+    assert [movie['title'] for movie in first[1]['movies']] == ['Vertigo', 'Casablanca']
+    assert [movie['title'] for movie in second[1]['movies']] == ['Psycho']
+    assert bad == [(400, {'error': "cursor must be the next_cursor of the previous page"})] * len(bad_cursors)
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from movies_web_generator import generate_website
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_movies(count):
+    return {f"Movie {number}": {'year': str(2000 + number), 'rating': '7.0', 'poster_url': 'N/A'}
+            for number in range(1, count + 1)}
+
+
+@pytest.fixture
+def output_path(tmp_path, monkeypatch):
+    # The template is read from _static in the project folder
+    monkeypatch.chdir(ROOT)
+    return str(tmp_path / 'movies.html')
+
+
+def page(output_path, number):
+    return output_path.replace('.html', f'-{number}.html')
+
+
+def read(path):
+    with open(path, encoding='utf-8') as file:
+        return file.read()
+
+
+def test_a_single_page_holds_all_the_movies(output_path):
+    assert generate_website(make_movies(3), output_path, 'My Movies') == [output_path]
+    html = read(output_path)
+    assert 'My Movies' in html
+    assert all(f"Movie {number}" in html for number in (1, 2, 3))
+
+
+def test_the_movies_are_split_into_pages_with_an_index(output_path):
+    written = generate_website(make_movies(5), output_path, 'My Movies', per_page=2)
+
+    assert written == [page(output_path, 1), page(output_path, 2), page(output_path, 3), output_path]
+    index = read(output_path)
+    assert 'href="movies-2.html">Page 2: Movie 3 - Movie 4</a>' in index
+    assert 'Movie 5' in read(page(output_path, 3)) and 'Movie 1' not in read(page(output_path, 3))
+    assert '(page 2 of 3)' in read(page(output_path, 2))
+    assert 'href="movies-3.html">next</a>' in read(page(output_path, 2))
+
+
+def test_only_the_changed_pages_are_written_again(output_path):
+    movies = make_movies(5)
+    generate_website(movies, output_path, 'My Movies', per_page=2, incremental=True)
+    assert generate_website(movies, output_path, 'My Movies', per_page=2, incremental=True) == []
+
+    movies['Movie 3']['rating'] = '9.0'
+    assert generate_website(movies, output_path, 'My Movies', per_page=2, incremental=True) == [page(output_path, 2)]
+    assert '9.0' in read(page(output_path, 2))
+
+    # A page that is gone is written again, even if its movies didn't change
+    os.remove(page(output_path, 1))
+    assert generate_website(movies, output_path, 'My Movies', per_page=2, incremental=True) == [page(output_path, 1)]
+
+
+def test_the_pages_left_over_from_more_movies_are_removed(output_path):
+    generate_website(make_movies(5), output_path, 'My Movies', per_page=2, incremental=True)
+    written = generate_website(make_movies(3), output_path, 'My Movies', per_page=2, incremental=True)
+
+    assert not os.path.exists(page(output_path, 3))
+    # The navigation of the pages and the index changed too
+    assert written == [page(output_path, 1), page(output_path, 2), output_path]
+    assert 'movies-3.html' not in read(output_path)
+
+
+def test_a_change_of_title_rewrites_the_page_and_the_index(output_path):
+    movies = make_movies(4)
+    generate_website(movies, output_path, 'My Movies', per_page=2, incremental=True)
+    movies['Movie 5'] = movies.pop('Movie 4')
+
+    written = generate_website(movies, output_path, 'My Movies', per_page=2, incremental=True)
+    assert written == [page(output_path, 2), output_path]
+    assert 'Page 2: Movie 3 - Movie 5' in read(output_path)
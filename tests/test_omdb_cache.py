@@ -0,0 +1,86 @@
+import pytest
+
+import omdb_cache
+from omdb_cache import OmdbCache
+
+FOUND = {'Response': 'True', 'Title': 'Psycho', 'Year': '1960'}
+NOT_FOUND = {'Response': 'False', 'Error': 'Movie not found!'}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(omdb_cache.time, 'time', clock.time)
+    return clock
+
+
+def make_cache(tmp_path, **options):
+    return OmdbCache(str(tmp_path / 'cache.db'), **options)
+
+
+def test_a_response_is_cached_by_normalized_title(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    assert cache.get('Psycho') is None
+    cache.put('Psycho', FOUND)
+
+    assert cache.get('  psycho ') == FOUND
+    assert cache.stats() == {'entries': 1, 'max_entries': omdb_cache.DEFAULT_MAX_ENTRIES,
+                             'hits': 1, 'misses': 1, 'hit_rate': 0.5}
+
+
+def test_a_response_expires_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=100, negative_ttl=10)
+    cache.put('Psycho', FOUND)
+    clock.now += 99
+    assert cache.get('Psycho') == FOUND
+    clock.now += 1
+    assert cache.get('Psycho') is None
+
+
+def test_a_not_found_response_expires_after_the_negative_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=100, negative_ttl=10)
+    cache.put('Unknown Movie', NOT_FOUND)
+    clock.now += 9
+    assert cache.get('Unknown Movie') == NOT_FOUND
+    clock.now += 1
+    assert cache.get('Unknown Movie') is None
+
+
+def test_the_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2)
+    cache.put('Psycho', FOUND)
+    clock.now += 1
+    cache.put('Casablanca', FOUND)
+    clock.now += 1
+    # Using Psycho makes Casablanca the least recently used
+    assert cache.get('Psycho') == FOUND
+    clock.now += 1
+    cache.put('Metropolis', FOUND)
+
+    assert cache.stats()['entries'] == 2
+    assert cache.get('Casablanca') is None
+    assert cache.get('Psycho') == FOUND
+    assert cache.get('Metropolis') == FOUND
+
+
+def test_the_expired_entries_are_removed_when_a_response_is_cached(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl=100, negative_ttl=10)
+    cache.put('Unknown Movie', NOT_FOUND)
+    clock.now += 10
+    cache.put('Psycho', FOUND)
+    assert cache.stats()['entries'] == 1
+
+
+def test_the_cache_is_kept_in_its_file(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put('Psycho', FOUND)
+    cache.close()
+    assert make_cache(tmp_path).get('psycho') == FOUND
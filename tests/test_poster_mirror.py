@@ -0,0 +1,105 @@
+import io
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from movies_web_generator import generate_movie_info
+from poster_mirror import PosterMirror
+
+
+def poster_bytes(size=(300, 444), color=(200, 30, 30)):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, 'JPEG')
+    return output.getvalue()
+
+
+POSTER = poster_bytes()
+OTHER_POSTER = poster_bytes(color=(30, 30, 200))
+
+
+class _PosterHandler(BaseHTTPRequestHandler):
+    """
+    Serves the same poster under /poster.jpg and /same-poster.jpg, another one under /other.jpg
+    and a 404 for anything else, counting the requests per path.
+    """
+    files = {'/poster.jpg': POSTER, '/same-poster.jpg': POSTER, '/other.jpg': OTHER_POSTER}
+
+    def do_GET(self):
+        with self.server.counter_lock:
+            self.server.requests[self.path] = self.server.requests.get(self.path, 0) + 1
+        content = self.files.get(self.path)
+        self.send_response(200 if content else 404)
+        self.send_header('Content-Length', str(len(content or b'')))
+        self.end_headers()
+        self.wfile.write(content or b'')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _PosterHandler)
+    server.requests = {}
+    server.counter_lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_a_poster_in_the_manifest_is_not_downloaded_again(tmp_path, server):
+    url = server.url + '/poster.jpg'
+    first = PosterMirror(str(tmp_path)).mirror([url])
+    second = PosterMirror(str(tmp_path)).mirror([url])
+
+    assert second == first
+    assert server.requests == {'/poster.jpg': 1}
+
+
+def test_a_poster_whose_files_are_gone_is_downloaded_again(tmp_path, server):
+    url = server.url + '/poster.jpg'
+    entry = PosterMirror(str(tmp_path)).mirror([url])[url]
+    os.remove(tmp_path / entry['thumbnail'])
+    PosterMirror(str(tmp_path)).mirror([url])
+
+    assert server.requests == {'/poster.jpg': 2}
+    assert (tmp_path / entry['thumbnail']).exists()
+
+
+def test_the_same_poster_behind_two_urls_is_stored_once(tmp_path, server):
+    urls = [server.url + path for path in ('/poster.jpg', '/same-poster.jpg', '/other.jpg')]
+    mirrored = PosterMirror(str(tmp_path)).mirror(urls)
+
+    assert mirrored[urls[0]] == mirrored[urls[1]]
+    assert mirrored[urls[0]]['file'] != mirrored[urls[2]]['file']
+    posters = [name for name in os.listdir(tmp_path) if name != 'manifest.json' and '-thumb' not in name]
+    assert sorted(posters) == sorted({entry['file'] for entry in mirrored.values()})
+
+
+def test_a_failed_download_keeps_the_remote_url(tmp_path, server, capsys):
+    urls = [server.url + '/poster.jpg', server.url + '/missing.jpg']
+    posters = PosterMirror(str(tmp_path)).local_posters(urls, str(tmp_path))
+
+    assert list(posters) == [urls[0]]
+    assert 'Could not download the poster' in capsys.readouterr().out
+    html = generate_movie_info('Psycho', {'year': '1960', 'rating': '8.5', 'poster_url': urls[1]},
+                               posters.get(urls[1]))
+    assert f'src="{urls[1]}"' in html
+
+
+@pytest.mark.parametrize('thumbnail_size, expected', [((150, 222), (150, 222)), ((100, 100), (68, 100))])
+def test_the_thumbnails_fit_in_the_thumbnail_size(tmp_path, server, thumbnail_size, expected):
+    url = server.url + '/poster.jpg'
+    entry = PosterMirror(str(tmp_path), thumbnail_size=thumbnail_size).mirror([url])[url]
+
+    assert (entry['width'], entry['height']) == expected
+    with Image.open(tmp_path / entry['thumbnail']) as thumbnail:
+        assert thumbnail.size == expected
+    with Image.open(tmp_path / entry['file']) as poster:
+        assert poster.size == (300, 444)
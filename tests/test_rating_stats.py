@@ -0,0 +1,82 @@
+import pytest
+
+from rating_stats import RatingStats, parse_rating, percentile, summarize_ratings
+
+MOVIES = {
+    'Psycho': {'rating': '8.5/10'},
+    'Casablanca': {'rating': '8.5'},
+    'Sin City': {'rating': '8,0'},
+    'Metropolis': {'rating': '7.0/10'},
+    'Following': {'rating': '6.5'},
+    'The Aerial': {'rating': 'N/A'},
+}
+
+
+@pytest.mark.parametrize('rating, expected', [('7.3/10', 7.3), ('8', 8.0), ('6,5', 6.5), (7.5, 7.5),
+                                              ('N/A', None), ('', None), (None, None)])
+def test_ratings_are_parsed(rating, expected):
+    assert parse_rating(rating) == expected
+
+
+def test_percentiles_interpolate_between_the_closest_values():
+    values = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 0) == 1.0
+    assert percentile(values, 100) == 4.0
+    assert percentile([5.0], 90) == 5.0
+
+
+def test_the_statistics_of_the_movies():
+    stats = RatingStats.from_movies(MOVIES).summary()
+    assert stats['average'] == pytest.approx((8.5 + 8.5 + 8.0 + 7.0 + 6.5) / 5)
+    assert stats['median'] == 8.0
+    assert stats['best_rating'] == 8.5
+    assert stats['best_movies'] == ['Psycho', 'Casablanca']
+    assert stats['worst_rating'] == 6.5
+    assert stats['worst_movies'] == ['Following']
+    assert stats['percentiles'] == {25: 7.0, 75: 8.5, 90: 8.5}
+    assert stats['histogram'] == {6: 1, 7: 1, 8: 3}
+    assert stats['skipped'] == ['N/A']
+
+
+def test_summarize_ratings_matches_the_sorted_statistics():
+    expected = RatingStats.from_movies(MOVIES).summary()
+    stats = summarize_ratings((title, details['rating']) for title, details in MOVIES.items())
+    assert stats.pop('average') == pytest.approx(expected.pop('average'))
+    assert stats == expected
+
+
+def test_summarize_ratings_without_movies_or_valid_ratings():
+    assert summarize_ratings([]) is None
+    stats = summarize_ratings([('The Aerial', 'N/A')])
+    assert stats['average'] is None and stats['histogram'] == {} and stats['skipped'] == ['N/A']
+
+
+def test_adding_and_removing_movies_keeps_the_statistics_up_to_date():
+    stats = RatingStats()
+    for title, details in MOVIES.items():
+        stats.add(title, details['rating'])
+    stats.add('Eraserhead', '9.5')
+    # Replacing a rating, and removing a movie with an invalid rating and one with a valid one
+    stats.add('Metropolis', '5.0')
+    stats.remove('The Aerial')
+    stats.remove('Psycho')
+    stats.remove('Vertigo')
+
+    movies = dict(MOVIES, Eraserhead={'rating': '9.5'}, Metropolis={'rating': '5.0'})
+    del movies['The Aerial'], movies['Psycho']
+    expected = RatingStats.from_movies(movies).summary()
+    summary = stats.summary()
+    assert summary.pop('average') == pytest.approx(expected.pop('average'))
+    assert summary == expected
+    assert stats.rating_of('Metropolis') == 5.0
+    assert stats.rating_of('Psycho') is None
+
+
+def test_removing_all_movies_empties_the_statistics():
+    stats = RatingStats.from_movies(MOVIES)
+    for title in MOVIES:
+        stats.remove(title)
+    assert stats.summary()['average'] is None
+    assert stats.summary()['best_movies'] == []
+    assert stats.histogram() == {}
@@ -0,0 +1,59 @@
+import json
+
+from benchmark import StubOmdbServer
+from refresh_worker import RefreshWorker
+from storage_json import StorageJson
+
+INCOMPLETE = {'year': 'N/A', 'rating': 'N/A', 'poster_url': 'N/A'}
+
+
+def make_storage(tmp_path):
+    storage = StorageJson(str(tmp_path / 'movies.json'))
+    storage.save_movies({'Unknown A': dict(INCOMPLETE), 'Casablanca': dict(INCOMPLETE)})
+    return storage
+
+
+def make_worker(storage, **options):
+    return RefreshWorker(storage, max_workers=1, requests_per_second=0, batch_size=1, **options)
+
+
+def test_a_movie_omdb_doesnt_know_is_checkpointed_and_the_others_refreshed(tmp_path):
+    storage = make_storage(tmp_path)
+    with StubOmdbServer():
+        summary = make_worker(storage).run()
+        again = make_worker(storage).run()
+
+    assert summary == {'due': 2, 'updated': 1, 'unchanged': 0, 'not_found': 1, 'failed': 0}
+    assert storage.load_movies()['Casablanca']['rating'] != 'N/A'
+    assert storage.load_movies()['Unknown A'] == INCOMPLETE
+    # Asked for again only after retry_after
+    assert again['due'] == 0
+    with open(str(tmp_path / 'movies.json.refresh.json'), encoding='utf-8') as file:
+        checkpoint = json.load(file)['movies']
+    assert checkpoint['Unknown A']['complete'] is False
+    assert checkpoint['Casablanca']['complete'] is True
+
+
+def test_the_movies_that_failed_are_fetched_by_the_next_run(tmp_path, capsys):
+    storage = make_storage(tmp_path)
+    with StubOmdbServer(error_every=1):
+        summary = make_worker(storage, retries=0).run()
+    assert summary == {'due': 2, 'updated': 0, 'unchanged': 0, 'not_found': 0, 'failed': 1}
+    assert "stopping, try again later" in capsys.readouterr().out
+    assert storage.load_movies()['Casablanca'] == INCOMPLETE
+
+    with StubOmdbServer():
+        summary = make_worker(storage, retries=0).run()
+    assert summary == {'due': 2, 'updated': 1, 'unchanged': 0, 'not_found': 1, 'failed': 0}
+
+
+def test_a_run_continues_where_the_stopped_one_ended(tmp_path):
+    storage = make_storage(tmp_path)
+    with StubOmdbServer() as server:
+        # Stops before the second batch
+        first = make_worker(storage).run(should_stop=lambda: server.requests >= 1)
+        second = make_worker(storage).run()
+
+    assert first['not_found'] + first['updated'] == 1
+    assert second['due'] == 1
+    assert second['not_found'] + second['updated'] == 1
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import pickle
+
+from search_index import SearchIndex, SearchableStorage
+from storage_json import StorageJson
+
+MOVIES = {
+    "The Man Who Wasn't There": {'year': 2001, 'rating': 7.5, 'poster_url': '', 'note': ''},
+    'To Kill a Mockingbird': {'year': 1962, 'rating': 8.2, 'poster_url': '', 'note': 'a classic'},
+    'Following': {'year': 1998, 'rating': 7.5, 'poster_url': '', 'note': ''},
+    'Psycho': {'year': 1960, 'rating': 8.5, 'poster_url': '', 'note': 'shower scene'},
+    'Casablanca': {'year': 1942, 'rating': 8.5, 'poster_url': '', 'note': ''},
+}
+
+
+def titles(results):
+    return [title for title, _ in results]
+
+
+def test_titles_containing_the_query_are_always_found():
+    index = SearchIndex.from_movies(MOVIES)
+    for query in ('her', 'ing', 'ck', 'a', "n't th", 'CASA'):
+        expected = {title for title in MOVIES if query.casefold() in title.casefold()}
+        assert expected and expected <= set(titles(index.search(query, limit=None))), query
+
+
+def test_titles_containing_the_query_come_before_fuzzy_matches():
+    index = SearchIndex.from_movies(MOVIES)
+    results = titles(index.search('ing', limit=None))
+    assert set(results[:2]) == {'Following', 'To Kill a Mockingbird'}
+
+
+def test_typos_and_notes_are_found():
+    index = SearchIndex.from_movies(MOVIES)
+    assert titles(index.search('mockingbrd')) == ['To Kill a Mockingbird']
+    assert titles(index.search('shower')) == ['Psycho']
+    assert index.search('zebra') == []
+
+
+def test_removed_movies_are_not_found():
+    index = SearchIndex.from_movies(MOVIES)
+    index.remove('Psycho')
+    assert index.search('psycho') == []
+    assert index.search('ps') == []
+
+
+def test_a_saved_index_is_loaded_for_the_same_signature(tmp_path):
+    file_path = str(tmp_path / 'movies.json.search')
+    SearchIndex.from_movies(MOVIES).save(file_path, ((1, 2, 3), None))
+
+    index = SearchIndex.load(file_path, ((1, 2, 3), None))
+    assert titles(index.search('mockingbrd')) == ['To Kill a Mockingbird']
+    assert SearchIndex.load(file_path, ((1, 2, 4), None)) is None
+
+
+class MakeFolder:
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return os.mkdir, (self.path,)
+
+
+def test_loading_an_index_file_never_runs_code(tmp_path):
+    file_path = tmp_path / 'movies.json.search'
+    file_path.write_bytes(pickle.dumps({'version': 1, 'documents': MakeFolder(str(tmp_path / 'hacked'))}))
+
+    assert SearchIndex.load(str(file_path), None) is None
+    assert not (tmp_path / 'hacked').exists()
+
+
+def test_searchable_storage_finds_added_movies(tmp_path):
+    file_path = str(tmp_path / 'movies.json')
+    StorageJson(file_path).save_movies(MOVIES)
+    storage = SearchableStorage(StorageJson(file_path))
+    storage.add_movie('Zebra Crossing', 2020, 6.0, '')
+    assert titles(storage.search_movies('zebra')) == ['Zebra Crossing']
+    storage.close()
+
+    reopened = SearchableStorage(StorageJson(file_path))
+    assert titles(reopened.search_movies('Zebra Crossing')) == ['Zebra Crossing']
+
+
+def add_other_movie(file_path):
+    StorageJson(file_path).add_movie('Other Movie', 2000, 5.0, '')
+
+
+class StorageJsonWithOtherWriter(StorageJson):
+    """
+    Another process tries to add a movie right after each movie this storage adds.
+    """
+
+    def add_movie(self, title, year, rating, poster_url):
+        super().add_movie(title, year, rating, poster_url)
+        writer = multiprocessing.get_context('spawn').Process(target=add_other_movie, args=(self.file_path,))
+        writer.start()
+        # Gives the other process (started from scratch, not holding our lock) the time to write,
+        # unless it waits for the lock
+        writer.join(timeout=0.5)
+        self.writers.append(writer)
+
+
+def test_a_change_by_another_process_is_not_taken_for_an_indexed_one(tmp_path):
+    file_path = str(tmp_path / 'movies.json')
+    StorageJson(file_path).save_movies(MOVIES)
+    inner = StorageJsonWithOtherWriter(file_path)
+    inner.writers = []
+    storage = SearchableStorage(inner)
+    storage.add_movie('Zebra Crossing', 2020, 6.0, '')
+    for writer in inner.writers:
+        writer.join()
+    storage.close()
+
+    reopened = SearchableStorage(StorageJson(file_path))
+    assert titles(reopened.search_movies('Zebra Crossing')) == ['Zebra Crossing']
+    assert titles(reopened.search_movies('Other Movie')) == ['Other Movie']
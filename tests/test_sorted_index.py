@@ -0,0 +1,92 @@
+import pytest
+
+from sorted_index import SortedIndex, parse_year, sort_value
+
+MOVIES = {
+    'Psycho': {'year': '1960', 'rating': '8.5'},
+    'casablanca': {'year': '1942', 'rating': '8.5'},
+    'Sin City': {'year': '2005', 'rating': '8.0'},
+    'Metropolis': {'year': '1927', 'rating': '8.3'},
+    'Following': {'year': '1998', 'rating': 'N/A'},
+    'Twin Peaks': {'year': '1990–1991', 'rating': '8.8'},
+    'The Aerial': {'year': 'N/A', 'rating': '6.0'},
+}
+
+
+def walk(index, limit, descending=False):
+    """
+    Return all the titles of an index, a page at a time, and the number of pages.
+    """
+    titles, cursor = index.page(limit, descending=descending)
+    pages = 1
+    while cursor is not None:
+        page, cursor = index.page(limit, cursor, descending)
+        titles += page
+        pages += 1
+    return titles, pages
+
+
+def test_values_to_sort_by():
+    assert parse_year('2005–2010') == 2005
+    assert parse_year('N/A') is None
+    assert sort_value('title', 'Psycho', {}) == 'psycho'
+    assert sort_value('rating', 'Psycho', {'rating': '7.5/10'}) == 7.5
+    with pytest.raises(ValueError):
+        sort_value('poster_url', 'Psycho', {})
+
+
+@pytest.mark.parametrize('by, expected', [
+    ('rating', ['The Aerial', 'Sin City', 'Metropolis', 'Psycho', 'casablanca', 'Twin Peaks']),
+    ('year', ['Metropolis', 'casablanca', 'Psycho', 'Twin Peaks', 'Following', 'Sin City']),
+    ('title', ['casablanca', 'Following', 'Metropolis', 'Psycho', 'Sin City', 'The Aerial', 'Twin Peaks']),
+])
+@pytest.mark.parametrize('limit', [1, 2, 3, 100])
+def test_a_cursor_walk_returns_every_movie_once_in_order(by, expected, limit):
+    index = SortedIndex.from_movies(by, MOVIES)
+    titles, pages = walk(index, limit)
+    assert titles == expected
+    assert pages == max(1, -(-len(expected) // limit))
+    assert walk(index, limit, descending=True)[0] == expected[::-1]
+
+
+def test_movies_with_the_same_value_are_ordered_by_title():
+    index = SortedIndex.from_movies('rating', MOVIES)
+    # 'Psycho' < 'casablanca' as plain strings, both are rated 8.5
+    first, cursor = index.page(4)
+    assert first[-1] == 'Psycho' and cursor == (8.5, 'Psycho')
+    assert index.page(1, cursor) == (['casablanca'], (8.5, 'casablanca'))
+    assert index.page(10, cursor, descending=True) == (['Metropolis', 'Sin City', 'The Aerial'], None)
+
+
+def test_the_top_movies():
+    index = SortedIndex.from_movies('rating', MOVIES)
+    assert index.top(3) == ['Twin Peaks', 'casablanca', 'Psycho']
+    assert index.top(100)[-1] == 'The Aerial'
+    assert index.top(0) == []
+
+
+@pytest.mark.parametrize('by, low, high, expected', [
+    ('year', 1942, 1990, ['casablanca', 'Psycho', 'Twin Peaks']),
+    ('year', None, 1942, ['Metropolis', 'casablanca']),
+    ('year', 1999, None, ['Sin City']),
+    ('year', 2006, 2010, []),
+    ('rating', 8.5, 8.5, ['Psycho', 'casablanca']),
+    ('rating', 8.0, 8.49, ['Sin City', 'Metropolis']),
+    ('title', 'p', 'sin city', ['Psycho', 'Sin City']),
+    ('year', None, None, ['Metropolis', 'casablanca', 'Psycho', 'Twin Peaks', 'Following', 'Sin City']),
+])
+def test_ranges_include_their_bounds(by, low, high, expected):
+    assert SortedIndex.from_movies(by, MOVIES).in_range(low, high) == expected
+
+
+def test_adding_and_removing_movies_keeps_the_index_sorted():
+    index = SortedIndex.from_movies('rating', MOVIES)
+    index.add('Eraserhead', {'rating': '7.4'})
+    index.add('Vertigo', {'rating': 'N/A'})
+    index.remove('Psycho', MOVIES['Psycho'])
+    index.remove('Following', MOVIES['Following'])
+
+    movies = dict(MOVIES, Eraserhead={'rating': '7.4'}, Vertigo={'rating': 'N/A'})
+    del movies['Psycho']
+    assert walk(index, 2)[0] == walk(SortedIndex.from_movies('rating', movies), 2)[0]
+    assert len(index) == 6
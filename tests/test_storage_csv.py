@@ -0,0 +1,54 @@
+from storage_csv import StorageCsv
+
+
+def make_storage(tmp_path, count):
+    storage = StorageCsv(str(tmp_path / 'movies.csv'))
+    storage.save_movies({f"Movie {number}": {'year': '2000', 'rating': 'N/A', 'poster_url': ''}
+                         for number in range(count)})
+    return storage
+
+
+def count_scans(storage, monkeypatch):
+    scans = []
+    iter_movies = storage.iter_movies
+
+    def counting_iter_movies(filter=None):
+        scans.append(filter)
+        return iter_movies(filter)
+
+    monkeypatch.setattr(storage, 'iter_movies', counting_iter_movies)
+    return scans
+
+
+def test_a_batch_reads_the_file_once_to_find_its_movies(tmp_path, monkeypatch):
+    storage = make_storage(tmp_path, 2000)
+    scans = count_scans(storage, monkeypatch)
+
+    with storage.batch():
+        refreshed = [storage.refresh_movie(f"movie {number}", '2001', '7.0', '') for number in range(0, 2000, 20)]
+        missing = storage.refresh_movie('Vertigo', '1958', '8.3', '')
+
+    assert all(refreshed) and not missing
+    # One pass to find the movies, one to copy the file with the changes
+    assert len(scans) == 2
+    movies = storage.load_movies()
+    assert movies['Movie 20'] == {'year': '2001', 'rating': '7.0', 'poster_url': ''}
+    assert movies['Movie 21']['rating'] == 'N/A'
+    assert 'Vertigo' not in movies
+
+
+def test_a_batch_counts_its_own_additions_and_deletions(tmp_path):
+    storage = make_storage(tmp_path, 3)
+
+    with storage.batch():
+        assert storage.delete_movie('Movie 0')
+        assert not storage.delete_movie('movie 0')
+        assert not storage.update_movie('Movie 0', 'gone')
+        storage.add_movie('Vertigo', '1958', '8.3', '')
+        assert storage.update_movie('vertigo', 'tower')
+        assert storage.refresh_movie('Movie 1', '1999', '6.0', '')
+
+    movies = storage.load_movies()
+    assert list(movies) == ['Movie 1', 'Movie 2', 'Vertigo']
+    assert movies['Vertigo']['note'] == 'tower'
+    assert movies['Movie 1']['rating'] == '6.0'
@@ -0,0 +1,31 @@
+import mmap
+
+import atomic_file
+import storage_snapshot
+from search_index import SearchableStorage
+from storage_snapshot import StorageSnapshot
+
+
+def test_the_snapshot_is_unmapped_before_it_is_replaced_where_windows_requires_it(tmp_path, monkeypatch):
+    file_path = str(tmp_path / 'movies.snap')
+    storage = SearchableStorage(StorageSnapshot(file_path))
+    storage.add_movies([('Casablanca', '1942', '8.5', ''), ('Psycho', '1960', '8.5', '')])
+    mapped = storage._storage._get_reader()._data
+    assert isinstance(mapped, mmap.mmap)
+
+    monkeypatch.setattr(storage_snapshot, 'CAN_REPLACE_MAPPED_FILE', False)
+    replace = atomic_file.os.replace
+
+    def replace_like_windows(source, target):
+        # Windows refuses to replace a file that is still mapped
+        assert mapped.closed
+        replace(source, target)
+
+    monkeypatch.setattr(atomic_file.os, 'replace', replace_like_windows)
+    # Saving goes on reading the movies loaded from the old snapshot, and indexes them after
+    storage.add_movie('Vertigo', '1958', '8.3', '')
+    storage.delete_movie('psycho')
+
+    assert sorted(storage.load_movies()) == ['Casablanca', 'Vertigo']
+    assert [title for title, _ in storage.search_movies('vertgo')] == ['Vertigo']
+    assert StorageSnapshot(file_path).get_movie('casablanca') == ('Casablanca', {'year': '1942', 'rating': '8.5', 'poster_url': ''})
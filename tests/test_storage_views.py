@@ -0,0 +1,73 @@
+import pytest
+
+from benchmark import synthetic_movies
+from movie_cli import open_file_storage, open_storage
+from rating_stats import RatingStats
+from sorted_index import SORT_FIELDS, SortedIndex
+
+# The JSON, CSV, snapshot and SQLite storages, and the JSON storage as the app opens it (cached and indexed)
+STORAGES = [('movies.json', open_file_storage), ('movies.csv', open_file_storage),
+            ('movies.snap', open_file_storage), ('movies.db', open_file_storage),
+            ('app.json', open_storage)]
+
+MOVIES = dict(synthetic_movies(400))
+# Movies with the same rating and year, year ranges and a lowercase title
+MOVIES.update({
+    'Twin Peaks': {'year': '1990–1991', 'rating': '8.8/10', 'poster_url': 'N/A'},
+    'Twin Peaks 2': {'year': '1990', 'rating': '8.8/10', 'poster_url': 'N/A'},
+    'twin peaks 3': {'year': '1990', 'rating': '8.8/10', 'poster_url': 'N/A'},
+    'No Year': {'year': 'N/A', 'rating': '5.0/10', 'poster_url': 'N/A'},
+})
+
+RANGES = {'year': [(1950, 1959), (None, 1930), (2020, None), (1990, 1990), (2030, 2040)],
+          'rating': [(8.8, 8.8), (None, 2.0), (9.5, None), (5.0, 5.5)],
+          'title': [('a', 'c'), ('twin', 'twin peaks 3'), (None, 'b')]}
+
+
+@pytest.fixture(scope='module', params=STORAGES, ids=[file_name for file_name, _ in STORAGES])
+def storage(request, tmp_path_factory):
+    file_name, open_function = request.param
+    storage = open_function(str(tmp_path_factory.mktemp('views') / file_name))
+    storage.save_movies(MOVIES)
+    yield storage
+    if hasattr(storage, 'close'):
+        storage.close()
+
+
+def titles(movies):
+    return [title for title, _ in movies]
+
+
+def test_the_statistics_are_the_same(storage):
+    expected = RatingStats.from_movies(MOVIES).summary()
+    stats = storage.movie_statistics()
+    # The average is summed in another order by some storages
+    assert stats.pop('average') == pytest.approx(expected.pop('average'))
+    assert stats == expected
+
+
+@pytest.mark.parametrize('by', SORT_FIELDS)
+def test_the_top_movies_are_the_same(storage, by):
+    expected = SortedIndex.from_movies(by, MOVIES).top(25)
+    assert titles(storage.top_movies(25, by)) == expected
+
+
+@pytest.mark.parametrize('by', SORT_FIELDS)
+@pytest.mark.parametrize('descending', [False, True])
+def test_a_full_cursor_walk_is_the_same(storage, by, descending):
+    expected = SortedIndex.from_movies(by, MOVIES).in_range()
+    if descending:
+        expected.reverse()
+    walked = []
+    page, cursor = storage.movies_page(by, limit=30, descending=descending)
+    walked += titles(page)
+    while cursor is not None:
+        page, cursor = storage.movies_page(by, limit=30, cursor=cursor, descending=descending)
+        walked += titles(page)
+    assert walked == expected
+
+
+@pytest.mark.parametrize('by, low, high', [(by, low, high) for by, ranges in RANGES.items() for low, high in ranges])
+def test_the_ranges_are_the_same(storage, by, low, high):
+    expected = SortedIndex.from_movies(by, MOVIES).in_range(low, high)
+    assert titles(storage.movies_in_range(by, low, high)) == expected
@@ -0,0 +1,46 @@
+import pytest
+
+from movie_cli import open_file_storage, open_storage
+
+FILE_NAMES = ['movies.json', 'movies.csv', 'movies.snap', 'movies.db']
+
+
+@pytest.fixture(params=FILE_NAMES)
+def storage(request, tmp_path):
+    storage = open_file_storage(str(tmp_path / request.param))
+    yield storage
+    if hasattr(storage, 'close'):
+        storage.close()
+
+
+def test_a_movie_is_added_found_and_deleted(storage):
+    storage.add_movie('Casablanca', '1942', '8.5', 'https://example.com/casablanca.jpg')
+    assert dict(storage.load_movies()['Casablanca']) == {
+        'year': '1942', 'rating': '8.5', 'poster_url': 'https://example.com/casablanca.jpg'}
+    assert storage.get_movie('casablanca') == ('Casablanca', storage.load_movies()['Casablanca'])
+    assert storage.get_movie('Casablanca')[0] == 'Casablanca'
+    assert storage.get_movie('Casa') is None
+    assert storage.delete_movie('CASABLANCA')
+    assert storage.load_movies() == {}
+
+
+@pytest.mark.parametrize('file_name', FILE_NAMES)
+def test_every_storage_calls_the_note_note(tmp_path, file_name):
+    storage = open_storage(str(tmp_path / file_name))
+    storage.add_movie('Psycho', '1960', '8.5', '')
+    assert storage.update_movie('psycho', 'shower scene')
+    assert storage.load_movies()['Psycho']['note'] == 'shower scene'
+    assert [details['note'] for _, details in storage.iter_movies()] == ['shower scene']
+    assert storage.search_movies('psych') == [('Psycho', storage.load_movies()['Psycho'])]
+    if hasattr(storage, 'close'):
+        storage.close()
+
+
+@pytest.mark.parametrize('file_name', FILE_NAMES)
+def test_the_app_storages_find_a_movie_by_title(tmp_path, file_name):
+    storage = open_storage(str(tmp_path / file_name))
+    storage.add_movies([('Psycho', '1960', '8.5', ''), ('Casablanca', '1942', '8.5', '')])
+    assert storage.get_movie('PSYCHO')[0] == 'Psycho'
+    assert storage.get_movie('Vertigo') is None
+    if hasattr(storage, 'close'):
+        storage.close()